@@ -0,0 +1,304 @@
+"""Template and step metrics for the analytics dashboards, computed with NumPy.
+
+`load_data` bulk-loads instances, instance steps and status-change times into
+column arrays (timestamps as float seconds since the epoch, statuses as small
+integer codes). Each column comes back from SQLite as one comma-separated
+string that NumPy parses in C, so no Python object is made per row, and the
+metric functions work on whole columns with bincount/ufunc.at/lexsort.
+
+The computed metrics are cached under `data_version_key`: the checklists'
+version counters plus the last status-change event id, which together change
+whenever anything the metrics read does. Unrelated commits (rollups, history)
+leave it alone, and while the database hasn't changed at all (VersionWatcher
+generation) the key isn't even re-read. Overdue counts and throughput depend
+on the clock too, so cached metrics are recomputed after MAX_AGE_SECONDS.
+
+NumPy is optional: without it `available()` is False and the dashboards say so."""
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from fasthtml.common import *
+from monsterui.all import *
+
+from db_connection import DBConnection
+from step_analytics import format_duration
+from versions import watcher
+
+THROUGHPUT_DAYS = 28
+MAX_AGE_SECONDS = 300
+PERCENTILES = (50, 90)
+
+IN_PROGRESS, COMPLETED = 1, 2
+
+_EPOCH = "ROUND((julianday({}) - 2440587.5) * 86400.0, 3)"
+_STATUS = "CASE {} WHEN 'Completed' THEN 2 WHEN 'In Progress' THEN 1 ELSE 0 END"
+
+def available():
+    return np is not None
+
+
+# Loading
+
+def _columns(cursor, query, dtypes, params=()):
+    """Run `query` and return its result as one array per column (NULL -> NaN).
+    SQLite concatenates each column into one string, so only len(dtypes)
+    Python objects cross over, however many rows there are."""
+    names = [f"c{i}" for i in range(len(dtypes))]
+    cursor.execute(f"""
+        WITH q({', '.join(names)}) AS ({query})
+        SELECT {', '.join(f"group_concat(COALESCE({name}, 'nan'), ',')" for name in names)} FROM q
+    """, params)
+    columns = cursor.fetchone()
+    return [np.fromstring(column, sep=',').astype(dtype) if column else np.empty(0, dtype=dtype)
+            for column, dtype in zip(columns, dtypes)]
+
+def load_data():
+    """Column arrays for every instance, instance step and status change"""
+    with DBConnection() as cursor:
+        (inst_id, inst_checklist, inst_created, inst_target,
+         inst_done_steps, inst_total_steps) = _columns(cursor, f"""
+            SELECT id, checklist_id, {_EPOCH.format('created_at')},
+                   {_EPOCH.format("NULLIF(target_date, '')")},
+                   completed_steps, total_steps
+            FROM checklist_instances
+            ORDER BY id
+        """, (np.int64, np.int64, np.float64, np.float64, np.int64, np.int64))
+        step_id, step_instance, step_template_step, step_status = _columns(cursor, f"""
+            SELECT id, instance_id, step_id, {_STATUS.format('status')}
+            FROM instance_steps
+            ORDER BY id
+        """, (np.int64, np.int64, np.int64, np.int8))
+        ev_step, ev_status, ev_done, ev_time = _columns(cursor, f"""
+            SELECT instance_step_id, {_STATUS.format('new_status')}, instance_done,
+                   {_EPOCH.format('created_at')}
+            FROM instance_step_events
+        """, (np.int64, np.int8, np.int8, np.float64))
+        cursor.execute("SELECT id, title FROM checklists")
+        titles = {row['id']: row['title'] for row in cursor.fetchall()}
+    return dict(
+        inst_id=inst_id, inst_checklist=inst_checklist, inst_created=inst_created,
+        inst_target=inst_target, inst_done_steps=inst_done_steps, inst_total_steps=inst_total_steps,
+        step_id=step_id, step_instance=step_instance, step_template_step=step_template_step,
+        step_status=step_status,
+        ev_step=ev_step, ev_status=ev_status, ev_done=ev_done, ev_time=ev_time,
+        titles=titles,
+    )
+
+
+# Metrics
+
+def _index_of(row_ids, ids):
+    """Positions of `ids` in `row_ids`, and a mask of the ones found. Row ids are
+    dense enough that a lookup table beats searchsorted's random access."""
+    if not len(row_ids):
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    lookup = np.full(int(row_ids.max()) + 1, -1, dtype=np.int64)
+    lookup[row_ids] = np.arange(len(row_ids))
+    in_range = (ids >= 0) & (ids < len(lookup))
+    pos = np.where(in_range, lookup[np.where(in_range, ids, 0)], -1)
+    found = pos >= 0
+    return np.where(found, pos, 0), found
+
+def _group_percentiles(keys, values, percentiles=PERCENTILES):
+    """Nearest-rank percentiles of `values` per distinct key:
+    (unique keys, counts, {p: array of values})"""
+    if not len(keys):
+        return keys, np.zeros(0, dtype=np.int64), {p: np.zeros(0) for p in percentiles}
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    unique, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    result = {p: values[starts + np.floor((counts - 1) * p / 100).astype(np.int64)]
+              for p in percentiles}
+    return unique, counts, result
+
+def compute_metrics(data, now=None):
+    """Per-template and per-step metrics from `load_data()` columns"""
+    now = time.time() if now is None else now
+    inst_id, step_instance = data['inst_id'], data['step_instance']
+
+    # Status-change times onto instance steps: first start, last completion
+    started = np.full(len(data['step_id']), np.inf)
+    finished = np.full(len(data['step_id']), -np.inf)
+    ev_pos, ev_found = _index_of(data['step_id'], data['ev_step'])
+    starts = ev_found & (data['ev_status'] == IN_PROGRESS)
+    ends = ev_found & (data['ev_status'] == COMPLETED)
+    np.minimum.at(started, ev_pos[starts], data['ev_time'][starts])
+    np.maximum.at(finished, ev_pos[ends], data['ev_time'][ends])
+
+    # Step durations (from instance creation if the step skipped In Progress)
+    inst_pos, inst_found = _index_of(inst_id, step_instance)
+    created = np.full(len(step_instance), np.nan)
+    created[inst_found] = data['inst_created'][inst_pos[inst_found]]
+    begin = np.where(np.isfinite(started), started, created)
+    timed = inst_found & (data['step_status'] == COMPLETED) & np.isfinite(finished) & np.isfinite(begin)
+    durations = np.maximum(finished[timed] - begin[timed], 0)
+    step_keys, step_counts, step_pcts = _group_percentiles(data['step_template_step'][timed], durations)
+    tmpl_keys, tmpl_counts, tmpl_pcts = _group_percentiles(data['inst_checklist'][inst_pos[timed]], durations)
+
+    # Per template: instances, completions, overdue, throughput, step duration percentiles
+    templates, inst_template = np.unique(data['inst_checklist'], return_inverse=True)
+    n = len(templates)
+    completed = (data['inst_total_steps'] > 0) & (data['inst_done_steps'] >= data['inst_total_steps'])
+    overdue = ~completed & (data['inst_target'] < now)  # NaN target dates compare False
+    # An instance finished when the event that completed its last step happened
+    done_time = np.full(len(inst_id), -np.inf)
+    finishing = ev_found & data['ev_done'].astype(bool)
+    done_pos, done_found = _index_of(inst_id, step_instance[ev_pos[finishing]])
+    np.maximum.at(done_time, done_pos[done_found], data['ev_time'][finishing][done_found])
+    recent = completed & (done_time >= now - THROUGHPUT_DAYS * 86400)
+
+    instances = np.bincount(inst_template, minlength=n)
+    completions = np.bincount(inst_template, weights=completed, minlength=n).astype(np.int64)
+    overdue_counts = np.bincount(inst_template, weights=overdue, minlength=n).astype(np.int64)
+    recent_counts = np.bincount(inst_template, weights=recent, minlength=n)
+
+    template_metrics = {}
+    for i, checklist_id in enumerate(templates.tolist()):
+        template_metrics[checklist_id] = dict(
+            title=data['titles'].get(checklist_id, f"#{checklist_id}"),
+            instances=int(instances[i]),
+            completed=int(completions[i]),
+            completion_rate=float(completions[i] / instances[i]) if instances[i] else 0.0,
+            overdue=int(overdue_counts[i]),
+            throughput_per_week=float(recent_counts[i] * 7 / THROUGHPUT_DAYS),
+            step_samples=0,
+            **{f"p{p}_step_seconds": None for p in PERCENTILES},
+        )
+    for i, checklist_id in enumerate(tmpl_keys.tolist()):
+        if checklist_id in template_metrics:
+            template_metrics[checklist_id]['step_samples'] = int(tmpl_counts[i])
+            for p in PERCENTILES:
+                template_metrics[checklist_id][f"p{p}_step_seconds"] = float(tmpl_pcts[p][i])
+
+    step_metrics = {
+        step: dict(samples=int(step_counts[i]),
+                   **{f"p{p}_seconds": float(step_pcts[p][i]) for p in PERCENTILES})
+        for i, step in enumerate(step_keys.tolist())
+    }
+    return dict(templates=template_metrics, steps=step_metrics, computed_at=now)
+
+
+def data_version_key():
+    """Changes whenever the data `load_data` reads does: checklist version
+    counters (titles, steps, instances and their progress) and the newest
+    status-change event (every instance step status change logs one)"""
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT (SELECT COALESCE(MAX(id), 0) FROM instance_step_events),
+                   (SELECT group_concat(v) FROM (
+                        SELECT id || ':' || version || ':' || instances_version as v
+                        FROM checklists ORDER BY id))
+        """)
+        return tuple(cursor.fetchone())
+
+_cache = {'generation': None, 'key': None, 'metrics': None}
+_lock = threading.Lock()
+
+def get_metrics():
+    """Metrics for everything, recomputed only after the data they're built from has changed"""
+    generation = watcher.current_generation()
+    with _lock:
+        fresh = _cache['metrics'] is not None and time.time() - _cache['metrics']['computed_at'] < MAX_AGE_SECONDS
+        if fresh and _cache['generation'] == generation:
+            return _cache['metrics']
+    key = data_version_key()
+    with _lock:
+        if fresh and _cache['key'] == key:
+            _cache['generation'] = generation
+            return _cache['metrics']
+    metrics = compute_metrics(load_data())
+    with _lock:
+        _cache.update(generation=generation, key=key, metrics=metrics)
+    return metrics
+
+
+# Rendering
+
+def _percent(value):
+    return f"{value * 100:.0f}%"
+
+def render_metrics_unavailable():
+    return P("Analytics needs NumPy (pip install numpy).", cls="uk-text-meta")
+
+def render_template_metrics(checklist_id):
+    """Headline metrics for one template"""
+    if not available():
+        return render_metrics_unavailable()
+    m = get_metrics()['templates'].get(checklist_id)
+    if not m:
+        return P("No instances yet", cls="uk-text-meta")
+    return Div(
+        H3("Metrics", cls="uk-heading-small"),
+        Table(
+            Tbody(
+                Tr(Td("Instances"), Td(m['instances'])),
+                Tr(Td("Completion rate"), Td(_percent(m['completion_rate']))),
+                Tr(Td("Overdue"), Td(m['overdue'])),
+                Tr(Td(f"Completed per week (last {THROUGHPUT_DAYS} days)"), Td(f"{m['throughput_per_week']:.1f}")),
+                *(Tr(Td(f"Step duration p{p}"), Td(format_duration(m[f'p{p}_step_seconds'])))
+                  for p in PERCENTILES),
+            ),
+            cls="uk-table uk-table-small uk-table-divider"
+        ),
+        id="template-metrics"
+    )
+
+def render_step_metrics(steps):
+    """Duration percentiles for a template's steps (`steps` in display order)"""
+    if not available():
+        return ""
+    metrics = get_metrics()['steps']
+    return Table(
+        Thead(Tr(Th("Step"), Th("Samples"), *(Th(f"p{p}") for p in PERCENTILES))),
+        Tbody(*(Tr(
+            Td(step.text),
+            Td(metrics.get(step.id, {}).get('samples', 0)),
+            *(Td(format_duration(metrics.get(step.id, {}).get(f'p{p}_seconds'))) for p in PERCENTILES),
+        ) for step in steps)),
+        cls="uk-table uk-table-divider uk-table-small",
+        id="step-metrics"
+    )
+
+def render_dashboard():
+    """Every template's metrics in one table"""
+    if not available():
+        body = render_metrics_unavailable()
+    else:
+        templates = sorted(get_metrics()['templates'].items(), key=lambda item: -item[1]['instances'])
+        body = Table(
+            Thead(Tr(Th("Template"), Th("Instances"), Th("Completion"), Th("Overdue"),
+                     Th("Per week"), *(Th(f"Step p{p}") for p in PERCENTILES))),
+            Tbody(*(Tr(
+                Td(A(m['title'], cls="uk-link-text",
+                     **{'hx-get': f'/checklist/{checklist_id}/analytics',
+                        'hx-target': '#main-content',
+                        'hx-push-url': 'true'})),
+                Td(m['instances']),
+                Td(_percent(m['completion_rate'])),
+                Td(m['overdue']),
+                Td(f"{m['throughput_per_week']:.1f}"),
+                *(Td(format_duration(m[f'p{p}_step_seconds'])) for p in PERCENTILES),
+            ) for checklist_id, m in templates)),
+            cls="uk-table uk-table-divider uk-table-small uk-table-hover"
+        )
+    return Div(
+        A("← Back",
+          cls="uk-link-text",
+          **{'hx-get': '/',
+             'hx-target': '#main-content',
+             'hx-push-url': 'true'}),
+        H2("Analytics", cls="uk-heading-small"),
+        A("Daily report",
+          cls="uk-link-text",
+          **{'hx-get': '/reports',
+             'hx-target': '#main-content',
+             'hx-push-url': 'true'}),
+        body,
+        cls="uk-container uk-margin-top",
+        id="main-content"
+    )
@@ -0,0 +1,65 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DB_POOL_SIZE
+import checklist_list
+import checklist_edit
+import instance_functions
+
+# At most one worker thread per pooled connection, so this executor alone can't
+# oversubscribe the pool. It is not the pool's only user, though: sync route
+# handlers run on starlette's own thread pool, and the rollup worker and
+# streamed responses check out connections too. A job may therefore still wait
+# for a connection (up to DB_POOL_TIMEOUT, counted in pool_stats() 'waits').
+# Jobs should hold one connection at a time, never nest DBConnection blocks.
+_executor = None
+
+def get_executor():
+    """Return the bounded executor used for blocking database work"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix='db')
+    return _executor
+
+def shutdown_executor(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking (sqlite3) callable on the DB executor and await its result"""
+    loop = asyncio.get_running_loop()
+    # Carry context vars (e.g. the request's query stats) over to the worker thread
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), ctx.run, functools.partial(fn, *args, **kwargs))
+
+def to_async(fn):
+    """Wrap a blocking data function so it can be awaited from a route handler"""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_db(fn, *args, **kwargs)
+    return wrapper
+
+
+# Awaitable versions of the data-access functions
+aget_checklist_with_steps = to_async(checklist_list.get_checklist_with_steps)
+acreate_new_checklist = to_async(checklist_list.create_new_checklist)
+
+aupdate_steps_order = to_async(checklist_edit.update_steps_order)
+amove_step = to_async(checklist_edit.move_step)
+acreate_new_step = to_async(checklist_edit.create_new_step)
+adelete_step = to_async(checklist_edit.delete_step)
+adb_update_step = to_async(checklist_edit.db_update_step)
+aget_step_reference = to_async(checklist_edit.get_step_reference)
+aupdate_step_reference = to_async(checklist_edit.update_step_reference)
+aget_step = to_async(checklist_edit.get_step)
+aupdate_checklist_field = to_async(checklist_edit.update_checklist_field)
+
+aget_instance_with_steps = to_async(instance_functions.get_instance_with_steps)
+aget_filtered_instances = to_async(instance_functions.get_filtered_instances)
+acreate_new_instance = to_async(instance_functions.create_new_instance)
+aget_instance_step = to_async(instance_functions.get_instance_step)
+aupdate_instance_step_status = to_async(instance_functions.update_instance_step_status)
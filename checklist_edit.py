@@ -6,41 +6,210 @@ from fastcore.basics import AttrDict
 from db_connection import DBConnection
 
 from models import Checklist
+from fragment_cache import fragments
+from streaming import STREAM_SLOT
+from checklist_list import get_checklist_header, iter_checklist_steps
+from tags import render_checklist_tags
+from template_history import (record_change, record_state, step_values, previous_step_id,
+                              _order_moves)
 
 from urllib.parse import urlparse
 
 ### Data access functions
+
+# Steps are ordered by a sparse order_index: consecutive steps start ORDER_GAP
+# apart, so an insert or move takes the midpoint of its neighbours and writes a
+# single row. Only when two neighbours end up adjacent is the checklist renumbered.
+ORDER_GAP = 1024
+
+def order_key_between(before, after):
+    """An order_index strictly between two neighbours' keys (None = list edge),
+    or None if there's no room left and the checklist needs rebalancing"""
+    if before is None and after is None:
+        return ORDER_GAP
+    if before is None:
+        return after - ORDER_GAP
+    if after is None:
+        return before + ORDER_GAP
+    if after - before < 2:
+        return None
+    return (before + after) // 2
+
+
+def rebalance_step_order(cursor, checklist_id: int, step_ids: list = None):
+    """Renumber a checklist's steps ORDER_GAP apart, in `step_ids` order if given
+    (any steps not listed keep their relative order after them)"""
+    cursor.execute("""
+        SELECT id FROM steps 
+        WHERE checklist_id = ? 
+        ORDER BY order_index, id
+    """, (checklist_id,))
+    current = [row['id'] for row in cursor.fetchall()]
+    ordered = list(step_ids or [])
+    listed = set(ordered)
+    ordered += [step_id for step_id in current if step_id not in listed]
+    cursor.executemany("""
+        UPDATE steps 
+        SET order_index = ? 
+        WHERE id = ? AND checklist_id = ?
+    """, [((i + 1) * ORDER_GAP, step_id, checklist_id) for i, step_id in enumerate(ordered)])
+
+
+def _longest_increasing_run(keys):
+    """Indexes of a longest strictly increasing subsequence of `keys`"""
+    tails, tail_idx, prev = [], [], [None] * len(keys)
+    for i, key in enumerate(keys):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tails[mid] < key: lo = mid + 1
+            else: hi = mid
+        if lo: prev[i] = tail_idx[lo - 1]
+        if lo == len(tails):
+            tails.append(key); tail_idx.append(i)
+        else:
+            tails[lo], tail_idx[lo] = key, i
+    result, i = [], tail_idx[-1] if tail_idx else None
+    while i is not None:
+        result.append(i)
+        i = prev[i]
+    return set(result)
+
+
 def update_steps_order(checklist_id: int, step_ids: list):
-    """Update the order_index of steps in a checklist"""
+    """Update the order_index of steps in a checklist
+    Only steps that actually moved are written (one row for a single drag).
+    Returns False if any step id doesn't belong to the checklist"""
+    step_ids = [int(step_id) for step_id in step_ids]
     with DBConnection() as cursor:
+        # Keys are computed from what's read here, so hold the write lock from the start
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            SELECT id, order_index 
+            FROM steps 
+            WHERE checklist_id = ?
+        """, (checklist_id,))
+        keys = {row['id']: row['order_index'] for row in cursor.fetchall()}
+        if len(set(step_ids)) != len(step_ids) or not all(step_id in keys for step_id in step_ids):
+            return False
+
+        # Steps on a longest increasing run of current keys stay put; the rest
+        # get a key between their new neighbours
+        current = [keys[step_id] for step_id in step_ids]
+        keep = _longest_increasing_run(current)
+        next_kept, upcoming = [None] * len(current), None
+        for i in reversed(range(len(current))):
+            next_kept[i] = upcoming
+            if i in keep: upcoming = current[i]
+
+        updates = []
+        prev_key = None
         for i, step_id in enumerate(step_ids):
+            if i in keep:
+                prev_key = current[i]
+                continue
+            key = order_key_between(prev_key, next_kept[i])
+            if key is None:
+                rebalance_step_order(cursor, checklist_id, step_ids)
+                updates = []
+                break
+            updates.append((key, step_id, checklist_id))
+            prev_key = key
+
+        cursor.executemany("""
+            UPDATE steps 
+            SET order_index = ? 
+            WHERE id = ? AND checklist_id = ?
+        """, updates)
+        if len(step_ids) == len(keys):
+            old_order = sorted(keys, key=lambda step_id: (keys[step_id], step_id))
+            record_change(cursor, checklist_id, {'moves': _order_moves(old_order, step_ids)}, "Reordered steps")
+        else:
+            # Only some of the steps were sent; where the rest end up is easiest read back
+            record_state(cursor, checklist_id, "Reordered steps")
+    return True
+
+
+def move_step(checklist_id: int, step_id: int, prev_id: int = None, next_id: int = None) -> bool:
+    """Move one step between its new neighbours (None = start/end of the list)
+    Writes a single row unless the neighbours' keys have no room between them.
+    Returns False if any of the steps doesn't belong to the checklist"""
+    ids = [i for i in (step_id, prev_id, next_id) if i is not None]
+    with DBConnection() as cursor:
+        # Keys are computed from what's read here, so hold the write lock from the start
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(f"""
+            SELECT id, order_index 
+            FROM steps 
+            WHERE checklist_id = ? AND id IN ({','.join('?' * len(ids))})
+        """, (checklist_id, *ids))
+        keys = {row['id']: row['order_index'] for row in cursor.fetchall()}
+        if len(keys) != len(set(ids)) or step_id in (prev_id, next_id):
+            return False
+
+        key = order_key_between(keys.get(prev_id), keys.get(next_id))
+        if key is None:
+            cursor.execute("""
+                SELECT id FROM steps 
+                WHERE checklist_id = ? AND id != ?
+                ORDER BY order_index, id
+            """, (checklist_id, step_id))
+            ordered = [row['id'] for row in cursor.fetchall()]
+            ordered.insert(ordered.index(prev_id) + 1 if prev_id is not None else 0, step_id)
+            rebalance_step_order(cursor, checklist_id, ordered)
+        else:
             cursor.execute("""
                 UPDATE steps 
                 SET order_index = ? 
                 WHERE id = ? AND checklist_id = ?
-            """, (i, int(step_id), checklist_id))
+            """, (key, step_id, checklist_id))
+        record_change(cursor, checklist_id,
+                      {'moves': [[step_id, previous_step_id(cursor, checklist_id, step_id)]]},
+                      "Moved a step")
     return True
 
 
+def _insert_position_key(cursor, checklist_id: int, position: int):
+    """order_index for a new step at 1-based `position`, or None if there's no gap"""
+    index = max(position - 1, 0)
+    cursor.execute("""
+        SELECT order_index FROM steps 
+        WHERE checklist_id = ? 
+        ORDER BY order_index, id 
+        LIMIT 2 OFFSET ?
+    """, (checklist_id, max(index - 1, 0)))
+    neighbours = [row['order_index'] for row in cursor.fetchall()]
+    if index == 0:
+        return order_key_between(None, neighbours[0] if neighbours else None)
+    before = neighbours[0] if neighbours else None
+    after = neighbours[1] if len(neighbours) > 1 else None
+    if before is None:
+        # Position past the end of the list: append
+        cursor.execute("SELECT MAX(order_index) FROM steps WHERE checklist_id = ?", (checklist_id,))
+        before = cursor.fetchone()[0]
+    return order_key_between(before, after)
+
+
 def create_new_step(checklist_id: int, text: str, position: int, reference_url: str = None) -> tuple[int, str | None]:
     """Create a new step and its reference if provided
     Returns: (step_id, error_message)"""
     with DBConnection() as cursor:
         try:
-            cursor.execute("BEGIN")
+            # Write lock before reading the neighbours' keys, so a concurrent insert
+            # can't pick the same key (or fail to upgrade a stale read snapshot)
+            cursor.execute("BEGIN IMMEDIATE")
             
-            # Shift existing steps to make room
-            cursor.execute("""
-                UPDATE steps 
-                SET order_index = order_index + 1
-                WHERE checklist_id = ? AND order_index >= ?
-            """, (checklist_id, position - 1))
+            # Take the midpoint of the neighbouring steps, renumbering only if they touch
+            order_index = _insert_position_key(cursor, checklist_id, position)
+            if order_index is None:
+                rebalance_step_order(cursor, checklist_id)
+                order_index = _insert_position_key(cursor, checklist_id, position)
             
             # Insert step
             cursor.execute("""
                 INSERT INTO steps (checklist_id, text, status, order_index)
                 VALUES (?, ?, ?, ?)
-            """, (checklist_id, text, 'Not Started', position - 1))
+            """, (checklist_id, text, 'Not Started', order_index))
             
             step_id = cursor.lastrowid
             
@@ -56,6 +225,10 @@ def create_new_step(checklist_id: int, text: str, position: int, reference_url:
                 else:
                     ref_error = error
             
+            record_change(cursor, checklist_id, {
+                'steps': {str(step_id): [text, None if ref_error or not reference_url else reference_url]},
+                'moves': [[step_id, previous_step_id(cursor, checklist_id, step_id)]],
+            }, "Added a step")
             cursor.execute("COMMIT")
             return step_id, ref_error
             
@@ -65,6 +238,19 @@ def create_new_step(checklist_id: int, text: str, position: int, reference_url:
 
 
 
+def delete_step(checklist_id: int, step_id: int) -> bool:
+    """Delete a step from a checklist"""
+    with DBConnection() as cursor:
+        cursor.execute("DELETE FROM steps WHERE id = ? AND checklist_id = ?",
+                      (step_id, checklist_id))
+        deleted = cursor.rowcount > 0
+        if deleted:
+            # A new step can reuse the id, and mustn't inherit the reference
+            cursor.execute("DELETE FROM step_references WHERE step_id = ?", (step_id,))
+            record_change(cursor, checklist_id, {'removed': [step_id]}, "Deleted a step")
+    return deleted
+
+
 def db_update_step(checklist_id: int, step_id: int, **updates):
     """Update step fields in database and return updated step"""
     if not updates:
@@ -78,6 +264,7 @@ def db_update_step(checklist_id: int, step_id: int, **updates):
         return None
         
     with DBConnection() as cursor:
+        before = step_values(cursor, step_id)
         set_clause = ', '.join(f"{k} = ?" for k in valid_updates)
         params = list(valid_updates.values())
         params.extend([step_id, checklist_id])
@@ -93,7 +280,12 @@ def db_update_step(checklist_id: int, step_id: int, **updates):
             SELECT * FROM steps 
             WHERE id = ? AND checklist_id = ?
         """, (step_id, checklist_id))
-        return AttrDict(cursor.fetchone())
+        step = AttrDict(cursor.fetchone())
+        # Only the text is part of a template's history (status isn't)
+        if before and before[0] == checklist_id and before[1] != step.text:
+            record_change(cursor, checklist_id, {'steps': {str(step_id): [step.text, before[2]]}},
+                          "Edited a step")
+    return step
 
 
 
@@ -110,9 +302,37 @@ def get_step_reference(step_id: int):
         row = cursor.fetchone()
         return AttrDict(row) if row else None
 
+def get_checklist_references(checklist_id: int) -> dict:
+    """Get every step reference for a checklist in one query, keyed by step id"""
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT sr.step_id, sr.id, sr.url, sr.type_id
+            FROM step_references sr
+            JOIN steps s ON s.id = sr.step_id
+            WHERE s.checklist_id = ?
+        """, (checklist_id,))
+        return {row['step_id']: AttrDict(id=row['id'], url=row['url'], type_id=row['type_id'])
+                for row in cursor.fetchall()}
+
+
+class StepReferenceLoader:
+    """Request-scoped batch loader for step references.
+    The first `load` fetches the references for the whole checklist at once;
+    later loads are served from memory."""
+    def __init__(self, checklist_id: int):
+        self.checklist_id = checklist_id
+        self._refs = None
+
+    def load(self, step_id: int):
+        if self._refs is None:
+            self._refs = get_checklist_references(self.checklist_id)
+        return self._refs.get(step_id)
+
+
 def update_step_reference(step_id: int, url: str, type_id: int = 1):
     """Create or update a reference URL for a step"""
     with DBConnection() as cursor:
+        before = step_values(cursor, step_id)
         cursor.execute("""
             INSERT INTO step_references (step_id, url, type_id)
             VALUES (?, ?, ?)
@@ -128,7 +348,11 @@ def update_step_reference(step_id: int, url: str, type_id: int = 1):
             WHERE step_id = ?
         """, (step_id,))
         row = cursor.fetchone()
-        return AttrDict(row) if row else None
+        if before and before[2] != url:
+            checklist_id, text, _ = before
+            record_change(cursor, checklist_id, {'steps': {str(step_id): [text, url]}},
+                          "Changed a step reference")
+    return AttrDict(row) if row else None
 
 def get_step(step_id: int, checklist_id: int = None):
     """Get a single step with its reference"""
@@ -173,6 +397,8 @@ def update_checklist_field(checklist_id: int, field_name: str, value: str):
         return None
         
     with DBConnection() as cursor:
+        cursor.execute(f"SELECT {field_name} FROM checklists WHERE id = ?", (checklist_id,))
+        before = cursor.fetchone()
         cursor.execute(f"""
             UPDATE checklists 
             SET {field_name} = ?
@@ -184,7 +410,11 @@ def update_checklist_field(checklist_id: int, field_name: str, value: str):
             SELECT * FROM checklists 
             WHERE id = ?
         """, (checklist_id,))
-        return AttrDict(cursor.fetchone())
+        checklist = AttrDict(cursor.fetchone())
+        if before and before[0] != value:
+            record_change(cursor, checklist_id, {'fields': {field_name: value}},
+                          f"Edited {field_name.replace('_', ' ')}")
+    return checklist
 
 
 # UI Components - rendering functions
@@ -196,7 +426,12 @@ def render_checklist_header(checklist_id):
           **{'hx-get': f'/checklist/{checklist_id}', 
              'hx-target': '#main-content',
              'hx-push-url': 'true'}),
-        cls="uk-margin-bottom"
+        A("History", 
+          cls="uk-link-text", 
+          **{'hx-get': f'/checklist/{checklist_id}/history', 
+             'hx-target': '#main-content',
+             'hx-push-url': 'true'}),
+        cls="uk-margin-bottom uk-flex uk-flex-between"
     )
 
 
@@ -280,8 +515,9 @@ def render_new_step_modal(checklist_id, current_step_count):
     )
 
 
-def render_checklist_edit(checklist):
-    """Main wrapper function that composes all components"""
+def render_checklist_edit(checklist, items=None, step_count=None):
+    """Main wrapper function that composes all components
+    `step_count` is needed when the steps aren't loaded (see stream_checklist_edit)"""
     return Div(
         # Header
         render_checklist_header(checklist.id),
@@ -289,15 +525,24 @@ def render_checklist_edit(checklist):
         # Main Content
         render_checklist_title_section(checklist.id),
         render_checklist_details(checklist),
-        render_sortable_steps(checklist),
+        render_checklist_tags(checklist.id),
+        render_sortable_steps(checklist, items),
         
-        SortableJS('.sortable', ghost_class='blue-background-class'),
-        render_new_step_modal(checklist.id, len(checklist.steps)),
+        render_new_step_modal(checklist.id, len(checklist.steps) if step_count is None else step_count),
         cls="uk-margin",
         id="main-content"
     )
 
 
+def stream_checklist_edit(checklist_id):
+    """(page, items) for StreamingHTML: the edit page first, then its steps as they're read"""
+    checklist = get_checklist_header(checklist_id)
+    if not checklist:
+        return Div("Checklist not found", cls="uk-alert uk-alert-danger"), ()
+    page = render_checklist_edit(checklist, items=[STREAM_SLOT], step_count=checklist.step_count)
+    return page, sortable_step_items(checklist, iter_checklist_steps(checklist_id))
+
+
 def render_step_text(step, checklist_id):
     """Render just the text input portion"""
     return Div(
@@ -320,15 +565,15 @@ def render_step_text(step, checklist_id):
           **{
               'hx-delete': f'/checklist/{checklist_id}/step/{step.id}',
               'hx-confirm': 'Are you sure you want to delete this step?',
-              'hx-target': '#main-content'
+              'hx-swap': 'none'
           }),
         cls="uk-flex uk-flex-middle",
         id=f"step-text-{step.id}"
     )
 
-def render_step_reference(step, checklist_id, error=None):
+def render_step_reference(step, checklist_id, error=None, loader=None):
     """Render reference input with error handling"""
-    ref = get_step_reference(step.id)
+    ref = loader.load(step.id) if loader else get_step_reference(step.id)
     return Div(
         Form(
             LabelInput(
@@ -350,18 +595,17 @@ def render_step_reference(step, checklist_id, error=None):
         cls="uk-margin-small"
     )
 
-def render_step_item(step, checklist_id, step_number):
-    print(f"DEBUG: Rendering step item - ID: {step.id}, Order: {step.order_index}")
+def render_step_item(step, checklist_id, step_number, loader=None):
     return Div(
         Div(
             Span("⋮⋮", 
                  cls="uk-margin-small-right drag-handle", 
                  style="cursor: move"),
             Span(f"Step {step_number}", 
-                 cls="uk-form-label"),
+                 cls="uk-form-label step-number"),
             Div(
                 render_step_text(step, checklist_id),
-                render_step_reference(step, checklist_id),
+                render_step_reference(step, checklist_id, loader=loader),
                 cls="uk-width-expand"
             ),
             cls="uk-flex"
@@ -376,25 +620,70 @@ def render_step_item(step, checklist_id, step_number):
         }
     )
 
-def render_sortable_steps(checklist):
+# After a drag, post only the moved step and its new neighbours, then renumber
+# the "Step N" labels in the browser; deletes renumber on their stepsChanged
+# trigger. Bound once per page, since the steps list itself gets swapped out.
+STEP_MOVE_JS = """
+window.renumberSteps = function () {
+    document.querySelectorAll('#steps-list .step-number').forEach(function (el, i) {
+        el.textContent = 'Step ' + (i + 1);
+    });
+};
+if (!window.stepMoveBound) {
+    window.stepMoveBound = true;
+    document.body.addEventListener('stepsChanged', function () { window.renumberSteps(); });
+    document.addEventListener('end', function (evt) {
+        var form = evt.target.closest && evt.target.closest('#steps-list');
+        if (!form || evt.oldIndex === evt.newIndex) return;
+        var item = evt.item, prev = item.previousElementSibling, next = item.nextElementSibling;
+        htmx.ajax('POST', form.dataset.moveUrl.replace('{step_id}', item.dataset.stepId), {
+            values: {prev_id: prev ? prev.dataset.stepId : '', next_id: next ? next.dataset.stepId : ''},
+            swap: 'none'
+        });
+        window.renumberSteps();
+    });
+}
+"""
+
+def sortable_step_items(checklist, steps=None):
+    """Yield the sortable list's Li items one at a time, for `steps` (default: checklist.steps)"""
+    loader = StepReferenceLoader(checklist.id)
+    for idx, step in enumerate(checklist.steps if steps is None else steps):
+        yield Li(
+            fragments.render('step_item', checklist.id, checklist.version, step.id, idx+1,
+                             render=lambda step=step, idx=idx: render_step_item(step, checklist.id, idx+1, loader)),
+            # Remove the Hidden input here since it's in render_step_item
+            id=f'step-{step.id}',
+            data_step_id=step.id,
+            cls="uk-padding-small uk-margin-small uk-box-shadow-small"
+        )
+
+def render_sortable_steps(checklist, items=None):
+    """Pass `items=[STREAM_SLOT]` to leave the list for streaming (see stream_checklist_edit)"""
     return Form(
         H3("Steps", cls="uk-heading-small uk-margin-top"),
-        Ul(*(
-            Li(
-                render_step_item(step, checklist.id, idx+1),
-                # Remove the Hidden input here since it's in render_step_item
-                id=f'step-{step.id}',
-                cls="uk-padding-small uk-margin-small uk-box-shadow-small"
-            )
-            for idx, step in enumerate(checklist.steps)
-        ), cls='sortable'),
-        Hidden(name="step_order", value=",".join(str(step.id) for step in checklist.steps)),
+        Ul(*(items if items is not None else sortable_step_items(checklist)), cls='sortable'),
+        Div(id='steps-order-status', cls='uk-text-meta'),
+        Script(STEP_MOVE_JS),
         id='steps-list',
-        hx_post=f'/checklist/{checklist.id}/reorder-steps',
-        hx_trigger="end"
+        data_move_url=f'/checklist/{checklist.id}/step/{{step_id}}/move'
     )
 
 
+def render_step_deleted(step_id):
+    """Out-of-band fragments removing a deleted step from the list; the route
+    triggers stepsChanged so the browser renumbers the rest"""
+    return (Li(id=f'step-{step_id}', hx_swap_oob='delete'),
+            render_move_status("Step deleted"))
+
+def render_move_status(message, error=False):
+    """Small out-of-band fragment acknowledging a step move"""
+    return Div(message,
+               id='steps-order-status',
+               cls=f"uk-text-{'danger' if error else 'meta'}",
+               hx_swap_oob='true')
+
+
 def render_checklist_field(checklist_id, field_name, value, label, input_type="input"):
     """Render a single auto-saving field"""
     field_id = f"checklist-{field_name}-{checklist_id}"
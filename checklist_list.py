@@ -6,8 +6,18 @@ from fastcore.basics import AttrDict
 from db_connection import DBConnection
 
 from models import Checklist
+from versions import get_checklist_version
+from fragment_cache import fragments, LRUCache
+from config import CHECKLIST_CACHE_MAX_STEPS, CHECKLIST_CACHE_MAX_ENTRIES, PAGE_SIZE, STREAM_CHUNK_ROWS
+from pagination import keyset_sql, split_page, normalize_order
+from tags import subtree_filter_sql, render_tag_filter
+from template_history import record_state
 
 def checklist_row(checklist):
+    return fragments.render('checklist_row', checklist.id, checklist.version,
+                            render=lambda: _checklist_row(checklist))
+
+def _checklist_row(checklist):
     return Tr(
         Td(
             Div(
@@ -71,11 +81,43 @@ def create_checklist_modal():
     )
 
 
+# Read-through cache of Checklist objects, sized by step count and validated
+# against the checklist's version (see versions.py) on every lookup
+_checklists = LRUCache(CHECKLIST_CACHE_MAX_STEPS, CHECKLIST_CACHE_MAX_ENTRIES)
+
+def _copy_checklist(checklist):
+    return Checklist(**{**checklist, 'steps': [AttrDict(step) for step in checklist.steps]})
+
 def get_checklist_with_steps(checklist_id):
+    version = get_checklist_version(checklist_id)
+    if version is None:
+        return None
+    cached = _checklists.get(checklist_id)
+    if cached is not None and cached.version == version:
+        return _copy_checklist(cached)
+    
+    checklist = load_checklist_with_steps(checklist_id)
+    if checklist is not None:
+        _checklists.put(checklist_id, _copy_checklist(checklist), 1 + len(checklist.steps))
+    return checklist
+
+
+# A checklist's steps with their references; callers add the ordering
+STEP_SELECT = """
+    SELECT 
+        s.id, s.text, s.status, s.order_index,
+        sr.url as reference_url
+    FROM steps s
+    LEFT JOIN step_references sr ON s.id = sr.step_id
+    WHERE s.checklist_id = ?
+"""
+
+def load_checklist_with_steps(checklist_id):
+    """Query a checklist and its steps, bypassing the cache"""
     with DBConnection() as cursor:
         # Get checklist details
         cursor.execute("""
-            SELECT id, title, description, description_long, created_at 
+            SELECT id, title, description, description_long, created_at, version 
             FROM checklists WHERE id = ?
         """, (checklist_id,))
         checklist_row = cursor.fetchone()
@@ -84,15 +126,7 @@ def get_checklist_with_steps(checklist_id):
             return None
             
         # Get steps with their references
-        cursor.execute("""
-            SELECT 
-                s.id, s.text, s.status, s.order_index,
-                sr.url as reference_url
-            FROM steps s
-            LEFT JOIN step_references sr ON s.id = sr.step_id
-            WHERE s.checklist_id = ?
-            ORDER BY s.order_index
-        """, (checklist_id,))
+        cursor.execute(STEP_SELECT + " ORDER BY s.order_index, s.id", (checklist_id,))
         step_rows = cursor.fetchall()
     
     # Create the checklist using our class
@@ -102,48 +136,135 @@ def get_checklist_with_steps(checklist_id):
         description=checklist_row['description'],
         description_long=checklist_row['description_long'],
         created_at=checklist_row['created_at'],
-        steps=[AttrDict(dict(row)) for row in step_rows]
+        steps=[AttrDict(dict(row)) for row in step_rows],
+        version=checklist_row['version']
     )
 
 
+def get_checklist_header(checklist_id):
+    """A checklist without its steps (see iter_checklist_steps), plus its `step_count`"""
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT id, title, description, description_long, created_at, version,
+                   (SELECT COUNT(*) FROM steps WHERE checklist_id = checklists.id) as step_count
+            FROM checklists WHERE id = ?
+        """, (checklist_id,))
+        row = cursor.fetchone()
+    if not row:
+        return None
+    checklist = Checklist(id=row['id'], title=row['title'], description=row['description'],
+                          description_long=row['description_long'], created_at=row['created_at'],
+                          version=row['version'])
+    checklist.step_count = row['step_count']
+    return checklist
 
-def checklist_table():
+def iter_checklist_steps(checklist_id, chunk_rows=STREAM_CHUNK_ROWS):
+    """Yield a checklist's steps in order, reading `chunk_rows` at a time with no
+    connection held in between (like instance_functions.iter_instance_steps)"""
+    after = None  # keys can be negative, so the first chunk has no lower bound
+    while True:
+        with DBConnection() as cursor:
+            cursor.execute(STEP_SELECT
+                           + (" AND (s.order_index, s.id) > (?, ?)" if after else "")
+                           + " ORDER BY s.order_index, s.id LIMIT ?",
+                           (checklist_id, *(after or ()), chunk_rows))
+            steps = [AttrDict(dict(row)) for row in cursor.fetchall()]
+        yield from steps
+        if len(steps) < chunk_rows:
+            return
+        after = (steps[-1].order_index, steps[-1].id)
+
+
+def create_new_checklist(title, description='', description_long=''):
+    """Insert a new checklist and return its id"""
     with DBConnection() as cursor:
         cursor.execute("""
-            SELECT id, title, description, description_long, created_at 
+            INSERT INTO checklists (title, description, description_long, created_at)
+            VALUES (?, ?, ?, ?)
+        """, (title, description, description_long, datetime.now().isoformat()))
+        checklist_id = cursor.lastrowid
+        record_state(cursor, checklist_id, "Created")
+    return checklist_id
+
+
+def get_checklists_page(after=None, order='desc', limit=PAGE_SIZE, tag_id=None):
+    """One page of checklists by created_at; returns (checklists, next cursor)
+    With `tag_id`, only checklists tagged with that tag or any tag under it"""
+    where, params, order_by = keyset_sql('', order, after)
+    if tag_id:
+        where = subtree_filter_sql() + where
+        params = [tag_id, *params]
+    with DBConnection() as cursor:
+        cursor.execute(f"""
+            SELECT id, title, description, description_long, created_at, version 
             FROM checklists
-        """)
-        rows = cursor.fetchall()
+            WHERE 1=1{where}{order_by}
+            LIMIT ?
+        """, (*params, limit + 1))
+        rows, next_cursor = split_page(cursor.fetchall(), limit)
     
-    data = [Checklist(
+    return [Checklist(
         id=row['id'],
         title=row['title'],
         description=row['description'],
         description_long=row['description_long'],
-        created_at=row['created_at']
-    ) for row in rows]
-    
+        created_at=row['created_at'],
+        version=row['version']
+    ) for row in rows], next_cursor
+
+
+def checklist_rows(after=None, order='desc', tag_id=None):
+    """Table rows for one page, plus a sentinel row that loads the next page when scrolled into view"""
+    data, next_cursor = get_checklists_page(after, order, tag_id=tag_id)
+    rows = [checklist_row(checklist) for checklist in data]
+    if next_cursor:
+        query = f"after={next_cursor}&order={order}" + (f"&tag={tag_id}" if tag_id else "")
+        rows.append(Tr(
+            Td("Loading more...", colspan="2", cls="uk-text-muted uk-text-center"),
+            hx_get=f'/checklists/page?{query}',
+            hx_trigger='revealed',
+            hx_swap='outerHTML'
+        ))
+    return rows
+
+
+def checklist_table(order='desc', tag_id=None):
+    order = normalize_order(order)
+    other = 'asc' if order == 'desc' else 'desc'
     return Table(
         Thead(
             Tr(
-                Th("Checklist"),
+                Th(A(f"Checklist {'↓' if order == 'desc' else '↑'}",
+                     cls='uk-link-reset',
+                     **{'hx-get': f'/?order={other}' + (f'&tag={tag_id}' if tag_id else ''),
+                        'hx-target': '#main-content',
+                        'hx-push-url': 'true'})),
                 Th("Actions", cls='uk-text-right')
             )
         ),
-        Tbody(*(checklist_row(checklist) for checklist in data)),
+        Tbody(*checklist_rows(order=order, tag_id=tag_id)),
         cls="uk-table uk-table-divider uk-table-hover uk-table-small"
     )
 
-def render_main_page():
+def render_main_page(order='desc', tag_id=None):
     return Div(
-        Script(src="https://unpkg.com/htmx.org/dist/ext/sortable.js"),
-        Script(src="https://cdn.jsdelivr.net/npm/sortablejs@1.15.0/Sortable.min.js"),
-        # Rest of your existing render_main_page code...
         H1("My Checklists", cls="uk-heading-medium"),
-        Button("+ New Checklist", 
-               cls="uk-button uk-button-primary uk-margin-bottom",
-               **{'uk-toggle': 'target: #new-checklist-modal'}),
-        checklist_table(),
+        DivFullySpaced(
+            Button("+ New Checklist", 
+                   cls="uk-button uk-button-primary",
+                   **{'uk-toggle': 'target: #new-checklist-modal'}),
+            DivLAligned(
+                render_tag_filter(tag_id, order),
+                Form(
+                    Input(type="search", name="q", placeholder="Search...", cls="uk-input uk-form-width-medium"),
+                    **{'hx-get': '/search',
+                       'hx-target': '#main-content',
+                       'hx-push-url': 'true'}
+                ),
+            ),
+            cls="uk-margin-bottom"
+        ),
+        checklist_table(order, tag_id),
         create_checklist_modal(),
         cls="uk-container uk-margin-top",
         id="main-content"
@@ -170,6 +291,11 @@ def render_steps(steps):
 
 
 def render_checklist_page(checklist_id):
+    # Serve the pre-rendered page while the checklist's version is unchanged
+    return fragments.render('checklist_page', checklist_id, get_checklist_version(checklist_id),
+                            render=lambda: _render_checklist_page(checklist_id))
+
+def _render_checklist_page(checklist_id):
     # Get the combined data using our new function
     checklist = get_checklist_with_steps(checklist_id)
     
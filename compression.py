@@ -0,0 +1,157 @@
+"""Response compression (brotli if installed and accepted, else gzip).
+
+`CompressionMiddleware` compresses text responses of at least
+COMPRESSION_MIN_BYTES. Streamed responses (see streaming.py) are compressed
+chunk by chunk with a sync flush after each, so the browser can still render
+rows as they arrive. It leaves alone:
+
+- event streams, whose messages must go out the moment they're sent;
+- bodies that are already encoded, like the precompressed /assets/ files;
+- binary content types.
+
+Compressed bodies are kept in an LRU cache, so a fragment that hasn't changed
+is compressed once rather than on every hit. Responses with an ETag (see
+etags.py) are looked up by path and ETag without even hashing the body.
+Other responses are looked up by a hash of the body, which is far cheaper
+than compressing it again."""
+import gzip
+import hashlib
+import zlib
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+from config import (COMPRESSION_MIN_BYTES, COMPRESSION_CACHE_MAX_BYTES,
+                    COMPRESSION_CACHE_MAX_ENTRIES, GZIP_LEVEL, BROTLI_QUALITY)
+from fragment_cache import LRUCache
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+def _gzip(body): return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+def _brotli(body): return brotli.compress(body, quality=BROTLI_QUALITY)
+
+# Content-Encoding -> compressor, in order of preference
+CODERS = {'br': _brotli, 'gzip': _gzip} if brotli is not None else {'gzip': _gzip}
+
+compressed_bodies = LRUCache(COMPRESSION_CACHE_MAX_BYTES, COMPRESSION_CACHE_MAX_ENTRIES)
+
+def accepted_encodings(accept_encoding):
+    """Codings an Accept-Encoding header value allows (ignoring any with q=0)"""
+    accepted = set()
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.replace(' ', '').lower()
+        if q.startswith('q=') and not q[2:].strip('0.'):
+            continue
+        if coding.strip():
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def choose_coding(accept_encoding):
+    accepted = accepted_encodings(accept_encoding)
+    return next((coding for coding in CODERS if coding in accepted or '*' in accepted), None)
+
+class StreamCompressor:
+    """Incremental compressor whose output is decodable after every chunk"""
+    def __init__(self, coding):
+        self.coding = coding
+        if coding == 'br':
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def chunk(self, data):
+        if self.coding == 'br':
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.coding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+def _encoded_headers(headers, coding):
+    """Response headers without Content-Length, with Vary (and Content-Encoding if compressing)"""
+    headers = [(k, v) for k, v in headers if k.lower() != b'content-length']
+    if not any(k.lower() == b'vary' and b'accept-encoding' in v.lower() for k, v in headers):
+        headers.append((b'vary', b'Accept-Encoding'))
+    if coding is not None:
+        headers.append((b'content-encoding', coding.encode()))
+    return headers
+
+def compress(coding, body, key=None):
+    """`body` compressed with `coding`, from the cache when `key` (or the body) was seen before"""
+    key = (coding, *key) if key else (coding, hashlib.blake2b(body, digest_size=16).digest())
+    compressed = compressed_bodies.get(key)
+    if compressed is None:
+        compressed = CODERS[coding](body)
+        compressed_bodies.put(key, compressed, len(compressed))
+    return compressed
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing compressible HTTP responses, whole or streamed"""
+    def __init__(self, app, min_size=None):
+        self.app = app
+        self.min_size = COMPRESSION_MIN_BYTES if min_size is None else min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            return await self.app(scope, receive, send)
+        request_headers = dict(scope['headers'])
+        coding = choose_coding(request_headers.get(b'accept-encoding', b'').decode('latin-1'))
+        start = None
+        passthrough = False
+        stream = None
+
+        async def send_compressed(message):
+            nonlocal start, passthrough, stream
+            if passthrough:
+                return await send(message)
+            if stream is not None:
+                more = message.get('more_body', False)
+                body = stream.chunk(message.get('body', b'')) + (b'' if more else stream.finish())
+                return await send({**message, 'body': body})
+            if message['type'] == 'http.response.start':
+                headers = {k.lower(): v for k, v in message.get('headers', [])}
+                content_type = headers.get(b'content-type', b'').decode('latin-1')
+                if (b'content-encoding' in headers
+                        or content_type.startswith('text/event-stream')
+                        or not content_type.startswith(COMPRESSIBLE_TYPES)):
+                    passthrough = True
+                    return await send(message)
+                start = message  # held until we see whether the body comes in one piece
+                return
+            if message['type'] != 'http.response.body':
+                return await send(message)
+
+            body = message.get('body', b'')
+            if message.get('more_body', False):
+                # Streaming: compress as it goes, never buffer
+                if coding is None:
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+                stream = StreamCompressor(coding)
+                await send({**start, 'headers': _encoded_headers(start.get('headers', []), coding)})
+                return await send({**message, 'body': stream.chunk(body)})
+            if len(body) < self.min_size:
+                await send(start)
+                return await send(message)
+
+            headers = _encoded_headers(start.get('headers', []), coding)
+            if coding is not None:
+                etag = next((v for k, v in headers if k.lower() == b'etag'), None)
+                key = (scope['path'], scope.get('query_string', b''), etag) if etag else None
+                body = compress(coding, body, key)
+                if etag and not etag.startswith(b'W/'):
+                    # A strong ETag identifies these exact bytes
+                    headers = [(k, v[:-1] + f'-{coding}"'.encode() if k.lower() == b'etag' else v)
+                               for k, v in headers]
+            headers.append((b'content-length', str(len(body)).encode()))
+            await send({**start, 'headers': headers})
+            await send({**message, 'body': body})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,3 +1,48 @@
+import os
 from pathlib import Path
 
 DB_PATH = Path('data/checklists.db')
+
+# Connection pool settings (see db_connection.py)
+DB_POOL_SIZE = 8            # max open connections per process
+DB_POOL_TIMEOUT = 30        # seconds to wait for a free connection
+DB_BUSY_TIMEOUT_MS = 5000   # PRAGMA busy_timeout
+DB_CACHE_SIZE_KB = 20000    # PRAGMA cache_size (negative value = KiB)
+DB_MMAP_SIZE = 256 * 1024 * 1024  # PRAGMA mmap_size in bytes
+
+# Debug mode adds diagnostic response headers (e.g. X-DB-Stats)
+DEBUG = os.environ.get('FAST_CHECKLIST_DEBUG', '') not in ('', '0')
+SLOW_QUERY_MS = float(os.environ.get('FAST_CHECKLIST_SLOW_QUERY_MS', 100))
+
+# Rendered fragment cache (see fragment_cache.py)
+FRAGMENT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+FRAGMENT_CACHE_MAX_ENTRIES = 20000
+
+# Checklist object cache (see checklist_list.get_checklist_with_steps)
+CHECKLIST_CACHE_MAX_STEPS = 200000
+CHECKLIST_CACHE_MAX_ENTRIES = 5000
+
+# Rows per page for keyset-paginated lists (see pagination.py)
+PAGE_SIZE = 50
+
+# Chunked streaming of long lists for htmx requests (see streaming.py)
+STREAM_HTMX_RESPONSES = True
+STREAM_CHUNK_ROWS = 50
+
+# Template history: a full snapshot every N versions, deltas in between (see template_history.py)
+HISTORY_SNAPSHOT_INTERVAL = 20
+
+# Daily rollups: background refresh interval in seconds, 0 to disable (see rollups.py)
+ROLLUP_INTERVAL_SECONDS = int(os.environ.get('FAST_CHECKLIST_ROLLUP_INTERVAL', 60))
+
+# Response compression (see compression.py)
+COMPRESSION_MIN_BYTES = 500
+COMPRESSION_CACHE_MAX_BYTES = 16 * 1024 * 1024
+COMPRESSION_CACHE_MAX_ENTRIES = 10000
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Serving (see main.py; gunicorn.conf.py for gunicorn)
+SERVER_HOST = os.environ.get('FAST_CHECKLIST_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('PORT', 5001))
+SERVER_WORKERS = int(os.environ.get('FAST_CHECKLIST_WORKERS', os.cpu_count() or 1))
@@ -1,17 +1,159 @@
 import sqlite3
+import threading
+import time
+from collections import deque
 from pathlib import Path
 
+from config import (DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_BUSY_TIMEOUT_MS,
+                    DB_CACHE_SIZE_KB, DB_MMAP_SIZE)
+from query_stats import InstrumentedCursor, record_checkout, record_connection_opened
+
 DB_PATH = Path('data/checklists.db')
 
+
+def configure_connection(conn):
+    """Apply the pragmas every pooled connection is expected to have"""
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+    return conn
+
+
+class ConnectionPool:
+    """A bounded pool of long-lived, pre-configured SQLite connections.
+
+    Connections are created lazily up to `size`; once that many are checked out,
+    `acquire` blocks until one is released (or `timeout` seconds pass)."""
+    def __init__(self, db_path=DB_PATH, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = deque()
+        self._open = 0
+        self._cond = threading.Condition()
+        self.closed = False
+        self.tracer = None  # optional sqlite3 trace callback for checked-out connections
+        self.stats = dict(hits=0, misses=0, waits=0, wait_time=0.0, timeouts=0)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        record_connection_opened()
+        return configure_connection(conn)
+
+    def acquire(self):
+        """Check out a connection, creating one if the pool isn't full yet"""
+        with self._cond:
+            if self.closed:
+                raise RuntimeError("Connection pool is closed")
+            if self._idle:
+                self.stats['hits'] += 1
+                return self._idle.pop()
+            if self._open < self.size:
+                self._open += 1
+                self.stats['misses'] += 1
+                create = True
+            else:
+                create = False
+                start = time.perf_counter()
+                self.stats['waits'] += 1
+                got_one = self._cond.wait_for(lambda: self._idle or self.closed, timeout=self.timeout)
+                self.stats['wait_time'] += time.perf_counter() - start
+                if self.closed:
+                    raise RuntimeError("Connection pool is closed")
+                if not got_one:
+                    self.stats['timeouts'] += 1
+                    raise TimeoutError(f"No database connection available after {self.timeout}s")
+                self.stats['hits'] += 1
+                return self._idle.pop()
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool; it must not be inside a transaction.
+        Once the pool is closed, the connection is closed instead."""
+        with self._cond:
+            if not self.closed:
+                self._idle.append(conn)
+                self._cond.notify()
+                return
+            self._open -= 1
+        conn.close()
+
+    def discard(self, conn):
+        """Close a connection that can't be reused and free its slot"""
+        try:
+            conn.close()
+        finally:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+
+    def close(self):
+        """Close every idle connection; checked-out ones are closed when released"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+            while self._idle:
+                self._idle.pop().close()
+                self._open -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path=DB_PATH):
+    """Return the process-wide pool for `db_path`, creating it on first use"""
+    key = str(db_path)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path)
+        return _pools[key]
+
+def pool_stats():
+    """Hit/miss/wait counters for every pool, keyed by database path"""
+    with _pools_lock:
+        return {k: dict(p.stats, open=p._open, idle=len(p._idle), size=p.size)
+                for k, p in _pools.items()}
+
+def close_pools():
+    """Close and forget every pool, e.g. before deleting the database file"""
+    with _pools_lock:
+        for p in _pools.values():
+            p.close()
+        _pools.clear()
+
+
 class DBConnection:
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
         
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row
-        return self.conn.cursor()
+        self.pool = get_pool(self.db_path)
+        self.conn = self.pool.acquire()
+        record_checkout()
+        if self.pool.tracer:
+            self.conn.set_trace_callback(self.pool.tracer)
+        self.cursor = self.conn.cursor(InstrumentedCursor)
+        return self.cursor
         
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.conn.commit()
-        self.conn.close()
+        self.cursor.finish()
+        if self.pool.tracer:
+            self.conn.set_trace_callback(None)
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        except sqlite3.Error:
+            self.pool.discard(self.conn)
+            raise
+        self.pool.release(self.conn)
@@ -0,0 +1,118 @@
+"""Secondary indexes for the hot query paths, and a query-plan check.
+
+Run `python db_indexes.py` to create missing indexes, or
+`python db_indexes.py --check` to fail if any data-module query does a full
+table scan according to EXPLAIN QUERY PLAN."""
+import argparse
+import re
+import sys
+
+from db_connection import DBConnection, get_pool
+
+# name -> (table, columns)
+INDEXES = {
+    'idx_steps_checklist_order': ('steps', ('checklist_id', 'order_index')),
+    'idx_step_references_step': ('step_references', ('step_id',)),
+    'idx_instance_steps_instance_status': ('instance_steps', ('instance_id', 'status')),
+    'idx_checklist_instances_checklist_created': ('checklist_instances', ('checklist_id', 'created_at')),
+    'idx_checklist_instances_created': ('checklist_instances', ('created_at',)),
+    'idx_checklist_instances_checklist_status_created': ('checklist_instances', ('checklist_id', 'status', 'created_at')),
+    'idx_checklists_created': ('checklists', ('created_at',)),
+    'idx_tags_path': ('tags', ('path',)),
+    'idx_tag_closure_descendant': ('tag_closure', ('descendant_id', 'ancestor_id')),
+    'idx_checklist_tags_tag': ('checklist_tags', ('tag_id', 'checklist_id')),
+}
+
+def ensure_indexes():
+    """Create any missing index whose table exists; returns the names created"""
+    created = []
+    with DBConnection() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {row['name'] for row in cursor.fetchall()}
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        existing = {row['name'] for row in cursor.fetchall()}
+        for name, (table, columns) in INDEXES.items():
+            if table not in tables or name in existing:
+                continue
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+            created.append(name)
+    return created
+
+
+def _sample_id(cursor, table):
+    cursor.execute(f"SELECT id FROM {table} LIMIT 1")
+    row = cursor.fetchone()
+    return row['id'] if row else 1
+
+def _hot_reads():
+    """The read paths the app runs on every page, with sample arguments"""
+    from checklist_list import load_checklist_with_steps, get_checklists_page
+    from checklist_edit import get_step, get_step_reference, get_checklist_references
+    from instance_functions import (get_instance_with_steps, get_instances_page,
+                                    get_instance_step)
+    from pagination import encode_cursor
+    from tags import get_tags, get_checklist_tags
+    with DBConnection() as cursor:
+        checklist_id = _sample_id(cursor, 'checklists')
+        step_id = _sample_id(cursor, 'steps')
+        instance_id = _sample_id(cursor, 'checklist_instances')
+        instance_step_id = _sample_id(cursor, 'instance_steps')
+        tag_id = _sample_id(cursor, 'tags')
+    after = encode_cursor('9999', 0)
+    return [
+        (load_checklist_with_steps, (checklist_id,)),
+        (get_checklists_page, ()),
+        (get_checklists_page, (after, 'asc')),
+        (get_checklists_page, (None, 'desc', 50, tag_id)),
+        (get_tags, ()),
+        (get_checklist_tags, (checklist_id,)),
+        (get_checklist_references, (checklist_id,)),
+        (get_step, (step_id,)),
+        (get_step_reference, (step_id,)),
+        (get_instances_page, (checklist_id,)),
+        (get_instances_page, (checklist_id, 'Completed', after)),
+        (get_instance_with_steps, (instance_id,)),
+        (get_instance_step, (instance_step_id,)),
+    ]
+
+# "SCAN steps" / "SCAN s" is a full table scan; "SCAN ci USING INDEX ..." is not
+_FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+def find_full_scans():
+    """Run the hot read paths, EXPLAIN each statement they issue, and return
+    (function name, sql, plan detail) for every full table scan"""
+    pool = get_pool()
+    calls = _hot_reads()
+    scans = []
+    for fn, args in calls:
+        statements = []
+        pool.tracer = statements.append
+        try:
+            fn(*args)
+        finally:
+            pool.tracer = None
+        with DBConnection() as cursor:
+            for sql in statements:
+                if not sql.lstrip().upper().startswith('SELECT'):
+                    continue
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                for row in cursor.fetchall():
+                    if _FULL_SCAN.match(row['detail']):
+                        scans.append((fn.__name__, ' '.join(sql.split()), row['detail']))
+    return scans
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--check', action='store_true', help='Fail on full table scans')
+    args = parser.parse_args()
+
+    from migrations import migrate
+    migrate()
+    created = ensure_indexes()
+    print(f"Created indexes: {', '.join(created)}" if created else "All indexes present")
+    if args.check:
+        scans = find_full_scans()
+        for name, sql, detail in scans:
+            print(f"FULL SCAN in {name}: {detail}\n    {sql}")
+        sys.exit(1 if scans else 0)
@@ -0,0 +1,49 @@
+"""Conditional GETs for read-only pages.
+
+A page's ETag is built from the version counters it depends on (see
+versions.py), so a route can answer `If-None-Match` with a 304 after the version
+lookup alone, before loading or rendering anything:
+
+    etag = page_etag(req, 'checklist', checklist_id, version)
+    if not_modified(req, etag):
+        return NotModified(etag)
+    return render_page(...), *etag_headers(etag)
+"""
+from starlette.responses import Response
+from fasthtml.common import HttpHeader
+
+VARY = 'HX-Request, HX-History-Restore-Request'
+
+def is_fragment_request(req):
+    """htmx requests get a bare fragment, everything else FastHTML's full page"""
+    return 'hx-request' in req.headers and 'hx-history-restore-request' not in req.headers
+
+def page_etag(req, *parts):
+    """Weak ETag for `parts` (None if any part is None, i.e. the thing doesn't exist)
+    The fragment and the full page of a URL get different tags."""
+    if any(part is None for part in parts):
+        return None
+    kind = 'f' if is_fragment_request(req) else 'p'
+    return 'W/"' + '-'.join(str(part) for part in (*parts, kind)) + '"'
+
+def not_modified(req, etag):
+    """True if the request's If-None-Match already covers `etag`"""
+    if etag is None:
+        return False
+    header = req.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # Weak comparison: ignore W/ prefixes on either side
+    tags = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return etag.removeprefix('W/') in tags
+
+def etag_headers(etag):
+    """Headers for a 200 response: the ETag, and revalidate on every use"""
+    if etag is None:
+        return ()
+    return HttpHeader('ETag', etag), HttpHeader('Cache-Control', 'no-cache')
+
+def NotModified(etag):
+    return Response(status_code=304, headers={'etag': etag, 'cache-control': 'no-cache', 'vary': VARY})
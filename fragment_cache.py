@@ -0,0 +1,110 @@
+"""LRU cache of rendered HTML fragments.
+
+Entries are keyed by (kind, checklist id, *parts) and tagged with the checklist
+version they were rendered from (see versions.py); a lookup with a newer version
+is a miss and the stale entry is replaced. The cache is capped by both entry
+count and total bytes."""
+import threading
+from collections import OrderedDict
+
+from fastcore.xml import NotStr, to_xml
+
+from config import FRAGMENT_CACHE_MAX_BYTES, FRAGMENT_CACHE_MAX_ENTRIES
+
+
+class LRUCache:
+    """Thread-safe LRU mapping capped by entry count and total value size"""
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.bytes = 0
+        self._data = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+        self.stats = dict(hits=0, misses=0, evictions=0)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.stats['misses'] += 1
+                return default
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return item[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes or len(self._data) > self.max_entries:
+                evicted_key, (_, evicted_size) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.stats['evictions'] += 1
+                self._evicted(evicted_key)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                self.bytes -= item[1]
+                self._evicted(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self): return len(self._data)
+
+    def _evicted(self, key): pass
+
+
+class Fragment(NotStr):
+    """Pre-rendered HTML that can be embedded in FT components or returned from a route"""
+    def __ft__(self): return NotStr(self)
+
+
+class FragmentCache(LRUCache):
+    def __init__(self, max_bytes, max_entries):
+        super().__init__(max_bytes, max_entries)
+        self._by_checklist = {}  # checklist id -> set of keys, for invalidate()
+
+    def put(self, key, value, size):
+        with self._lock:
+            self._by_checklist.setdefault(key[1], set()).add(key)
+        super().put(key, value, size)
+
+    def _evicted(self, key):
+        keys = self._by_checklist.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_checklist[key[1]]
+
+    def render(self, kind, checklist_id, version, *parts, render):
+        """Return the cached fragment for this key and version, or call
+        `render()` and cache its HTML. With version None nothing is cached."""
+        if version is None:
+            return render()
+        key = (kind, checklist_id, *parts)
+        hit = self.get(key)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+        html = Fragment(to_xml(render()))
+        self.put(key, (version, html), len(html))
+        return html
+
+    def invalidate(self, checklist_id):
+        """Drop every fragment for a checklist (e.g. after it's deleted)"""
+        with self._lock:
+            keys = list(self._by_checklist.get(checklist_id, ()))
+        for key in keys:
+            self.pop(key)
+
+
+fragments = FragmentCache(FRAGMENT_CACHE_MAX_BYTES, FRAGMENT_CACHE_MAX_ENTRIES)
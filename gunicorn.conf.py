@@ -0,0 +1,31 @@
+"""gunicorn settings for production:
+
+    gunicorn 'main:create_app()' -c gunicorn.conf.py
+
+The app is built (schema migrated, assets built) once in the master and the
+workers are forked from it, after the master has closed its database
+connections, so each worker opens its own pool on first use. The master
+refuses to start if any static asset isn't vendored."""
+from config import SERVER_HOST, SERVER_PORT, SERVER_WORKERS
+
+bind = f"{SERVER_HOST}:{SERVER_PORT}"
+workers = SERVER_WORKERS
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+timeout = 60
+graceful_timeout = 30
+
+def on_starting(server):
+    # Production serves every asset itself, never from a CDN
+    from static_assets import require_assets
+    require_assets()
+
+def pre_fork(server, worker):
+    # SQLite connections must not be carried across fork: close the master's
+    # so each worker opens its own pool on first use
+    from async_db import shutdown_executor
+    from db_connection import close_pools
+    from versions import watcher
+    close_pools()
+    watcher.close()
+    shutdown_executor()
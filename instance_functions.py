@@ -2,20 +2,27 @@ from fasthtml.common import *
 from fasthtml.components import *
 from monsterui.all import *
 from datetime import datetime
+from urllib.parse import urlencode
 from fastcore.basics import AttrDict
 from db_connection import DBConnection
 
 from models import Checklist
 from checklist_list import get_checklist_with_steps
+from config import PAGE_SIZE, STREAM_CHUNK_ROWS
+from pagination import keyset_sql, split_page, normalize_order, encode_cursor
+from streaming import STREAM_SLOT
+from step_analytics import record_step_event
+from live_updates import hub, instance_topic
+
+INSTANCE_STATUSES = ('Not Started', 'Active', 'Completed')
 
 
 # Your instance functions here...
 
 # Data access functions
-def get_instance_with_steps(instance_id):
-    """Get a complete instance with all its steps and related information"""
+def get_instance(instance_id):
+    """Get an instance's details (without its steps)"""
     with DBConnection() as cursor:
-        # Get instance details
         cursor.execute("""
             SELECT ci.*, c.title as checklist_title, c.id as checklist_id
             FROM checklist_instances ci
@@ -26,25 +33,6 @@ def get_instance_with_steps(instance_id):
         
         if not instance:
             return None
-            
-        # Get steps with their original text and current status
-        cursor.execute("""
-            SELECT 
-                i_steps.id as instance_step_id,
-                i_steps.status,
-                i_steps.notes,
-                i_steps.updated_at,
-                s.text as step_text,
-                sr.url as reference_url,
-                s.order_index
-            FROM instance_steps i_steps
-            JOIN steps s ON i_steps.step_id = s.id
-            LEFT JOIN step_references sr ON s.id = sr.step_id
-            WHERE i_steps.instance_id = ?
-            ORDER BY s.order_index
-        """, (instance_id,))
-
-        steps = cursor.fetchall()
         
         return AttrDict(
             id=instance['id'],
@@ -55,50 +43,100 @@ def get_instance_with_steps(instance_id):
             created_at=instance['created_at'],
             target_date=instance['target_date'],
             checklist_title=instance['checklist_title'],
-            steps=[AttrDict(dict(step)) for step in steps]
+            steps=[]
         )
 
-def get_filtered_instances(checklist_id=None, status=None):
-    """Get instances with optional filtering"""
+def iter_instance_steps(instance_id, chunk_rows=STREAM_CHUNK_ROWS):
+    """Yield an instance's steps in order, reading `chunk_rows` at a time.
+    The connection goes back to the pool between chunks, so a slow client
+    reading a streamed response never holds one."""
+    after = None  # keys can be negative (steps inserted before the first one)
+    while True:
+        with DBConnection() as cursor:
+            # Get steps with their original text and current status
+            cursor.execute(f"""
+                SELECT 
+                    i_steps.id as instance_step_id,
+                    i_steps.status,
+                    i_steps.notes,
+                    i_steps.updated_at,
+                    s.text as step_text,
+                    sr.url as reference_url,
+                    s.order_index
+                FROM instance_steps i_steps
+                JOIN steps s ON i_steps.step_id = s.id
+                LEFT JOIN step_references sr ON s.id = sr.step_id
+                WHERE i_steps.instance_id = ? {"AND (s.order_index, i_steps.id) > (?, ?)" if after else ""}
+                ORDER BY s.order_index, i_steps.id
+                LIMIT ?
+            """, (instance_id, *(after or ()), chunk_rows))
+            steps = [AttrDict(dict(step)) for step in cursor.fetchall()]
+        yield from steps
+        if len(steps) < chunk_rows:
+            return
+        after = (steps[-1].order_index, steps[-1].instance_step_id)
+
+def get_instance_with_steps(instance_id):
+    """Get a complete instance with all its steps and related information"""
+    instance = get_instance(instance_id)
+    if instance:
+        instance.steps = list(iter_instance_steps(instance_id))
+    return instance
+
+def get_filtered_instances(checklist_id=None, status=None, after=None, order='desc', limit=None):
+    """Get instances with optional filtering
+    `after`/`order`/`limit` page through them by (created_at, id), see pagination.py"""
     with DBConnection() as cursor:
-        query = """
-            SELECT 
-                ci.id,
-                ci.name,
-                ci.status,
-                ci.created_at,
-                ci.target_date,
-                c.title as checklist_title,
-                c.id as checklist_id,
-                (
-                    SELECT COUNT(*) 
-                    FROM instance_steps 
-                    WHERE instance_id = ci.id AND status = 'Completed'
-                ) as completed_steps,
-                (
-                    SELECT COUNT(*) 
-                    FROM instance_steps 
-                    WHERE instance_id = ci.id
-                ) as total_steps
-            FROM checklist_instances ci
-            JOIN checklists c ON ci.checklist_id = c.id
-            WHERE 1=1
-        """
+        query = INSTANCE_ROW_SELECT + " WHERE 1=1"
         params = []
         
         if checklist_id is not None:
-            query += " AND c.id = ?"
+            query += " AND ci.checklist_id = ?"
             params.append(checklist_id)
             
         if status is not None:
             query += " AND ci.status = ?"
             params.append(status)
-            
-        query += " ORDER BY ci.created_at DESC"
+        
+        where, keyset_params, order_by = keyset_sql('ci', order, after)
+        query += where + order_by
+        params.extend(keyset_params)
+        
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
         
         cursor.execute(query, params)
-        instances = cursor.fetchall()
-        return [AttrDict(dict(instance)) for instance in instances]
+        return [AttrDict(dict(instance)) for instance in cursor.fetchall()]
+
+
+# Columns for instance_row
+INSTANCE_ROW_SELECT = """
+    SELECT 
+        ci.id,
+        ci.name,
+        ci.status,
+        ci.created_at,
+        ci.target_date,
+        c.title as checklist_title,
+        c.id as checklist_id,
+        ci.completed_steps,
+        ci.total_steps
+    FROM checklist_instances ci
+    JOIN checklists c ON ci.checklist_id = c.id
+"""
+
+def get_instance_row(instance_id):
+    """One instance as listed in the instances table"""
+    with DBConnection() as cursor:
+        cursor.execute(INSTANCE_ROW_SELECT + " WHERE ci.id = ?", (instance_id,))
+        row = cursor.fetchone()
+        return AttrDict(dict(row)) if row else None
+
+def get_instances_page(checklist_id=None, status=None, after=None, order='desc', limit=PAGE_SIZE):
+    """One page of instances; returns (instances, next cursor)"""
+    instances = get_filtered_instances(checklist_id, status, after, order, limit + 1)
+    return split_page(instances, limit)
 
 
 def create_new_instance(checklist_id, name, description=None, target_date=None):
@@ -128,27 +166,148 @@ def get_instance_step(step_id):
     """Get a single instance step with its details"""
     with DBConnection() as cursor:
         cursor.execute("""
-            SELECT i_steps.*, s.text as step_text
+            SELECT i_steps.*, s.text as step_text, ci.checklist_id
             FROM instance_steps i_steps
             JOIN steps s ON i_steps.step_id = s.id
+            JOIN checklist_instances ci ON ci.id = i_steps.instance_id
             WHERE i_steps.id = ?
         """, (step_id,))
         result = cursor.fetchone()
         return AttrDict(dict(result)) if result else None
 
 def update_instance_step_status(step_id, new_status):
-    """Update the status of an instance step"""
+    """Update the status of an instance step, logging the change to instance_step_events
+    and sending it to live viewers of the instance"""
+    with DBConnection() as cursor:
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                SELECT i_steps.status, i_steps.instance_id, ci.version
+                FROM instance_steps i_steps
+                JOIN checklist_instances ci ON ci.id = i_steps.instance_id
+                WHERE i_steps.id = ?
+            """, (step_id,))
+            row = cursor.fetchone()
+            if not row:
+                cursor.execute("ROLLBACK")
+                return False
+            
+            cursor.execute("""
+                UPDATE instance_steps 
+                SET status = ?, updated_at = datetime('now')
+                WHERE id = ?
+            """, (new_status, step_id))
+            changed = row['status'] != new_status
+            if changed:
+                record_step_event(cursor, step_id, row['status'])
+            # The version change this write made, for subscribers in other processes
+            cursor.execute("SELECT version FROM checklist_instances WHERE id = ?", (row['instance_id'],))
+            versions = (row['version'], cursor.fetchone()[0])
+            
+            cursor.execute("COMMIT")
+            
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    publish_step(row['instance_id'], step_id, versions, changed)
+    return True
+
+def publish_step(instance_id, step_id, versions, changed=True):
+    """Broadcast a step's new state to everyone viewing its instance, rendered once.
+    An unchanged status still bumps the instance version, so subscribers are told
+    about that too (with nothing to show) rather than mistaking it for another
+    process's change."""
+    topic = instance_topic(instance_id)
+    if not hub.has_subscribers(topic):
+        return
+    step = get_instance_step(step_id) if changed else None
+    message = sse_message(render_instance_step(step, oob=True), event='step') if step else None
+    hub.publish(topic, message, versions)
+
+
+# Materialized progress counters
+# checklist_instances.completed_steps/total_steps are kept current by triggers on
+# instance_steps, so listings never have to count step rows.
+PROGRESS_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS instance_steps_progress_insert
+    AFTER INSERT ON instance_steps
+    BEGIN
+        UPDATE checklist_instances
+        SET total_steps = total_steps + 1,
+            completed_steps = completed_steps + (NEW.status = 'Completed')
+        WHERE id = NEW.instance_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS instance_steps_progress_delete
+    AFTER DELETE ON instance_steps
+    BEGIN
+        UPDATE checklist_instances
+        SET total_steps = total_steps - 1,
+            completed_steps = completed_steps - (OLD.status = 'Completed')
+        WHERE id = OLD.instance_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS instance_steps_progress_update
+    AFTER UPDATE OF status ON instance_steps
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        UPDATE checklist_instances
+        SET completed_steps = completed_steps
+                              + (NEW.status = 'Completed')
+                              - (OLD.status = 'Completed')
+        WHERE id = NEW.instance_id;
+    END;
+"""
+
+def ensure_instance_progress_counters():
+    """Add the progress counter columns and triggers if they're missing"""
     with DBConnection() as cursor:
         cursor.execute("""
-            UPDATE instance_steps 
-            SET status = ?, updated_at = datetime('now')
-            WHERE id = ?
-        """, (new_status, step_id))
-        return cursor.rowcount > 0
+            SELECT name FROM pragma_table_info('checklist_instances')
+        """)
+        columns = {row['name'] for row in cursor.fetchall()}
+        if not columns:
+            return False  # table not created yet
+        added = False
+        for column in ('completed_steps', 'total_steps'):
+            if column not in columns:
+                cursor.execute(f"""
+                    ALTER TABLE checklist_instances 
+                    ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0
+                """)
+                added = True
+        cursor.executescript(PROGRESS_TRIGGERS)
+    if added:
+        recompute_instance_progress()
+    return True
+
+def recompute_instance_progress(instance_ids=None):
+    """Recompute the progress counters from instance_steps in bulk
+    Returns the number of instances updated"""
+    with DBConnection() as cursor:
+        query = """
+            UPDATE checklist_instances
+            SET total_steps = (
+                    SELECT COUNT(*) FROM instance_steps 
+                    WHERE instance_id = checklist_instances.id
+                ),
+                completed_steps = (
+                    SELECT COUNT(*) FROM instance_steps 
+                    WHERE instance_id = checklist_instances.id AND status = 'Completed'
+                )
+        """
+        params = []
+        if instance_ids is not None:
+            query += f" WHERE id IN ({','.join('?' * len(instance_ids))})"
+            params = list(instance_ids)
+        cursor.execute(query, params)
+        return cursor.rowcount
 
 
-def create_instance_modal(checklist_id):
-    """Create the modal for new instance creation"""
+def create_instance_modal(checklist_id, status=None, order='desc'):
+    """Create the modal for new instance creation; the hidden fields tell the
+    route which view the list is showing"""
     return Modal(
         ModalTitle("Create New Instance"),
         ModalBody(
@@ -156,9 +315,17 @@ def create_instance_modal(checklist_id):
                 LabelInput("Name", id="name", placeholder="Instance Name", required=True),
                 LabelTextArea("Description", id="description", placeholder="Optional description"),
                 LabelInput("Target Date", id="target_date", type="date"),
+                Hidden(name="view_status", value=status or ""),
+                Hidden(name="view_order", value=order),
                 action=f"/checklist/{checklist_id}/instance/create",
                 method="POST",
-                id="new-instance-form"
+                id="new-instance-form",
+                # With htmx, only the new row comes back, prepended to the table
+                # (or just a notice when the current view wouldn't show it there)
+                **{'hx-post': f'/checklist/{checklist_id}/instance/create',
+                   'hx-target': '#instances-body',
+                   'hx-swap': 'afterbegin',
+                   'hx-on::after-request': "if (event.detail.successful) { this.reset(); UIkit.modal('#new-instance-modal').hide(); }"}
             )
         ),
         footer=DivRAligned(
@@ -176,35 +343,94 @@ def create_instance_modal(checklist_id):
 
 # Render functions
 
-def render_instance_step(step):
-    """Render a single instance step with consistent styling"""
-    return Div(
-        P(step.step_text, cls="uk-margin-remove uk-flex-1"),
-        Form(
-            Select(
-                Option("Not Started", selected=step.status=="Not Started"),
-                Option("In Progress", selected=step.status=="In Progress"),
-                Option("Completed", selected=step.status=="Completed"),
-                cls="uk-select uk-form-small uk-width-small uk-margin-right",
-                name="status"
+def render_instance_step(step, oob=False):
+    """One step of the instance view from a `get_instance_step` row;
+    `oob` marks it for an out-of-band swap (live updates)"""
+    return step_container(step.checklist_id, step.instance_id, step.id, step.step_text, step.status,
+                          **({'hx-swap-oob': 'true'} if oob else {}))
+
+
+def instance_row(instance):
+    """A single row of the instances table"""
+    return Tr(
+        Td(instance.checklist_title),
+        Td(instance.name),
+        Td(
+            Span(
+                instance.status,
+                cls=f"uk-label uk-label-{'success' if instance.status == 'Completed' else 'warning' if instance.status == 'Active' else 'default'}"
+            )
+        ),
+        Td(
+            Div(
+                Div(
+                    style=f"width: {(instance.completed_steps/instance.total_steps)*100 if instance.total_steps else 0}%",
+                    cls="uk-progress-bar"
+                ),
+                cls="uk-progress"
             ),
-            Button("Save",
-                  cls="uk-button uk-button-small uk-button-primary",
-                  type="submit"),
-            cls="uk-flex uk-flex-middle",
-            **{
-                'hx-put': f'/instance-step/{step.id}/status',
-                'hx-target': f'#step-container-{step.id}'
-            }
+            f"{instance.completed_steps}/{instance.total_steps} steps"
+        ),
+        Td(instance.created_at[:10]),
+        Td(instance.target_date[:10] if instance.target_date else ""),
+        Td(
+            A("Continue", 
+              cls="uk-button uk-button-small uk-button-primary",
+              **{
+                  'hx-get': f'/checklist/{instance.checklist_id}/instance/{instance.id}',
+                  'hx-target': '#main-content',
+                  'hx-push-url': 'true'
+              })
+        )
+    )
+
+
+def instance_rows(checklist_id=None, status=None, after=None, order='desc', limit=PAGE_SIZE):
+    """Rows for one page of instances, plus a sentinel row that loads the next
+    page when revealed if there's more"""
+    instances = get_filtered_instances(checklist_id, status, after, order, limit + 1)
+    rows = [instance_row(instance) for instance in instances[:limit]]
+    if len(instances) > limit:
+        last = instances[limit - 1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+        query = urlencode({'after': next_cursor, 'order': order, **({'status': status} if status else {})})
+        rows.append(Tr(
+            Td("Loading more...", colspan="7", cls="uk-text-muted uk-text-center"),
+            hx_get=f'/checklist/{checklist_id}/instances/page?{query}',
+            hx_trigger='revealed',
+            hx_swap='outerHTML'
+        ))
+    return rows
+
+
+def render_instance_filters(checklist_id, status=None, order='desc'):
+    """Status filter and sort order controls; changing either reloads the list"""
+    return Form(
+        Select(
+            Option("All statuses", value="", selected=not status),
+            *(Option(s, value=s, selected=status == s) for s in INSTANCE_STATUSES),
+            cls="uk-select uk-form-small uk-width-small uk-margin-small-right",
+            name="status"
+        ),
+        Select(
+            Option("Newest first", value="desc", selected=order == 'desc'),
+            Option("Oldest first", value="asc", selected=order == 'asc'),
+            cls="uk-select uk-form-small uk-width-small",
+            name="order"
         ),
-        cls="uk-flex uk-flex-middle uk-flex-between",
-        id=f'step-container-{step.id}'
+        cls="uk-flex uk-flex-middle uk-margin-bottom",
+        **{
+            'hx-get': f'/checklist/{checklist_id}/instances',
+            'hx-trigger': 'change',
+            'hx-target': '#main-content',
+            'hx-push-url': 'true'
+        }
     )
 
 
-def render_instances(checklist_id=None, status=None):
+def render_instances(checklist_id=None, status=None, order='desc'):
     """Render instances view with optional filtering"""
-    instances = get_filtered_instances(checklist_id, status)
+    order = normalize_order(order)
     
     # Get checklist details if checklist_id is provided
     header_content = []
@@ -212,11 +438,19 @@ def render_instances(checklist_id=None, status=None):
         checklist = get_checklist_with_steps(checklist_id)
         header_content = [
             Div(
-                A("← Back to Checklist", 
-                  cls="uk-link-text", 
-                  **{'hx-get': f'/checklist/{checklist_id}', 
-                     'hx-target': '#main-content',
-                     'hx-push-url': 'true'}),
+                Div(
+                    A("← Back to Checklist", 
+                      cls="uk-link-text", 
+                      **{'hx-get': f'/checklist/{checklist_id}', 
+                         'hx-target': '#main-content',
+                         'hx-push-url': 'true'}),
+                    A("Analytics", 
+                      cls="uk-link-text", 
+                      **{'hx-get': f'/checklist/{checklist_id}/analytics', 
+                         'hx-target': '#main-content',
+                         'hx-push-url': 'true'}),
+                    cls="uk-flex uk-flex-between"
+                ),
                 H2(checklist.title, cls="uk-heading-small uk-margin-remove-bottom"),
                 cls="uk-margin-small-bottom"
             )
@@ -236,7 +470,9 @@ def render_instances(checklist_id=None, status=None):
             cls="uk-flex uk-flex-middle uk-flex-between uk-margin-medium-bottom"
         ),
         
-        # Rest of the function remains the same...
+        render_instance_filters(checklist_id, status, order) if checklist_id else "",
+        Div(id='instances-status', cls='uk-text-meta'),
+        
         Table(
             Thead(
                 Tr(
@@ -249,45 +485,13 @@ def render_instances(checklist_id=None, status=None):
                     Th("Actions")
                 )
             ),
-            Tbody(*(
-                Tr(
-                    Td(instance.checklist_title),
-                    Td(instance.name),
-                    Td(
-                        Span(
-                            instance.status,
-                            cls=f"uk-label uk-label-{'success' if instance.status == 'Completed' else 'warning' if instance.status == 'Active' else 'default'}"
-                        )
-                    ),
-                    Td(
-                        Div(
-                            Div(
-                                style=f"width: {(instance.completed_steps/instance.total_steps)*100 if instance.total_steps else 0}%",
-                                cls="uk-progress-bar"
-                            ),
-                            cls="uk-progress"
-                        ),
-                        f"{instance.completed_steps}/{instance.total_steps} steps"
-                    ),
-                    Td(instance.created_at[:10]),
-                    Td(instance.target_date[:10] if instance.target_date else ""),
-                    Td(
-                        A("Continue", 
-                          cls="uk-button uk-button-small uk-button-primary",
-                          **{
-                              'hx-get': f'/checklist/{instance.checklist_id}/instance/{instance.id}',
-                              'hx-target': '#main-content',
-                              'hx-push-url': 'true'
-                          })
-                    )
-                )
-                for instance in instances
-            )),
+            Tbody(*instance_rows(checklist_id, status, order=order),
+                  id="instances-body"),
             cls="uk-table uk-table-divider uk-table-middle uk-table-hover"
         ),
         
         # Add the modal
-        create_instance_modal(checklist_id) if checklist_id else "",
+        create_instance_modal(checklist_id, status, order) if checklist_id else "",
         
         id="main-content",
         cls="uk-container uk-margin-top"
@@ -295,10 +499,59 @@ def render_instances(checklist_id=None, status=None):
 
 
 
-def render_instance_view(instance_id):
-    instance = get_instance_with_steps(instance_id)
+def instance_in_view(instance, status=None, order='desc'):
+    """Whether a newly created instance belongs at the top of the list as filtered"""
+    return normalize_order(order) == 'desc' and (not status or instance.status == status)
+
+def render_instances_status(message):
+    """Small out-of-band notice above the instances table"""
+    return Div(message, id='instances-status', cls='uk-text-meta', hx_swap_oob='true')
+
+
+def instance_step_container(instance, step):
+    """One step of the instance view, from an `iter_instance_steps` row"""
+    return step_container(instance.checklist_id, instance.id, step.instance_step_id, step.step_text, step.status)
+
+def step_container(checklist_id, instance_id, instance_step_id, text, status, **kwargs):
+    """A step with its status form; saving swaps in the re-rendered container"""
+    return Div(
+        Div(
+            P(text, cls="uk-margin-remove uk-flex-1"),
+            Form(
+                Select(
+                    Option("Not Started", selected=status=="Not Started"),
+                    Option("In Progress", selected=status=="In Progress"),
+                    Option("Completed", selected=status=="Completed"),
+                    cls="uk-select uk-form-small uk-width-small uk-margin-right",
+                    name="status"
+                ),
+                Button("Save",
+                      cls="uk-button uk-button-small uk-button-primary",
+                      type="submit"),
+                cls="uk-flex uk-flex-middle",
+                **{
+                    'hx-put': f'/checklist/{checklist_id}/instance/{instance_id}/step/{instance_step_id}/status',
+                    'hx-target': f'#step-container-{instance_step_id}',
+                    'hx-swap': 'outerHTML'
+                }
+            ),
+            cls="uk-flex uk-flex-middle uk-flex-between"
+        ),
+        cls="uk-margin-medium-bottom uk-padding-small uk-box-shadow-small",
+        id=f'step-container-{instance_step_id}',
+        **kwargs
+    )
+
+def render_instance_view(instance_id, steps=None, instance=None):
+    """Render one instance and its steps
+    Pass `steps=[STREAM_SLOT]` to leave the steps list for streaming (see stream_instance_view),
+    and `instance` if it has been read already"""
+    if instance is None:
+        instance = get_instance(instance_id) if steps is not None else get_instance_with_steps(instance_id)
     if not instance:
         return Div("Instance not found", cls="uk-alert uk-alert-danger")
+    if steps is None:
+        steps = [instance_step_container(instance, step) for step in instance.steps]
     
     return Div(
         # Header with updated back button
@@ -315,36 +568,30 @@ def render_instance_view(instance_id):
         ),
         
         # Steps list with save buttons
-        Div(*(
-            Div(
-                Div(
-                    P(step.step_text, cls="uk-margin-remove uk-flex-1"),
-                    Form(
-                        Select(
-                            Option("Not Started", selected=step.status=="Not Started"),
-                            Option("In Progress", selected=step.status=="In Progress"),
-                            Option("Completed", selected=step.status=="Completed"),
-                            cls="uk-select uk-form-small uk-width-small uk-margin-right",
-                            name="status"
-                        ),
-                        Button("Save",
-                              cls="uk-button uk-button-small uk-button-primary",
-                              type="submit"),
-                        cls="uk-flex uk-flex-middle",
-                        **{
-                            'hx-put': f'/checklist/{instance.checklist_id}/instance/{instance.id}/step/{step.instance_step_id}/status',
-                            'hx-target': f'#step-container-{step.instance_step_id}'
-                        }
-                    ),
-                    cls="uk-flex uk-flex-middle uk-flex-between"
-                ),
-                cls="uk-margin-medium-bottom uk-padding-small uk-box-shadow-small",
-                id=f'step-container-{step.instance_step_id}' 
-            )
-            for step in instance.steps
-        )),
+        Div(*steps),
+
+        # Live updates: changed steps arrive as out-of-band swaps; a refresh
+        # event (the connection fell behind) reloads the whole view
+        Div(hidden=True, **{'sse-swap': 'step'}),
+        Div(hidden=True,
+            **{'hx-get': f'/checklist/{instance.checklist_id}/instance/{instance.id}',
+               'hx-trigger': 'sse:refresh',
+               'hx-target': '#main-content',
+               'hx-swap': 'outerHTML'}),
         
         id="main-content",
-        cls="uk-container uk-margin-top"
+        cls="uk-container uk-margin-top",
+        **{'hx-ext': 'sse',
+           'sse-connect': f'/checklist/{instance.checklist_id}/instance/{instance.id}/events'}
     )
 
+def stream_instance_view(instance_id):
+    """(page, items) for StreamingHTML: the instance header first, then its steps as they're read"""
+    instance = get_instance(instance_id)
+    if not instance:
+        return render_instance_view(instance_id), ()
+    page = render_instance_view(instance_id, steps=[STREAM_SLOT], instance=instance)
+    steps = (instance_step_container(instance, step) for step in iter_instance_steps(instance_id))
+    return page, steps
+
+
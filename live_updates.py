@@ -0,0 +1,133 @@
+"""Pub/sub for live instance views over Server-Sent Events.
+
+Each open instance view holds an EventSource on
+/checklist/{checklist_id}/instance/{instance_id}/events, which subscribes to
+that instance's topic. `update_instance_step_status` publishes the changed
+step, rendered once as an out-of-band fragment, and every subscriber gets the
+same pre-formatted SSE message.
+
+`publish` may be called from any thread (status updates run on the DB
+executor): messages reach each subscriber's asyncio queue through its loop's
+call_soon_threadsafe. A subscriber that falls QUEUE_SIZE messages behind is
+sent a `refresh` event instead and reloads the whole view.
+
+The hub itself is per process, so with several workers a subscriber only gets
+messages for the changes its own worker handled. To catch the rest, `stream`
+polls the topic's version (cheap while nothing commits, see
+versions.VersionWatcher) every POLL_SECONDS. Each publish says which version
+change it covers, as (before, after) read inside the writing transaction; a
+version the subscriber wasn't told about came from another process, and it is
+sent a `refresh`."""
+import asyncio
+import threading
+import time
+
+QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15
+POLL_SECONDS = 1
+
+# Sent after an overflow; the instance view reloads itself on it
+REFRESH = "event: refresh\ndata: \n\n"
+
+
+class Subscriber:
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def _put(self, item):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Drop what's queued; one refresh replaces it all
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((REFRESH, None))
+
+    async def get(self):
+        """The next (message, versions) published"""
+        item = await self.queue.get()
+        if item[0] is REFRESH:
+            self.overflowed = False
+        return item
+
+
+class Hub:
+    def __init__(self):
+        self._topics = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        """Subscribe the running event loop to `topic`"""
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, topic, subscriber):
+        with self._lock:
+            subscribers = self._topics.get(topic)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._topics[topic]
+
+    def has_subscribers(self, topic):
+        return topic in self._topics
+
+    def publish(self, topic, message, versions=None):
+        """Queue `message` for every subscriber to `topic`; returns how many there were.
+        `versions` is the (before, after) change of the topic's version it covers;
+        `message` may be None when a write changed the version but nothing shown."""
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber._put, (message, versions))
+            except RuntimeError:  # loop closed
+                self.unsubscribe(topic, subscriber)
+        return len(subscribers)
+
+    async def stream(self, topic, version=None):
+        """Async generator of SSE messages for one connection, with keepalive comments.
+
+        `version` is an async callable returning the topic's current version;
+        if given, it is polled for changes published by other processes."""
+        subscriber = self.subscribe(topic)
+        # Read after subscribing, so no publish falls between the two
+        known = await version() if version else None
+        last_sent = time.monotonic()
+        try:
+            while True:
+                try:
+                    message, versions = await asyncio.wait_for(
+                        subscriber.get(), POLL_SECONDS if version else KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    message = None
+                    if version:
+                        current = await version()
+                        if current != known:
+                            known, message = current, REFRESH
+                    if message is None and time.monotonic() - last_sent >= KEEPALIVE_SECONDS:
+                        message = ": keepalive\n\n"
+                else:
+                    if message is REFRESH and version:
+                        known = await version()
+                    elif versions and versions[0] == known:
+                        known = versions[1]
+                    # Otherwise a change went by unannounced; the next poll catches it
+                if message is not None:
+                    last_sent = time.monotonic()
+                    yield message
+        finally:
+            self.unsubscribe(topic, subscriber)
+
+
+hub = Hub()
+
+def instance_topic(instance_id):
+    return f'instance:{instance_id}'
@@ -8,7 +8,7 @@ import argparse
 from fastcore.basics import AttrDict, patch
 
 # Import from your local modules
-from config import DB_PATH
+from config import DB_PATH, SERVER_HOST, SERVER_PORT, SERVER_WORKERS
 from models import Checklist
 from checklist_list import (checklist_row, create_checklist_modal, get_checklist_with_steps, 
                           render_steps, render_checklist_page, checklist_table, render_main_page)
@@ -25,24 +25,20 @@ from checklist_edit import (
 )
 
 
-from db_connection import DBConnection
-from routes import *
-
-# CLI Arguments
-parser = argparse.ArgumentParser()
-parser.add_argument('-refresh', action='store_true', help='Refresh the database on startup')
-args = parser.parse_args()
-
-# Database Setup
-os.makedirs('data', exist_ok=True)
-
-if args.refresh and DB_PATH.exists():
-    print("Refreshing database...")
-    DB_PATH.unlink()
-    for ext in ['-wal', '-shm']:
-        path = DB_PATH.parent / f"{DB_PATH.name}{ext}"
-        if path.exists(): path.unlink()
-
+from db_connection import DBConnection, close_pools
+from async_db import shutdown_executor
+from query_stats import QueryStatsMiddleware
+from compression import CompressionMiddleware
+from db_indexes import ensure_indexes
+from migrations import migrate, drop_triggers
+from versions import ensure_version_triggers, VERSION_TRIGGERS, watcher
+from search import ensure_search_triggers, SEARCH_TRIGGERS
+from tags import ensure_tag_triggers, TAG_TRIGGERS
+from rollups import start_rollup_worker, stop_rollup_worker
+from static_assets import (build_assets, asset_hdrs, mount_assets, require_assets,
+                           warn_missing_assets, SSE_URL, SORTABLE_URL)
+from fasthtml.pico import picolink
+import routes
 
 table_config = {
     'checklists': {
@@ -51,6 +47,9 @@ table_config = {
         'description': str,
         'description_long': str,
         'created_at': str,
+        'version': int,  # bumped by triggers, see versions.py
+        'instances_version': int,
+        'defaults': {'version': 0, 'instances_version': 0},
         'pk': 'id'
     },
     'steps': {
@@ -63,15 +62,100 @@ table_config = {
     }
 }
 
+def reset_database():
+    """Delete the database file (and its WAL/SHM files)"""
+    close_pools()
+    watcher.close()
+    if DB_PATH.exists():
+        print("Refreshing database...")
+        DB_PATH.unlink()
+    for ext in ['-wal', '-shm']:
+        path = DB_PATH.parent / f"{DB_PATH.name}{ext}"
+        if path.exists(): path.unlink()
+
+def create_app(live=False, setup=True):
+    """Build the FastHTML app.
 
-app, rt, checklists, steps = fast_app(  
-    str(DB_PATH),
-    checklists=table_config['checklists'],
-    steps=table_config['steps'],  
-    hdrs=(SortableJS('.sortable'), Theme.blue.headers()), 
-    live=True
-)
+    With `setup` (the default) this also brings the database schema and the
+    static asset build up to date. Production workers pass setup=False: the
+    parent process has done it once already, and several workers migrating
+    the same file at once would race each other. They also refuse to start
+    with any asset missing rather than serve it from a CDN."""
+    os.makedirs('data', exist_ok=True)
+    if setup:
+        # fast_app transforms checklists/steps when their config changes, and SQLite
+        # refuses the rename back into place while triggers on other tables refer to
+        # them. Ours are re-created after migrating below.
+        drop_triggers(VERSION_TRIGGERS, SEARCH_TRIGGERS, TAG_TRIGGERS)
+
+        # Hash and compress any newly vendored static files before the head is built
+        build_assets()
+        warn_missing_assets()
+    else:
+        require_assets()
+
+    app, rt, checklists, steps = fast_app(
+        str(DB_PATH),
+        checklists=table_config['checklists'],
+        steps=table_config['steps'],
+        hdrs=asset_hdrs(*def_hdrs(), picolink, Theme.blue.headers(),
+                        Script(src=SSE_URL), Script(src=SORTABLE_URL),
+                        Script("proc_htmx('.sortable', Sortable.create);")),
+        default_hdrs=False,  # included above, so they're self-hosted too
+        middleware=[Middleware(CompressionMiddleware), Middleware(QueryStatsMiddleware)],
+        on_startup=[start_rollup_worker],
+        on_shutdown=[stop_rollup_worker, shutdown_executor],
+        live=live
+    )
+    mount_assets(app)
+    routes.rt.to_app(app)
+
+    if setup:
+        migrate()
+        ensure_indexes()
+        ensure_version_triggers()
+        ensure_search_triggers()
+        ensure_tag_triggers()
+    return app
+
+def dev_app():
+    """Development profile: live reload in the browser"""
+    return create_app(live=True)
+
+def production_app():
+    """Production profile, one per worker process (see prepare_production)"""
+    return create_app(setup=False)
+
+def prepare_production():
+    """Migrate the schema and build assets once, in the parent, before the
+    workers start; then drop this process's connections so none are shared.
+    Fails here, before any worker starts, if an asset isn't vendored."""
+    build_assets()
+    require_assets()
+    create_app()
+    close_pools()
+    watcher.close()
 
 
 if __name__ == '__main__':
-    serve()
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-refresh', action='store_true', help='Refresh the database on startup')
+    parser.add_argument('--production', action='store_true',
+                        help='No live reload, several worker processes')
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS,
+                        help='Worker processes in production (default: %(default)s)')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+
+    if args.refresh:
+        reset_database()
+    if args.production:
+        prepare_production()
+        uvicorn.run('main:production_app', factory=True, host=args.host, port=args.port,
+                    workers=args.workers, proxy_headers=True)
+    else:
+        print(f"Link: http://{'localhost' if args.host == '0.0.0.0' else args.host}:{args.port}")
+        uvicorn.run('main:dev_app', factory=True, host=args.host, port=args.port, reload=True)
@@ -0,0 +1,331 @@
+"""Versioned schema migrations.
+
+Each migration has a number and is recorded in `schema_version` once applied.
+Migrations are written to be idempotent, and data copies run in batches that
+resume where they left off, so a crash part way through only costs a re-run.
+
+Run `python migrations.py` to apply pending migrations, or `--status` to list them."""
+import argparse
+import re
+import sqlite3
+from datetime import datetime
+
+from db_connection import DBConnection
+
+BATCH_SIZE = 5000
+
+MIGRATIONS = []  # (version, name, fn), kept sorted by version
+
+def migration(version, name):
+    """Register `fn(progress)` as migration number `version`"""
+    def decorator(fn):
+        assert all(v != version for v, _, _ in MIGRATIONS), f"Duplicate migration {version}"
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+def report(message):
+    print(f"  {message}")
+
+
+# Helpers
+
+def table_exists(cursor, table):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return cursor.fetchone() is not None
+
+def table_columns(cursor, table):
+    cursor.execute("SELECT name FROM pragma_table_info(?)", (table,))
+    return [row['name'] for row in cursor.fetchall()]
+
+def drop_triggers(*scripts):
+    """Drop every trigger the given CREATE TRIGGER scripts define"""
+    names = [name for script in scripts
+             for name in re.findall(r"CREATE TRIGGER IF NOT EXISTS (\w+)", script)]
+    with DBConnection() as cursor:
+        for name in names:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+def supports_drop_column():
+    return sqlite3.sqlite_version_info >= (3, 35, 0)
+
+def rebuild_table(table, create_sql, columns, progress=report, batch_size=None):
+    """Rebuild `table` from `create_sql` (which must create `<table>_new`) without
+    holding a lock for the whole copy.
+
+    Rows are copied in id order, one batch per transaction, and triggers mirror
+    updates/deletes to already-copied rows while the copy runs. Re-running after
+    a crash continues from the highest id already in `<table>_new`. The final
+    swap is a single transaction. Indexes and triggers on `table` are dropped
+    with it, so re-create them afterwards (see db_indexes.ensure_indexes)."""
+    batch_size = batch_size or BATCH_SIZE
+    new = f"{table}_new"
+    cols = ', '.join(columns)
+    new_vals = ', '.join(f"NEW.{c}" for c in columns)
+    with DBConnection() as cursor:
+        if not table_exists(cursor, new):
+            cursor.execute(create_sql)
+        cursor.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_mirror_update AFTER UPDATE ON {table}
+            WHEN NEW.id <= (SELECT COALESCE(MAX(id), 0) FROM {new})
+            BEGIN
+                INSERT OR REPLACE INTO {new} ({cols}) VALUES ({new_vals});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {table}_mirror_delete AFTER DELETE ON {table}
+            BEGIN
+                DELETE FROM {new} WHERE id = OLD.id;
+            END;
+        """)
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        total = cursor.fetchone()[0]
+
+    while True:
+        with DBConnection() as cursor:
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {new}")
+            last_id = cursor.fetchone()[0]
+            cursor.execute(f"""
+                INSERT OR REPLACE INTO {new} ({cols})
+                SELECT {cols} FROM {table}
+                WHERE id > ? ORDER BY id LIMIT ?
+            """, (last_id, batch_size))
+            copied = cursor.rowcount
+            cursor.execute(f"SELECT COUNT(*) FROM {new}")
+            done = cursor.fetchone()[0]
+        progress(f"{table}: copied {done}/{total} rows")
+        if copied < batch_size:
+            break
+
+    with DBConnection() as cursor:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Catch rows inserted since the last batch
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {new}")
+            cursor.execute(f"""
+                INSERT OR REPLACE INTO {new} ({cols})
+                SELECT {cols} FROM {table} WHERE id > ?
+            """, (cursor.fetchone()[0],))
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_mirror_update")
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_mirror_delete")
+            cursor.execute(f"DROP TABLE {table}")
+            cursor.execute(f"ALTER TABLE {new} RENAME TO {table}")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    progress(f"{table}: rebuilt")
+
+
+# Migrations
+
+@migration(1, 'create_instance_tables')
+def create_instance_tables(progress):
+    """Tables used by the app that fast_app's table config doesn't create"""
+    with DBConnection() as cursor:
+        cursor.executescript("""
+            CREATE TABLE IF NOT EXISTS reference_types (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS step_references (
+                id INTEGER PRIMARY KEY,
+                step_id INTEGER UNIQUE NOT NULL,
+                url TEXT NOT NULL,
+                type_id INTEGER DEFAULT 1,
+                FOREIGN KEY(step_id) REFERENCES steps(id),
+                FOREIGN KEY(type_id) REFERENCES reference_types(id)
+            );
+            CREATE TABLE IF NOT EXISTS checklist_instances (
+                id INTEGER PRIMARY KEY,
+                checklist_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                description TEXT,
+                status TEXT,
+                created_at TEXT,
+                target_date TEXT,
+                FOREIGN KEY(checklist_id) REFERENCES checklists(id)
+            );
+            CREATE TABLE IF NOT EXISTS instance_steps (
+                id INTEGER PRIMARY KEY,
+                instance_id INTEGER NOT NULL,
+                step_id INTEGER NOT NULL,
+                status TEXT,
+                notes TEXT,
+                updated_at TEXT,
+                FOREIGN KEY(instance_id) REFERENCES checklist_instances(id),
+                FOREIGN KEY(step_id) REFERENCES steps(id)
+            );
+        """)
+
+@migration(2, 'step_references_unique_step_id')
+def step_references_unique_step_id(progress):
+    """update_step_reference upserts on step_id, which needs a UNIQUE constraint"""
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT 1 FROM pragma_index_list('step_references') il
+            JOIN pragma_index_info(il.name) ii
+            WHERE il."unique" = 1 AND ii.name = 'step_id'
+              AND (SELECT COUNT(*) FROM pragma_index_info(il.name)) = 1
+        """)
+        if cursor.fetchone():
+            return
+    rebuild_table('step_references', """
+        CREATE TABLE step_references_new (
+            id INTEGER PRIMARY KEY,
+            step_id INTEGER UNIQUE NOT NULL,
+            url TEXT NOT NULL,
+            type_id INTEGER DEFAULT 1,
+            FOREIGN KEY(step_id) REFERENCES steps(id),
+            FOREIGN KEY(type_id) REFERENCES reference_types(id)
+        )
+    """, ['id', 'step_id', 'url', 'type_id'], progress)
+
+@migration(3, 'drop_steps_reference_material')
+def drop_steps_reference_material(progress):
+    """References moved to step_references; drop the old steps column"""
+    with DBConnection() as cursor:
+        if 'reference_material' not in table_columns(cursor, 'steps'):
+            return
+        if supports_drop_column():
+            progress("steps: dropping reference_material")
+            cursor.execute("ALTER TABLE steps DROP COLUMN reference_material")
+            return
+    rebuild_table('steps', """
+        CREATE TABLE steps_new (
+            id INTEGER PRIMARY KEY,
+            checklist_id INTEGER,
+            text TEXT,
+            status TEXT,
+            order_index INTEGER
+        )
+    """, ['id', 'checklist_id', 'text', 'status', 'order_index'], progress)
+
+@migration(4, 'instance_progress_counters')
+def instance_progress_counters(progress):
+    from instance_functions import ensure_instance_progress_counters
+    ensure_instance_progress_counters()
+
+
+@migration(5, 'sparse_step_order')
+def sparse_step_order(progress):
+    """Space existing order_index values ORDER_GAP apart, one checklist per transaction"""
+    from checklist_edit import ORDER_GAP, rebalance_step_order
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT checklist_id FROM steps
+            GROUP BY checklist_id
+            HAVING MIN(order_index) < ?  -- already-renumbered checklists start at ORDER_GAP
+        """, (ORDER_GAP,))
+        checklist_ids = [row['checklist_id'] for row in cursor.fetchall()]
+    for i, checklist_id in enumerate(checklist_ids, 1):
+        with DBConnection() as cursor:
+            rebalance_step_order(cursor, checklist_id)
+        if i % 100 == 0 or i == len(checklist_ids):
+            progress(f"steps: renumbered {i}/{len(checklist_ids)} checklists")
+
+@migration(6, 'instance_versions')
+def instance_versions(progress):
+    """Version counter for ETags on instance pages, maintained by triggers in versions.py"""
+    with DBConnection() as cursor:
+        if 'version' not in table_columns(cursor, 'checklist_instances'):
+            cursor.execute("ALTER TABLE checklist_instances ADD COLUMN version INTEGER DEFAULT 0")
+
+@migration(7, 'search_index')
+def search_index(progress):
+    """FTS5 index behind /search, see search.py"""
+    from search import rebuild_search_index
+    rebuild_search_index(progress, BATCH_SIZE)
+
+@migration(8, 'tag_tree')
+def tag_tree(progress):
+    """Tag tree, closure table and checklist links, see tags.py"""
+    from tags import ensure_tag_tables, ensure_tag_triggers, recompute_tag_counts
+    ensure_tag_tables()
+    ensure_tag_triggers()
+    recompute_tag_counts()
+
+@migration(9, 'checklist_history')
+def checklist_history(progress):
+    """Template version history, with a first version for existing checklists"""
+    from template_history import ensure_history_table, backfill_history
+    ensure_history_table()
+    backfill_history(progress)
+
+@migration(10, 'instance_step_events')
+def instance_step_events(progress):
+    """Status change log and the duration aggregates built from it, see step_analytics.py"""
+    from step_analytics import ensure_analytics_tables
+    ensure_analytics_tables()
+
+@migration(11, 'daily_rollups')
+def daily_rollups(progress):
+    """Daily template and instance rollups, built by rollups.refresh_rollups"""
+    from rollups import ensure_rollup_tables
+    ensure_rollup_tables()
+
+@migration(12, 'instance_first_completions')
+def instance_first_completions(progress):
+    """Count each instance's completion once in the duration stats, see step_analytics.py"""
+    from step_analytics import ensure_analytics_tables, recount_first_completions
+    ensure_analytics_tables()
+    with DBConnection() as cursor:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            recount_first_completions(cursor)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+
+# Runner
+
+def ensure_schema_version_table():
+    with DBConnection() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        """)
+
+def applied_versions():
+    ensure_schema_version_table()
+    with DBConnection() as cursor:
+        cursor.execute("SELECT version FROM schema_version")
+        return {row['version'] for row in cursor.fetchall()}
+
+def migrate(target=None, progress=report):
+    """Apply pending migrations up to `target` (default: all); returns the versions applied"""
+    done = applied_versions()
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        print(f"Applying migration {version}: {name}")
+        fn(progress)
+        with DBConnection() as cursor:
+            cursor.execute("""
+                INSERT OR IGNORE INTO schema_version (version, name, applied_at)
+                VALUES (?, ?, ?)
+            """, (version, name, datetime.now().isoformat()))
+        applied.append(version)
+    return applied
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--status', action='store_true', help='List migrations and exit')
+    parser.add_argument('--target', type=int, help='Stop after this version')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.status:
+        done = applied_versions()
+        for version, name, _ in MIGRATIONS:
+            print(f"{'[x]' if version in done else '[ ]'} {version:03d} {name}")
+    else:
+        BATCH_SIZE = args.batch_size
+        applied = migrate(args.target)
+        print(f"Applied {len(applied)} migration(s)" if applied else "Schema is up to date")
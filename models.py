@@ -1,14 +1,15 @@
 from fastcore.basics import AttrDict, patch
 
 class Checklist(AttrDict):
-    def __init__(self, id, title, description, description_long='', created_at=None, steps=None):
+    def __init__(self, id, title, description, description_long='', created_at=None, steps=None, version=None):
         super().__init__(
             id=id,
             title=title,
             description=description,
             description_long=description_long,
             created_at=created_at,
-            steps=steps or []
+            steps=steps or [],
+            version=version
         )
 
 @patch
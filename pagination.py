@@ -0,0 +1,46 @@
+"""Keyset (cursor) pagination on (created_at, id).
+
+A cursor encodes the sort key of the last row on a page; the next page is
+everything strictly after it, which an index on created_at can seek to directly
+no matter how deep the page is."""
+import base64
+import json
+
+from config import PAGE_SIZE
+
+ORDERS = {'desc': ('<', 'DESC'), 'asc': ('>', 'ASC')}
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor string, or None if it's missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return created_at, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+def normalize_order(order):
+    return order if order in ORDERS else 'desc'
+
+def keyset_sql(alias, order, after):
+    """(where clause, params, order by) for one page sorted by created_at, id"""
+    op, direction = ORDERS[normalize_order(order)]
+    prefix = f"{alias}." if alias else ""
+    where, params = "", []
+    key = decode_cursor(after)
+    if key is not None:
+        where = f" AND ({prefix}created_at, {prefix}id) {op} (?, ?)"
+        params = list(key)
+    return where, params, f" ORDER BY {prefix}created_at {direction}, {prefix}id {direction}"
+
+def split_page(rows, limit):
+    """(rows on this page, cursor for the next page or None) from up to limit+1 rows"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
@@ -0,0 +1,202 @@
+"""Per-request database instrumentation.
+
+DBConnection hands out `InstrumentedCursor`s, which record every statement's
+fingerprint, duration, rows returned and calling function into the
+`RequestStats` for the current request. `QueryStatsMiddleware` creates that
+object per request, logs slow statements, and in debug mode adds an
+`X-DB-Stats` summary header to the response."""
+import contextvars
+import json
+import logging
+import re
+import sqlite3
+import sys
+import time
+
+from config import DEBUG, SLOW_QUERY_MS
+
+slow_query_log = logging.getLogger('fast_checklist.slow_queries')
+
+_current = contextvars.ContextVar('query_stats', default=None)
+
+MAX_RECORDED_STATEMENTS = 200
+
+
+class RequestStats:
+    """Query totals for one request"""
+    def __init__(self, path=''):
+        self.path = path
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.connections = 0  # checkouts from the pool
+        self.opened = 0       # new sqlite3 connections created
+        self.statements = []  # QueryRecord, capped at MAX_RECORDED_STATEMENTS
+
+    def summary(self):
+        return (f"queries={self.queries}; db_ms={self.db_time * 1000:.2f}; "
+                f"rows={self.rows}; connections={self.connections}; opened={self.opened}")
+
+
+class QueryRecord:
+    __slots__ = ('fingerprint', 'duration', 'rows', 'caller')
+
+    def __init__(self, fingerprint, caller):
+        self.fingerprint, self.caller = fingerprint, caller
+        self.duration, self.rows = 0.0, 0
+
+
+def current_stats():
+    """The RequestStats being collected in this context, or None"""
+    return _current.get()
+
+def start_request(path=''):
+    """Begin collecting stats in the current context; returns (stats, reset token)"""
+    stats = RequestStats(path)
+    return stats, _current.set(stats)
+
+def end_request(token):
+    _current.reset(token)
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"IN \((?:\?\s*,\s*)+\?\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+def fingerprint(sql):
+    """Normalise a statement so different parameter values group together"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _SPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('IN (...)', sql)
+
+def _caller():
+    """module.function of the first frame outside the DB plumbing"""
+    frame = sys._getframe(1)
+    while frame and (frame.f_code.co_filename == __file__
+                     or frame.f_code.co_filename.endswith('db_connection.py')):
+        frame = frame.f_back
+    if not frame:
+        return '?'
+    module = frame.f_globals.get('__name__', '?')
+    return f"{module}.{frame.f_code.co_name}"
+
+
+def record_checkout():
+    stats = _current.get()
+    if stats is not None:
+        stats.connections += 1
+
+def record_connection_opened():
+    stats = _current.get()
+    if stats is not None:
+        stats.opened += 1
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """A cursor that times its statements (including fetches) into the current RequestStats"""
+    _record = None
+
+    def _begin(self, sql):
+        self.finish()
+        record = QueryRecord(fingerprint(sql), _caller())
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            if len(stats.statements) < MAX_RECORDED_STATEMENTS:
+                stats.statements.append(record)
+        self._record = record
+        return record
+
+    def _timed(self, record, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            if record is not None:
+                elapsed = time.perf_counter() - start
+                record.duration += elapsed
+                stats = _current.get()
+                if stats is not None:
+                    stats.db_time += elapsed
+
+    def _count(self, n):
+        if self._record is not None and n:
+            self._record.rows += n
+            stats = _current.get()
+            if stats is not None:
+                stats.rows += n
+
+    def execute(self, sql, parameters=()):
+        record = self._begin(sql)
+        self._timed(record, super().execute, sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        record = self._begin(sql)
+        self._timed(record, super().executemany, sql, seq_of_parameters)
+        return self
+
+    def executescript(self, sql_script):
+        record = self._begin(sql_script)
+        self._timed(record, super().executescript, sql_script)
+        return self
+
+    def fetchone(self):
+        row = self._timed(self._record, super().fetchone)
+        self._count(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(self._record, super().fetchmany, size or self.arraysize)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._record, super().fetchall)
+        self._count(len(rows))
+        return rows
+
+    def __next__(self):
+        row = self._timed(self._record, super().__next__)
+        self._count(1)
+        return row
+
+    def finish(self):
+        """Close out the current statement and log it if it was slow"""
+        record, self._record = self._record, None
+        if record is not None and record.duration * 1000 >= SLOW_QUERY_MS:
+            stats = _current.get()
+            slow_query_log.warning(json.dumps({
+                'event': 'slow_query',
+                'path': stats.path if stats else '',
+                'caller': record.caller,
+                'duration_ms': round(record.duration * 1000, 2),
+                'rows': record.rows,
+                'sql': record.fingerprint,
+            }))
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware that collects RequestStats for each HTTP request"""
+    def __init__(self, app, debug=None):
+        self.app = app
+        self.debug = DEBUG if debug is None else debug
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        stats, token = start_request(scope.get('path', ''))
+
+        async def send_with_stats(message):
+            if message['type'] == 'http.response.start' and self.debug:
+                headers = list(message.get('headers', []))
+                headers.append((b'x-db-stats', stats.summary().encode()))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            end_request(token)
@@ -0,0 +1,18 @@
+import argparse
+
+from instance_functions import ensure_instance_progress_counters, recompute_instance_progress
+
+def repair_instance_progress(instance_ids=None):
+    """Recompute checklist_instances.completed_steps/total_steps from instance_steps"""
+    if not ensure_instance_progress_counters():
+        print("Table checklist_instances does not exist")
+        return 0
+    updated = recompute_instance_progress(instance_ids)
+    print(f"Recomputed progress for {updated} instance(s)")
+    return updated
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=repair_instance_progress.__doc__)
+    parser.add_argument('instance_ids', nargs='*', type=int, help='Only repair these instances')
+    args = parser.parse_args()
+    repair_instance_progress(args.instance_ids or None)
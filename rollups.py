@@ -0,0 +1,285 @@
+"""Daily rollups of instance activity, for reports over weeks or months.
+
+`daily_instance_stats` has a row per instance per day it had activity: created
+that day, steps completed that day, and completed (with its duration) that day.
+`daily_template_stats` sums those rows per template per day, so a report over
+a year reads at most a few hundred rows per template.
+
+`refresh_rollups` is incremental. New instances come from `checklist_instances`
+past one high-water mark and changed instances from `instance_step_events`
+past another. Each changed instance's rows are rebuilt from `instance_steps`,
+and only the template days they touched, old and new, are re-summed.
+
+The first run builds everything. After that a background thread (see
+`start_rollup_worker`, ROLLUP_INTERVAL_SECONDS) or `python rollups.py` from
+cron keeps it current. The thread also rolls up the step duration stats
+(step_analytics.process_events)."""
+import argparse
+import json
+import logging
+import threading
+
+from fasthtml.common import *
+from monsterui.all import *
+from fastcore.basics import AttrDict
+
+from config import ROLLUP_INTERVAL_SECONDS
+from db_connection import DBConnection
+from step_analytics import format_duration, process_events
+
+log = logging.getLogger('fast_checklist.rollups')
+
+INSTANCES_HWM = 'rollup_instances'
+EVENTS_HWM = 'rollup_events'
+BATCH_SIZE = 2000
+MAX_BACKOFF = 16  # after repeated failures, wait up to this many intervals between attempts
+
+ROLLUP_TABLES = """
+    CREATE TABLE IF NOT EXISTS daily_instance_stats (
+        instance_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        checklist_id INTEGER NOT NULL,
+        created INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        steps_completed INTEGER NOT NULL DEFAULT 0,
+        completion_seconds REAL NOT NULL DEFAULT 0,  -- created -> completed, on the completion day
+        PRIMARY KEY (instance_id, day)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_daily_instance_stats_checklist_day
+        ON daily_instance_stats (checklist_id, day);
+
+    CREATE TABLE IF NOT EXISTS daily_template_stats (
+        checklist_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        instances_created INTEGER NOT NULL DEFAULT 0,
+        instances_completed INTEGER NOT NULL DEFAULT 0,
+        steps_completed INTEGER NOT NULL DEFAULT 0,
+        completion_seconds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (checklist_id, day)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_daily_template_stats_day ON daily_template_stats (day);
+"""
+
+PERIODS = {
+    'day': "day",
+    'week': "date(day, '-6 days', 'weekday 1')",  # the Monday starting the week
+    'month': "strftime('%Y-%m', day)",
+}
+
+def ensure_rollup_tables():
+    from step_analytics import ensure_analytics_tables
+    ensure_analytics_tables()  # analytics_state holds the high-water marks
+    with DBConnection() as cursor:
+        cursor.executescript(ROLLUP_TABLES)
+
+
+# Building
+
+def _get_hwm(cursor, name):
+    cursor.execute("SELECT value FROM analytics_state WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    return row['value'] if row else 0
+
+def _set_hwm(cursor, name, value):
+    cursor.execute("""
+        INSERT INTO analytics_state (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value
+    """, (name, value))
+
+def _rebuild_instance(cursor, instance_id):
+    """Replace an instance's daily rows; returns the (checklist_id, day) pairs touched"""
+    cursor.execute("""
+        DELETE FROM daily_instance_stats WHERE instance_id = ?
+        RETURNING checklist_id, day
+    """, (instance_id,))
+    touched = {(row['checklist_id'], row['day']) for row in cursor.fetchall()}
+
+    cursor.execute("""
+        SELECT checklist_id, date(created_at) as day, created_at,
+               total_steps > 0 AND completed_steps = total_steps as done
+        FROM checklist_instances WHERE id = ?
+    """, (instance_id,))
+    instance = cursor.fetchone()
+    if not instance:
+        return touched
+    checklist_id = instance['checklist_id']
+    days = {instance['day']: dict(created=1, completed=0, steps_completed=0, completion_seconds=0.0)}
+
+    cursor.execute("""
+        SELECT date(updated_at) as day, COUNT(*) as steps, MAX(updated_at) as last_at
+        FROM instance_steps
+        WHERE instance_id = ? AND status = 'Completed'
+        GROUP BY date(updated_at)
+    """, (instance_id,))
+    completions = cursor.fetchall()
+    for row in completions:
+        days.setdefault(row['day'], dict(created=0, completed=0, steps_completed=0, completion_seconds=0.0))
+        days[row['day']]['steps_completed'] = row['steps']
+    if instance['done'] and completions:
+        last = max(completions, key=lambda row: row['last_at'])
+        cursor.execute("SELECT (julianday(?) - julianday(?)) * 86400.0",
+                       (last['last_at'], instance['created_at']))
+        days[last['day']].update(completed=1, completion_seconds=max(cursor.fetchone()[0] or 0.0, 0.0))
+
+    cursor.executemany("""
+        INSERT INTO daily_instance_stats
+        (instance_id, day, checklist_id, created, completed, steps_completed, completion_seconds)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(instance_id, day, checklist_id, d['created'], d['completed'], d['steps_completed'],
+           d['completion_seconds']) for day, d in days.items()])
+    return touched | {(checklist_id, day) for day in days}
+
+def _resum_template_day(cursor, checklist_id, day):
+    cursor.execute("DELETE FROM daily_template_stats WHERE checklist_id = ? AND day = ?", (checklist_id, day))
+    cursor.execute("""
+        INSERT INTO daily_template_stats
+        (checklist_id, day, instances_created, instances_completed, steps_completed, completion_seconds)
+        SELECT checklist_id, day, SUM(created), SUM(completed), SUM(steps_completed), SUM(completion_seconds)
+        FROM daily_instance_stats
+        WHERE checklist_id = ? AND day = ?
+        GROUP BY checklist_id, day
+    """, (checklist_id, day))
+
+def refresh_rollups(batch_size=BATCH_SIZE):
+    """Bring the rollups up to date, one batch of new instances and status
+    changes per transaction; returns the number of instances rebuilt"""
+    rebuilt = 0
+    while True:
+        with DBConnection() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                instances_hwm = _get_hwm(cursor, INSTANCES_HWM)
+                events_hwm = _get_hwm(cursor, EVENTS_HWM)
+                cursor.execute("""
+                    SELECT id FROM checklist_instances WHERE id > ? ORDER BY id LIMIT ?
+                """, (instances_hwm, batch_size))
+                new_ids = [row['id'] for row in cursor.fetchall()]
+                cursor.execute("""
+                    SELECT id, instance_id FROM instance_step_events WHERE id > ? ORDER BY id LIMIT ?
+                """, (events_hwm, batch_size))
+                events = cursor.fetchall()
+                if not new_ids and not events:
+                    cursor.execute("COMMIT")
+                    return rebuilt
+
+                changed = set(new_ids) | {e['instance_id'] for e in events}
+                touched = set()
+                for instance_id in sorted(changed):
+                    touched |= _rebuild_instance(cursor, instance_id)
+                for checklist_id, day in sorted(touched):
+                    _resum_template_day(cursor, checklist_id, day)
+
+                if new_ids:
+                    _set_hwm(cursor, INSTANCES_HWM, new_ids[-1])
+                if events:
+                    _set_hwm(cursor, EVENTS_HWM, events[-1]['id'])
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        rebuilt += len(changed)
+        if len(new_ids) < batch_size and len(events) < batch_size:
+            return rebuilt
+
+
+_worker = None
+_stop = threading.Event()
+
+def _run_worker(interval):
+    failures = 0
+    while not _stop.wait(interval * min(2 ** failures, MAX_BACKOFF)):
+        try:
+            process_events()  # duration stats, see step_analytics.py
+            refresh_rollups()
+        except Exception as e:
+            failures += 1
+            log.exception(json.dumps({
+                'event': 'rollup_refresh_failed',
+                'error': repr(e),
+                'failures': failures,
+                'retry_in_s': interval * min(2 ** failures, MAX_BACKOFF),
+            }))
+        else:
+            if failures:
+                log.warning(json.dumps({'event': 'rollup_refresh_recovered', 'failures': failures}))
+            failures = 0
+
+def start_rollup_worker(interval=ROLLUP_INTERVAL_SECONDS):
+    """Refresh the rollups every `interval` seconds on a daemon thread (0 disables)"""
+    global _worker
+    if not interval or (_worker and _worker.is_alive()):
+        return
+    _stop.clear()
+    _worker = threading.Thread(target=_run_worker, args=(interval,), name='rollups', daemon=True)
+    _worker.start()
+
+def stop_rollup_worker():
+    global _worker
+    _stop.set()
+    if _worker:
+        _worker.join()
+        _worker = None
+
+
+# Reporting
+
+def get_report(checklist_id=None, period='week', since=None):
+    """Rollup totals per period (newest first), for one template or all of them"""
+    bucket = PERIODS[period]
+    where, params = [], []
+    if checklist_id is not None:
+        where.append("checklist_id = ?")
+        params.append(checklist_id)
+    if since:
+        where.append("day >= ?")
+        params.append(since)
+    with DBConnection() as cursor:
+        cursor.execute(f"""
+            SELECT {bucket} as period,
+                   SUM(instances_created) as instances_created,
+                   SUM(instances_completed) as instances_completed,
+                   SUM(steps_completed) as steps_completed,
+                   SUM(completion_seconds) / NULLIF(SUM(instances_completed), 0) as avg_completion_seconds
+            FROM daily_template_stats
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            GROUP BY period
+            ORDER BY period DESC
+        """, params)
+        return [AttrDict(dict(row)) for row in cursor.fetchall()]
+
+def render_report(checklist_id=None, title="Report", period='week', since=None):
+    """Rollup report table with period switcher, as of the last refresh
+    (the worker's or `python rollups.py`'s; a GET never writes)"""
+    base = f'/checklist/{checklist_id}/report' if checklist_id is not None else '/reports'
+    rows = get_report(checklist_id, period, since)
+    return Div(
+        H2(title, cls="uk-heading-small"),
+        Div(*(A(name.title(),
+                cls="uk-button uk-button-small " + ("uk-button-primary" if name == period else "uk-button-default"),
+                **{'hx-get': f'{base}?period={name}',
+                   'hx-target': '#main-content',
+                   'hx-push-url': 'true'})
+              for name in PERIODS),
+            cls="uk-button-group uk-margin-bottom"),
+        Table(
+            Thead(Tr(Th(period.title()), Th("Created"), Th("Completed"),
+                     Th("Steps completed"), Th("Average completion"))),
+            Tbody(*(Tr(
+                Td(row.period),
+                Td(row.instances_created),
+                Td(row.instances_completed),
+                Td(row.steps_completed),
+                Td(format_duration(row.avg_completion_seconds)),
+            ) for row in rows)),
+            cls="uk-table uk-table-divider uk-table-small"
+        ) if rows else P("No activity yet", cls="uk-text-meta"),
+        id="rollup-report"
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    ensure_rollup_tables()
+    print(f"Rebuilt rollups for {refresh_rollups(args.batch_size)} instance(s)")
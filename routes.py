@@ -1,59 +1,99 @@
 from fasthtml.common import * 
+from monsterui.all import *
 from datetime import datetime
 from db_connection import DBConnection
-from checklist_list import render_main_page, get_checklist_with_steps, render_checklist_page
+from checklist_list import render_main_page, get_checklist_with_steps, render_checklist_page, checklist_rows
 
 from checklist_edit import (
     render_checklist_edit, render_sortable_steps, render_step_item, 
     render_step_text, render_step_reference, db_update_step,
     get_step, get_step_reference, update_step_reference, validate_url,
-    create_new_step, update_checklist_field, render_checklist_field  # Add this line
+    create_new_step, update_checklist_field, render_checklist_field,  # Add this line
+    render_move_status, stream_checklist_edit, render_step_deleted
 )
 
 
 from instance_functions import (
     render_instances, render_instance_view, create_new_instance,
-    update_instance_step_status, get_instance_step, render_instance_step
+    update_instance_step_status, get_instance_step, render_instance_step,
+    instance_rows, stream_instance_view, get_instance_row, instance_row,
+    instance_in_view, render_instances_status
 )
 
 from models import Checklist
+from fragment_cache import fragments
+from streaming import wants_stream, StreamingHTML
+from etags import page_etag, not_modified, etag_headers, NotModified
+from versions import get_checklist_version, get_instances_version, get_instance_version, get_tags_version
+from search import render_search_page, search_result_items, render_search_results
+from tags import create_tag, tag_checklist, untag_checklist, render_checklist_tags
+from step_analytics import render_duration_stats
+from analytics import render_template_metrics, render_step_metrics, render_dashboard
+from rollups import render_report, PERIODS
+from live_updates import hub, instance_topic
+from template_history import (record_change, revert_to_version, delete_history,
+                              render_history, render_history_rows, render_version)
+from async_db import (
+    run_db, aget_checklist_with_steps, acreate_new_checklist, acreate_new_step,
+    adelete_step, aget_step, aupdate_step_reference, aupdate_checklist_field,
+    aupdate_steps_order, amove_step, adb_update_step, acreate_new_instance,
+    aupdate_instance_step_status, aget_instance_step
+)
+
+# Registered on the app by main.create_app
+rt = APIRouter()
 
-from main import *
+def int_param(req, name):
+    """Query parameter `name` as an int, or None if it's missing or not a number"""
+    try:
+        return int(req.query_params.get(name, ''))
+    except ValueError:
+        return None
+
+def tag_param(req):
+    """The ?tag= filter; anything but a positive id means no filter"""
+    tag_id = int_param(req, 'tag')
+    return tag_id if tag_id and tag_id > 0 else None
 
 # Routes
 @rt('/')
 async def get(req):
-    return render_main_page()
+    return await run_db(render_main_page,
+                        req.query_params.get('order', 'desc'),
+                        tag_param(req))
+
+@rt('/checklists/page')
+async def get(req):
+    """Next page of checklist rows (requested by the infinite-scroll sentinel)"""
+    return tuple(await run_db(checklist_rows,
+                              req.query_params.get('after'),
+                              req.query_params.get('order', 'desc'),
+                              tag_param(req)))
+
+@rt('/search')
+async def get(req):
+    text = req.query_params.get('q', '')
+    kind = req.query_params.get('kind') or None
+    return await run_db(render_search_page, text, kind)
+
+@rt('/search/results')
+async def get(req):
+    """Search results list, or the next page of it (requested by the infinite-scroll sentinel)"""
+    text = req.query_params.get('q', '')
+    kind = req.query_params.get('kind') or None
+    page = max(int_param(req, 'page') or 1, 1)
+    if page > 1:
+        return tuple(await run_db(search_result_items, text, kind, page))
+    return await run_db(render_search_results, text, kind)
 
 @rt('/create')
 async def post(req):
     form = await req.form()
     try:
-        checklist = Checklist(
-            id=None,
+        new_id = await acreate_new_checklist(
             title=form['title'],
-            description=form.get('description', ''),
-            description_long='',
-            created_at=datetime.now().isoformat(),
-            steps=[]
+            description=form.get('description', '')
         )
-        checklist_data = dict(checklist)
-        del checklist_data['steps']
-        del checklist_data['id']
-        
-        # Insert using DBConnection
-        with DBConnection() as cursor:
-            cursor.execute("""
-                INSERT INTO checklists (title, description, description_long, created_at)
-                VALUES (?, ?, ?, ?)
-            """, (
-                checklist_data['title'],
-                checklist_data['description'],
-                checklist_data['description_long'],
-                checklist_data['created_at']
-            ))
-            cursor.execute("SELECT last_insert_rowid()")
-            new_id = cursor.fetchone()[0]
         
         return RedirectResponse(f'/checklist/{new_id}/edit', status_code=303)
             
@@ -64,32 +104,48 @@ async def post(req):
 @rt('/checklist/{checklist_id}')
 def get(req):
     checklist_id = int(req.path_params['checklist_id'])
-    return render_checklist_page(checklist_id)  # Now passing the parameter
+    etag = page_etag(req, 'checklist', checklist_id, get_checklist_version(checklist_id))
+    if not_modified(req, etag):
+        return NotModified(etag)
+    return render_checklist_page(checklist_id), *etag_headers(etag)
 
 @patch
 def delete(self:Checklist):
     with DBConnection() as cursor:
-        # First delete associated steps
+        # First delete associated steps and their references
+        cursor.execute("""
+            DELETE FROM step_references
+            WHERE step_id IN (SELECT id FROM steps WHERE checklist_id = ?)
+        """, (self.id,))
         cursor.execute("""
             DELETE FROM steps 
             WHERE checklist_id = ?
         """, (self.id,))
         
-        # Then delete the checklist
+        # Untag it (the tag count triggers run on checklist_tags)
+        cursor.execute("""
+            DELETE FROM checklist_tags 
+            WHERE checklist_id = ?
+        """, (self.id,))
+        
+        # Then delete the checklist and its history
         cursor.execute("""
             DELETE FROM checklists 
             WHERE id = ?
         """, (self.id,))
-        
-        return cursor.rowcount > 0
+        deleted = cursor.rowcount > 0
+        delete_history(cursor, self.id)
+    
+    fragments.invalidate(self.id)
+    return deleted
 
 @rt('/checklist/{checklist_id}')
 async def delete(req):
     checklist_id = int(req.path_params['checklist_id'])
-    checklist = get_checklist_with_steps(checklist_id)
+    checklist = await aget_checklist_with_steps(checklist_id)
     if checklist:
-        checklist.delete()
-    return render_main_page()
+        await run_db(checklist.delete)
+    return await run_db(render_main_page)
 
 @patch
 def update(self:Checklist, title=None, description=None, description_long=None):
@@ -109,6 +165,9 @@ def update(self:Checklist, title=None, description=None, description_long=None):
             
         if not updates:
             return False
+        
+        cursor.execute("SELECT title, description, description_long FROM checklists WHERE id = ?", (self.id,))
+        before = cursor.fetchone()
             
         query = f"""
             UPDATE checklists 
@@ -117,15 +176,151 @@ def update(self:Checklist, title=None, description=None, description_long=None):
         """
         params.append(self.id)
         cursor.execute(query, params)
-        return cursor.rowcount > 0
+        updated = cursor.rowcount > 0
+        if updated:
+            changed = {field: value for field, value in
+                       (('title', title), ('description', description), ('description_long', description_long))
+                       if value is not None and value != before[field]}
+            record_change(cursor, self.id, {'fields': changed}, "Edited details")
+    return updated
 
 @rt('/checklist/{checklist_id}/edit')
 def get(req):
     checklist_id = int(req.path_params['checklist_id'])
+    # The tag picker lists every tag, not just this checklist's
+    etag = page_etag(req, 'edit', checklist_id, get_checklist_version(checklist_id), get_tags_version())
+    if not_modified(req, etag):
+        return NotModified(etag)
+    if wants_stream(req):
+        return StreamingHTML(*stream_checklist_edit(checklist_id), headers=etag_headers(etag))
     checklist = get_checklist_with_steps(checklist_id)
     if not checklist:
         return Div("Checklist not found", cls="uk-alert uk-alert-danger")
-    return render_checklist_edit(checklist)
+    return render_checklist_edit(checklist), *etag_headers(etag)
+
+
+@rt('/checklist/{checklist_id}/history')
+async def get(req):
+    return await run_db(render_history, int(req.path_params['checklist_id']))
+
+@rt('/checklist/{checklist_id}/history/page')
+async def get(req):
+    """Older versions (requested by the infinite-scroll sentinel)"""
+    return tuple(await run_db(render_history_rows,
+                              int(req.path_params['checklist_id']),
+                              int_param(req, 'before')))
+
+@rt('/checklist/{checklist_id}/history/{seq}')
+async def get(req):
+    return await run_db(render_version, int(req.path_params['checklist_id']), int(req.path_params['seq']))
+
+@rt('/checklist/{checklist_id}/history/{seq}/revert', methods=['POST'])
+async def post(req):
+    checklist_id = int(req.path_params['checklist_id'])
+    if await run_db(revert_to_version, checklist_id, int(req.path_params['seq'])) is None:
+        return Div("Version not found", cls="uk-alert uk-alert-danger")
+    return await run_db(render_checklist_edit, await aget_checklist_with_steps(checklist_id))
+
+
+@rt('/checklist/{checklist_id}/analytics')
+async def get(req):
+    checklist_id = int(req.path_params['checklist_id'])
+    checklist = await aget_checklist_with_steps(checklist_id)
+    if not checklist:
+        return Div("Checklist not found", cls="uk-alert uk-alert-danger")
+    return Div(
+        A("← Back to instances",
+          cls="uk-link-text",
+          **{'hx-get': f'/checklist/{checklist_id}/instances',
+             'hx-target': '#main-content',
+             'hx-push-url': 'true'}),
+        H2(f"{checklist.title}: analytics", cls="uk-heading-small"),
+        DivLAligned(
+            A("All templates",
+              cls="uk-link-text",
+              **{'hx-get': '/analytics',
+                 'hx-target': '#main-content',
+                 'hx-push-url': 'true'}),
+            A("Daily report",
+              cls="uk-link-text",
+              **{'hx-get': f'/checklist/{checklist_id}/report',
+                 'hx-target': '#main-content',
+                 'hx-push-url': 'true'})),
+        await run_db(render_template_metrics, checklist_id),
+        await run_db(render_step_metrics, checklist.steps),
+        await run_db(render_duration_stats, checklist_id),
+        cls="uk-container uk-margin-top",
+        id="main-content"
+    )
+
+@rt('/analytics')
+async def get(req):
+    return await run_db(render_dashboard)
+
+@rt('/checklist/{checklist_id}/report')
+async def get(req):
+    """Created/completed counts per day, week or month, from the daily rollups"""
+    checklist_id = int(req.path_params['checklist_id'])
+    checklist = await aget_checklist_with_steps(checklist_id)
+    if not checklist:
+        return Div("Checklist not found", cls="uk-alert uk-alert-danger")
+    period = req.query_params.get('period', 'week')
+    if period not in PERIODS:
+        return Div("Unknown period", cls="uk-alert uk-alert-danger")
+    return Div(
+        A("← Back to analytics",
+          cls="uk-link-text",
+          **{'hx-get': f'/checklist/{checklist_id}/analytics',
+             'hx-target': '#main-content',
+             'hx-push-url': 'true'}),
+        await run_db(render_report, checklist_id, f"{checklist.title}: report", period,
+                     req.query_params.get('since')),
+        cls="uk-container uk-margin-top",
+        id="main-content"
+    )
+
+@rt('/reports')
+async def get(req):
+    """The same report summed over every template"""
+    period = req.query_params.get('period', 'week')
+    if period not in PERIODS:
+        return Div("Unknown period", cls="uk-alert uk-alert-danger")
+    return Div(
+        A("← Back to analytics",
+          cls="uk-link-text",
+          **{'hx-get': '/analytics',
+             'hx-target': '#main-content',
+             'hx-push-url': 'true'}),
+        await run_db(render_report, None, "All templates: report", period,
+                     req.query_params.get('since')),
+        cls="uk-container uk-margin-top",
+        id="main-content"
+    )
+
+
+@rt('/checklist/{checklist_id}/tags', methods=['POST'])
+async def post(req):
+    """Tag a checklist with an existing tag, or with a new one created under parent_id"""
+    checklist_id = int(req.path_params['checklist_id'])
+    form = await req.form()
+    name = form.get('name', '').strip()
+    try:
+        if name:
+            tag_id = await run_db(create_tag, name, int(form.get('parent_id') or 0) or None)
+        elif form.get('tag_id'):
+            tag_id = int(form['tag_id'])
+        else:
+            return await run_db(render_checklist_tags, checklist_id, "Choose a tag or enter a name")
+    except ValueError as e:
+        return await run_db(render_checklist_tags, checklist_id, str(e))
+    await run_db(tag_checklist, checklist_id, tag_id)
+    return await run_db(render_checklist_tags, checklist_id)
+
+@rt('/checklist/{checklist_id}/tags/{tag_id}', methods=['DELETE'])
+async def delete(req):
+    checklist_id = int(req.path_params['checklist_id'])
+    await run_db(untag_checklist, checklist_id, int(req.path_params['tag_id']))
+    return await run_db(render_checklist_tags, checklist_id)
 
 
 @rt('/checklist/{checklist_id}/step', methods=['POST'])
@@ -141,7 +336,7 @@ async def post(req):
         reference_url = form.get('step_ref', '').strip()
         
         # Create step using the new function
-        step_id, ref_error = create_new_step(
+        step_id, ref_error = await acreate_new_step(
             checklist_id=checklist_id,
             text=text,
             position=position,
@@ -149,10 +344,10 @@ async def post(req):
         )
         
         # Get updated checklist for rendering
-        checklist = get_checklist_with_steps(checklist_id)
+        checklist = await aget_checklist_with_steps(checklist_id)
         if ref_error:
-            return render_checklist_edit(checklist), f"Step created but reference invalid: {ref_error}", 400
-        return render_sortable_steps(checklist) #render_checklist_edit(checklist)
+            return await run_db(render_checklist_edit, checklist), f"Step created but reference invalid: {ref_error}", 400
+        return await run_db(render_sortable_steps, checklist) #render_checklist_edit(checklist)
             
     except Exception as e:
         return f"Error creating step: {str(e)}", 500
@@ -164,11 +359,10 @@ async def delete(req):
     checklist_id = int(req.path_params['checklist_id'])
     step_id = int(req.path_params['step_id'])
     
-    with DBConnection() as cursor:
-        cursor.execute("DELETE FROM steps WHERE id = ? AND checklist_id = ?",
-                      (step_id, checklist_id))
+    if not await adelete_step(checklist_id, step_id):
+        return render_move_status("Step not found", error=True)
     
-    return render_checklist_edit(get_checklist_with_steps(checklist_id))
+    return *render_step_deleted(step_id), HttpHeader('HX-Trigger-After-Swap', 'stepsChanged')
 
 
 
@@ -178,27 +372,22 @@ async def put(req, step_id: int):
     """Handle reference URL updates"""
     form = await req.form()
     url = form.get('url', '').strip()
-    print(f"DEBUG: Received form data: {dict(form)}")
-    print(f"DEBUG: Parsed URL: '{url}'")
     
     # Get step first to ensure it exists
-    step = get_step(step_id)
+    step = await aget_step(step_id)
     if not step:
-        print(f"DEBUG: Step {step_id} not found")
-        return render_step_reference(step, None, error="Step not found")
+        return "Step not found", 404
         
     # Validate URL
     is_valid, error = validate_url(url)
-    print(f"DEBUG: URL validation - Valid: {is_valid}, Error: {error}")
     
     if not is_valid:
-        return render_step_reference(step, None, error=error)
+        return await run_db(render_step_reference, step, None, error=error)
         
     # Update reference
-    ref = update_step_reference(step_id, url)
-    print(f"DEBUG: Updated reference result: {dict(ref) if ref else None}")
+    await aupdate_step_reference(step_id, url)
     
-    return render_step_reference(step, None)
+    return await run_db(render_step_reference, step, None)
 
 @rt('/checklist/{checklist_id}/field/{field_name}', methods=['PUT'])
 async def put(req):
@@ -218,7 +407,7 @@ async def put(req):
             return "Empty value not allowed", 400
             
         # Update and get refreshed checklist
-        checklist = update_checklist_field(checklist_id, field_name, new_value)
+        checklist = await aupdate_checklist_field(checklist_id, field_name, new_value)
         if not checklist:
             return "Update failed", 404
             
@@ -240,32 +429,29 @@ async def put(req):
 @rt('/checklist/{checklist_id}/reorder-steps', methods=['POST'])
 async def post(req, id:list[int]):
     checklist_id = int(req.path_params['checklist_id'])
-    print("DEBUG: ====== REORDER ENDPOINT HIT ======")
-    print(f"DEBUG: Reordering steps - Received IDs: {id}")
     
-    with DBConnection() as cursor:
-        # First, verify all steps belong to this checklist
-        step_ids = ','.join('?' * len(id))
-        cursor.execute(f"""
-            SELECT COUNT(*) 
-            FROM steps 
-            WHERE checklist_id = ? AND id IN ({step_ids})
-        """, (checklist_id, *id))
-        
-        if cursor.fetchone()[0] != len(id):
-            return "Invalid step IDs", 400
-            
-        # Update all positions in a transaction
-        for i, step_id in enumerate(id):
-            cursor.execute("""
-                UPDATE steps 
-                SET order_index = ? 
-                WHERE id = ? AND checklist_id = ?
-            """, (i, step_id, checklist_id))
+    if not await aupdate_steps_order(checklist_id, id):
+        return "Invalid step IDs", 400
     
     # Return the updated list
-    checklist = get_checklist_with_steps(checklist_id)
-    return render_sortable_steps(checklist)
+    checklist = await aget_checklist_with_steps(checklist_id)
+    return await run_db(render_sortable_steps, checklist)
+
+@rt('/checklist/{checklist_id}/step/{step_id}/move', methods=['POST'])
+async def post(req):
+    """Move one step between its new neighbours (sent by the SortableJS end handler)"""
+    checklist_id = int(req.path_params['checklist_id'])
+    step_id = int(req.path_params['step_id'])
+    form = await req.form()
+    try:
+        prev_id = int(form['prev_id']) if form.get('prev_id') else None
+        next_id = int(form['next_id']) if form.get('next_id') else None
+    except ValueError:
+        return render_move_status("Invalid step IDs", error=True)
+    
+    if not await amove_step(checklist_id, step_id, prev_id, next_id):
+        return render_move_status("Invalid step IDs", error=True)
+    return render_move_status("Order saved")
 
 @rt('/checklist/{checklist_id}/step/{step_id}', methods=['PUT'])
 async def put(req):
@@ -286,7 +472,7 @@ async def put(req):
             return "No valid updates provided", 400
             
         # Update and get refreshed step
-        step = db_update_step(checklist_id, step_id, **updates)
+        step = await adb_update_step(checklist_id, step_id, **updates)
         if not step:
             return "Step not found or update failed", 404
         
@@ -304,25 +490,65 @@ async def put(req):
 @rt('/checklist/{checklist_id}/instances')
 def get(req):
     checklist_id = int(req.path_params['checklist_id'])
-    return render_instances(checklist_id=checklist_id)
+    status = req.query_params.get('status') or None
+    order = req.query_params.get('order', 'desc')
+    # Query params are part of the URL, so they don't need to be in the tag
+    etag = page_etag(req, 'instances', checklist_id, *(get_instances_version(checklist_id) or (None,)))
+    if not_modified(req, etag):
+        return NotModified(etag)
+    # One page of rows (PAGE_SIZE) at most, so there's nothing to gain from streaming it
+    return render_instances(checklist_id=checklist_id, status=status, order=order), *etag_headers(etag)
+
+@rt('/checklist/{checklist_id}/instances/page')
+def get(req):
+    """Next page of instance rows (requested by the infinite-scroll sentinel)"""
+    checklist_id = int(req.path_params['checklist_id'])
+    return tuple(instance_rows(checklist_id,
+                               status=req.query_params.get('status') or None,
+                               after=req.query_params.get('after'),
+                               order=req.query_params.get('order', 'desc')))
 
 @rt('/checklist/{checklist_id}/instance/{instance_id}')
 def get(req):
     checklist_id = int(req.path_params['checklist_id'])
     instance_id = int(req.path_params['instance_id'])
-    return render_instance_view(instance_id)
+    etag = page_etag(req, 'instance', instance_id, *(get_instance_version(instance_id) or (None,)))
+    if not_modified(req, etag):
+        return NotModified(etag)
+    if wants_stream(req):
+        return StreamingHTML(*stream_instance_view(instance_id), headers=etag_headers(etag))
+    return render_instance_view(instance_id), *etag_headers(etag)
+
+@rt('/checklist/{checklist_id}/instance/{instance_id}/events')
+async def get(req):
+    """Server-sent step changes for an open instance view (see live_updates.py)"""
+    instance_id = int(req.path_params['instance_id'])
+    if await run_db(get_instance_version, instance_id) is None:
+        return Response(status_code=204)  # tells EventSource not to reconnect
+
+    async def version():
+        # Polled for changes made through other worker processes
+        versions = await run_db(get_instance_version, instance_id)
+        return versions[2] if versions else None
+    return EventStream(hub.stream(instance_topic(instance_id), version))
 
 @rt('/checklist/{checklist_id}/instance/create')
 async def post(req):
     checklist_id = int(req.path_params['checklist_id'])
     form = await req.form()
-    instance_id = create_new_instance(
+    instance_id = await acreate_new_instance(
         checklist_id=checklist_id,
         name=form['name'],
         description=form.get('description'),
         target_date=form.get('target_date')
     )
-    return render_instances(checklist_id=checklist_id)
+    if req.headers.get('HX-Request'):
+        instance = await run_db(get_instance_row, instance_id)
+        if instance_in_view(instance, form.get('view_status') or None, form.get('view_order', 'desc')):
+            return instance_row(instance)
+        # The current filter or order wouldn't show the row at the top
+        return render_instances_status(f'Instance "{instance.name}" created')
+    return await run_db(render_instances, checklist_id=checklist_id)
 
 @rt('/checklist/{checklist_id}/instance/{instance_id}/step/{step_id}/status', methods=['PUT'])
 async def put(req):
@@ -332,8 +558,8 @@ async def put(req):
     form = await req.form()
     new_status = form.get('status')
     
-    if update_instance_step_status(step_id, new_status):
-        step = get_instance_step(step_id)
+    if await aupdate_instance_step_status(step_id, new_status):
+        step = await aget_instance_step(step_id)
         if step:
             return render_instance_step(step)
     
@@ -0,0 +1,278 @@
+"""Full-text search over checklists, steps and instances.
+
+`search_index` is an FTS5 table with one row per searchable item. Its rowid is
+`id * 4 + kind`, so triggers on the source tables can find and replace an
+item's row without a lookup. Results are ranked with bm25 (title matches
+count more than body matches) and returned with highlighted titles and snippets."""
+import html
+from urllib.parse import urlencode
+
+from fasthtml.common import *
+from monsterui.all import *
+from fastcore.basics import AttrDict
+
+from config import PAGE_SIZE
+from db_connection import DBConnection
+
+KINDS = {'checklist': 1, 'step': 2, 'instance': 3}
+KIND_NAMES = {code: name for name, code in KINDS.items()}
+TITLE_WEIGHT, BODY_WEIGHT = 10.0, 1.0
+
+# highlight()/snippet() mark matches with these; they're swapped for <mark>
+# after the text is HTML-escaped
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+SEARCH_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title,
+        body,
+        kind UNINDEXED,
+        checklist_id UNINDEXED,
+        tokenize = 'porter unicode61',
+        prefix = '2 3'
+    )
+"""
+
+# Row values per kind, shared by the triggers and the rebuild
+_CHECKLIST_ROW = "{t}.id * 4 + 1, {t}.title, COALESCE({t}.description, '') || ' ' || COALESCE({t}.description_long, ''), 1, {t}.id"
+_STEP_ROW = "{t}.id * 4 + 2, '', {t}.text, 2, {t}.checklist_id"
+_INSTANCE_ROW = "{t}.id * 4 + 3, {t}.name, COALESCE({t}.description, ''), 3, {t}.checklist_id"
+_COLUMNS = "rowid, title, body, kind, checklist_id"
+
+SEARCH_TRIGGERS = f"""
+    CREATE TRIGGER IF NOT EXISTS checklists_search_insert
+    AFTER INSERT ON checklists
+    BEGIN
+        INSERT INTO search_index ({_COLUMNS}) VALUES ({_CHECKLIST_ROW.format(t='NEW')});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS checklists_search_update
+    AFTER UPDATE OF title, description, description_long ON checklists
+    BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 1;
+        INSERT INTO search_index ({_COLUMNS}) VALUES ({_CHECKLIST_ROW.format(t='NEW')});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS checklists_search_delete
+    AFTER DELETE ON checklists
+    BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS steps_search_insert
+    AFTER INSERT ON steps
+    BEGIN
+        INSERT INTO search_index ({_COLUMNS}) VALUES ({_STEP_ROW.format(t='NEW')});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS steps_search_update
+    AFTER UPDATE OF text, checklist_id ON steps
+    BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 2;
+        INSERT INTO search_index ({_COLUMNS}) VALUES ({_STEP_ROW.format(t='NEW')});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS steps_search_delete
+    AFTER DELETE ON steps
+    BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 2;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS checklist_instances_search_insert
+    AFTER INSERT ON checklist_instances
+    BEGIN
+        INSERT INTO search_index ({_COLUMNS}) VALUES ({_INSTANCE_ROW.format(t='NEW')});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS checklist_instances_search_update
+    AFTER UPDATE OF name, description, checklist_id ON checklist_instances
+    BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 3;
+        INSERT INTO search_index ({_COLUMNS}) VALUES ({_INSTANCE_ROW.format(t='NEW')});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS checklist_instances_search_delete
+    AFTER DELETE ON checklist_instances
+    BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 3;
+    END;
+"""
+
+def ensure_search_triggers():
+    """Create the index and its triggers if missing.
+    Run at every startup, like versions.ensure_version_triggers: fast_app's
+    schema transform drops the triggers on checklists/steps."""
+    with DBConnection() as cursor:
+        cursor.execute(SEARCH_TABLE)
+        cursor.executescript(SEARCH_TRIGGERS)
+
+def rebuild_search_index(progress=print, batch_size=5000):
+    """Re-index everything, one id range of source rows per transaction.
+    Each range's index rows are replaced in place, with rows for deleted items
+    dropped in the same transaction, so search keeps answering from the old
+    rows until their replacements commit. The triggers keep rows written
+    meanwhile current (REPLACE makes re-indexing them harmless), so this is
+    safe to run while the app is up."""
+    ensure_search_triggers()
+    for table, row, kind in (('checklists', _CHECKLIST_ROW, KINDS['checklist']),
+                             ('steps', _STEP_ROW, KINDS['step']),
+                             ('checklist_instances', _INSTANCE_ROW, KINDS['instance'])):
+        with DBConnection() as cursor:
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+            max_id = cursor.fetchone()[0]
+        done = 0
+        for start in range(0, max_id, batch_size):
+            end = start + batch_size
+            with DBConnection() as cursor:
+                cursor.execute(f"""
+                    DELETE FROM search_index
+                    WHERE rowid > ? AND rowid <= ? AND kind = ?
+                      AND rowid / 4 NOT IN (SELECT id FROM {table} WHERE id > ? AND id <= ?)
+                """, (start * 4 + kind, end * 4 + kind, kind, start, end))
+                cursor.execute(f"""
+                    INSERT OR REPLACE INTO search_index ({_COLUMNS})
+                    SELECT {row.format(t='src')} FROM {table} src
+                    WHERE src.id > ? AND src.id <= ?
+                """, (start, end))
+                done += cursor.rowcount
+            progress(f"search_index: indexed {done} {table}")
+        with DBConnection() as cursor:
+            # Items deleted past the current last id
+            cursor.execute(f"""
+                DELETE FROM search_index
+                WHERE rowid > ? AND kind = ? AND rowid / 4 NOT IN (SELECT id FROM {table} WHERE id > ?)
+            """, (max_id * 4 + kind, kind, max_id))
+    with DBConnection() as cursor:
+        cursor.execute("INSERT INTO search_index(search_index) VALUES ('optimize')")
+
+def match_query(text):
+    """Turn free text into an FTS5 query: every word must match, the last one
+    as a prefix so results show up while typing. Quoting each word keeps FTS5
+    syntax characters in user input from being interpreted."""
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def search(text, kind=None, page=1, limit=PAGE_SIZE):
+    """Ranked matches for `text` as (results, has_more); `kind` limits them to
+    'checklist', 'step' or 'instance'"""
+    query = match_query(text)
+    if not query:
+        return [], False
+    page = max(int(page), 1)
+    where = "s.search_index MATCH ?"
+    params = [query]
+    if kind in KINDS:
+        where += " AND s.kind = ?"
+        params.append(KINDS[kind])
+    with DBConnection() as cursor:
+        cursor.execute(f"""
+            SELECT
+                s.rowid / 4 as id,
+                s.kind,
+                s.checklist_id,
+                highlight(s.search_index, 0, ?, ?) as title,
+                snippet(s.search_index, 1, ?, ?, '…', 16) as snippet,
+                c.title as checklist_title
+            FROM search_index s
+            LEFT JOIN checklists c ON c.id = s.checklist_id
+            WHERE {where}
+            ORDER BY bm25(s.search_index, ?, ?)
+            LIMIT ? OFFSET ?
+        """, (_MARK_START, _MARK_END, _MARK_START, _MARK_END, *params,
+              TITLE_WEIGHT, BODY_WEIGHT, limit + 1, (page - 1) * limit))
+        rows = cursor.fetchall()
+    results = [AttrDict(dict(row), kind=KIND_NAMES[row['kind']]) for row in rows[:limit]]
+    return results, len(rows) > limit
+
+
+# Rendering
+
+def highlighted(text):
+    """HTML-escape `text`, turning the match markers into <mark> tags"""
+    escaped = html.escape(text or '')
+    return NotStr(escaped.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+def result_link(result):
+    if result.kind == 'checklist':
+        return f'/checklist/{result.id}'
+    if result.kind == 'step':
+        return f'/checklist/{result.checklist_id}'
+    return f'/checklist/{result.checklist_id}/instance/{result.id}'
+
+def render_search_result(result):
+    # Steps have no title of their own; show which checklist they belong to
+    title = highlighted(result.title) if result.title else result.checklist_title or "Untitled"
+    return Li(
+        Div(
+            A(title,
+              cls="uk-link-text uk-text-bold",
+              **{'hx-get': result_link(result),
+                 'hx-target': '#main-content',
+                 'hx-push-url': 'true'}),
+            Span(result.kind.title(), cls="uk-label uk-margin-small-left"),
+        ),
+        P(highlighted(result.snippet), cls="uk-text-small uk-margin-remove") if result.snippet else "",
+        P(f"In: {result.checklist_title}", cls="uk-text-meta uk-margin-remove")
+        if result.kind != 'checklist' and result.checklist_title else "",
+    )
+
+def search_result_items(text, kind=None, page=1):
+    """Result items for one page, plus a sentinel that loads the next page when revealed"""
+    results, has_more = search(text, kind, page)
+    items = [render_search_result(result) for result in results]
+    if has_more:
+        query = urlencode({'q': text, 'kind': kind or '', 'page': int(page) + 1})
+        items.append(Li("Loading more...",
+                        cls="uk-text-muted uk-text-center",
+                        hx_get=f'/search/results?{query}',
+                        hx_trigger='revealed',
+                        hx_swap='outerHTML'))
+    elif not items and page == 1 and text.strip():
+        items.append(Li("No matches", cls="uk-text-muted"))
+    return items
+
+def render_search_results(text, kind=None):
+    return Ul(*search_result_items(text, kind), id="search-results",
+              cls="uk-list uk-list-divider")
+
+def render_search_form(text='', kind=None):
+    """Search box; results update as you type"""
+    return Form(
+        Div(
+            Input(type="search", name="q", value=text, placeholder="Search checklists, steps and instances",
+                  cls="uk-input uk-width-expand", autocomplete="off"),
+            Select(
+                Option("Everything", value="", selected=not kind),
+                *(Option(name.title() + "s", value=name, selected=kind == name) for name in KINDS),
+                name="kind",
+                cls="uk-select uk-width-small uk-margin-small-left"
+            ),
+            cls="uk-flex"
+        ),
+        **{'hx-get': '/search/results',
+           'hx-trigger': 'input changed delay:300ms from:input, change from:select, submit',
+           'hx-target': '#search-results',
+           'hx-swap': 'outerHTML'},
+        cls="uk-margin-bottom"
+    )
+
+def render_search_page(text='', kind=None):
+    return Div(
+        Div(
+            A("← Back",
+              cls="uk-link-text",
+              **{'hx-get': '/',
+                 'hx-target': '#main-content',
+                 'hx-push-url': 'true'}),
+            cls="uk-margin-top"
+        ),
+        H2("Search", cls="uk-heading-small"),
+        render_search_form(text, kind),
+        render_search_results(text, kind),
+        cls="uk-container uk-margin-top",
+        id="main-content"
+    )
@@ -0,0 +1,205 @@
+"""Self-hosted, precompressed copies of the third-party scripts and stylesheets.
+
+ASSETS lists every file the page head loads from a CDN. Vendoring them is a
+two-step process:
+
+    python static_assets.py --fetch   # where the CDNs are reachable; commit static/vendor/
+    python static_assets.py           # optional, startup does the same
+
+The build writes content-hashed copies (e.g. htmx.3fa9c2d1e0.js) to
+static/build/, with a .gz and (if the brotli package is installed) a .br next
+to each, plus a manifest.json. `asset_hdrs` rewrites the head's src/href
+attributes to /assets/<hashed name> for every built asset. In development
+anything not vendored yet keeps its CDN URL, with a warning, so a fresh
+checkout still runs; the production profile refuses to start instead
+(`require_assets`). /assets/ responses are cacheable for a year (immutable, since the name
+changes with the content) and sent precompressed when the client accepts it."""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import urllib.request
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+from fasthtml.common import *
+from fastcore.xml import FT
+from fasthtml.pico import picolink
+from monsterui.all import HEADER_URLS
+from starlette.routing import Route
+
+from compression import accepted_encodings
+
+STATIC_DIR = Path(__file__).parent / 'static'
+VENDOR_DIR = STATIC_DIR / 'vendor'
+BUILD_DIR = STATIC_DIR / 'build'
+MANIFEST = BUILD_DIR / 'manifest.json'
+
+ASSET_PREFIX = '/assets'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+SSE_URL = 'https://cdn.jsdelivr.net/npm/htmx-ext-sse@2.2.2/sse.js'
+SORTABLE_URL = 'https://cdn.jsdelivr.net/npm/sortablejs@1.15.0/Sortable.min.js'
+
+# Vendored file name -> upstream URL
+ASSETS = {
+    'htmx.js': htmxsrc.src,
+    'fasthtml.js': fhjsscr.src,
+    'surreal.js': surrsrc.src,
+    'css-scope-inline.js': scopesrc.src,
+    'pico.min.css': picolink[0].href,
+    'franken-ui.core.min.css': HEADER_URLS['franken_css'],
+    'franken-ui.core.iife.js': HEADER_URLS['franken_js_core'],
+    'franken-ui.icon.iife.js': HEADER_URLS['franken_icons'],
+    'tailwindcss.js': HEADER_URLS['tailwind'],
+    'daisyui.full.min.css': HEADER_URLS['daisyui'],
+    'htmx-ext-sse.js': SSE_URL,
+    'Sortable.min.js': SORTABLE_URL,
+}
+
+# (Content-Encoding, file suffix), in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+# Building
+
+def fetch_assets():
+    """Download any vendored files that are missing; returns the names fetched"""
+    VENDOR_DIR.mkdir(parents=True, exist_ok=True)
+    fetched = []
+    for name, url in ASSETS.items():
+        path = VENDOR_DIR / name
+        if path.exists():
+            continue
+        with urllib.request.urlopen(url, timeout=30) as response:
+            _write(path, response.read())
+        fetched.append(name)
+    return fetched
+
+def _write(path, data):
+    """Write via a temp file and rename, so concurrent builds never expose a partial file"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+def hashed_name(name, data):
+    stem, ext = name.rsplit('.', 1)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}.{ext}"
+
+def build_assets():
+    """(Re)build static/build/ from static/vendor/ if anything changed; returns the manifest"""
+    manifest = {}
+    for name in ASSETS:
+        path = VENDOR_DIR / name
+        if path.exists():
+            data = path.read_bytes()
+            manifest[name] = dict(file=hashed_name(name, data), size=len(data))
+    if manifest == _read_manifest():
+        return manifest
+
+    BUILD_DIR.mkdir(parents=True, exist_ok=True)
+    for name, entry in manifest.items():
+        data = (VENDOR_DIR / name).read_bytes()
+        out = BUILD_DIR / entry['file']
+        _write(out, data)
+        _write(out.with_name(out.name + '.gz'), gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(out.with_name(out.name + '.br'), brotli.compress(data, quality=11))
+    keep = {entry['file'] + suffix for entry in manifest.values() for suffix in ('', '.gz', '.br')}
+    for path in BUILD_DIR.iterdir():
+        if path.name not in keep and path != MANIFEST:
+            path.unlink()
+    _write(MANIFEST, json.dumps(manifest, indent=1, sort_keys=True).encode())
+    _manifest.clear()
+    return manifest
+
+
+# Serving
+
+_manifest = {}
+
+def _read_manifest():
+    """The built assets whose files are present"""
+    try:
+        manifest = json.loads(MANIFEST.read_text())
+    except (OSError, ValueError):
+        return {}
+    return {name: entry for name, entry in manifest.items()
+            if (BUILD_DIR / entry['file']).exists()}
+
+def get_manifest():
+    if not _manifest:
+        _manifest.update(_read_manifest())
+    return _manifest
+
+def asset_url(name):
+    """The self-hosted URL for a vendored file, or its CDN URL if it isn't built"""
+    entry = get_manifest().get(name)
+    return f"{ASSET_PREFIX}/{entry['file']}" if entry else ASSETS[name]
+
+def _localize(item, urls):
+    if isinstance(item, (tuple, list)):
+        return type(item)(_localize(i, urls) for i in item)
+    if isinstance(item, FT):
+        for attr in ('src', 'href'):
+            if item.attrs.get(attr) in urls:
+                return FT(item.tag, item.children, {**item.attrs, attr: urls[item.attrs[attr]]})
+    return item
+
+def missing_assets():
+    """Names of the assets that aren't built, so the head loads them from their CDN"""
+    return [name for name in ASSETS if name not in get_manifest()]
+
+def warn_missing_assets():
+    missing = missing_assets()
+    if missing:
+        print(f"Static assets not vendored, loading from CDN: {', '.join(missing)} "
+              f"(run python static_assets.py --fetch)")
+
+def require_assets():
+    """Raise unless every asset is built: production never falls back to a CDN"""
+    missing = missing_assets()
+    if missing:
+        raise RuntimeError(f"Static assets not vendored: {', '.join(missing)} "
+                           f"(run python static_assets.py --fetch and commit static/vendor/)")
+
+def asset_hdrs(*hdrs):
+    """`hdrs` with every vendored CDN URL pointed at its self-hosted copy"""
+    return _localize(list(hdrs), {url: asset_url(name) for name, url in ASSETS.items()})
+
+async def serve_asset(req):
+    fname = req.path_params['fname']
+    if fname not in {entry['file'] for entry in get_manifest().values()}:
+        return Response("Not found", status_code=404)
+    path = BUILD_DIR / fname
+    headers = {'Cache-Control': IMMUTABLE, 'Vary': 'Accept-Encoding'}
+    media_type = mimetypes.guess_type(fname)[0] or 'application/octet-stream'
+    accepted = accepted_encodings(req.headers.get('accept-encoding', ''))
+    for coding, suffix in ENCODINGS:
+        variant = path.with_name(path.name + suffix)
+        if coding in accepted and variant.exists():
+            headers['Content-Encoding'] = coding
+            return FileResponse(variant, media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+def mount_assets(app):
+    """Serve /assets/. Inserted ahead of fast_app's catch-all static file route,
+    which would otherwise match the .js/.css names first."""
+    app.router.routes.insert(0, Route(f"{ASSET_PREFIX}/{{fname}}", serve_asset))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fetch', action='store_true', help='Download missing files into static/vendor/ first')
+    args = parser.parse_args()
+    if args.fetch:
+        print(f"Fetched {len(fetch_assets())} file(s)")
+    manifest = build_assets()
+    print(f"Built {len(manifest)}/{len(ASSETS)} asset(s) in {BUILD_DIR}"
+          + ("" if brotli else " (gzip only: install brotli for .br variants)"))
@@ -0,0 +1,309 @@
+"""Step status event log and incremental duration analytics.
+
+`update_instance_step_status` appends a row to `instance_step_events` in the
+same transaction as every status change. `process_events` rolls new events up
+into per-step and per-template duration aggregates. It reads only events past
+the high-water mark stored in `analytics_state`, so each event is read once and
+no analytics query rescans the log.
+
+A step's duration runs from when it was first set to "In Progress" (or, if it
+skipped that, from when its instance was created) until it is set to
+"Completed". An instance's duration runs from its creation until its last
+step is first completed; reopening and completing it again doesn't count it
+twice (`instance_first_completions`).
+
+The rollup worker (see rollups.start_rollup_worker) calls `process_events` in
+the background, or run `python step_analytics.py` from cron. Pages only read
+the aggregates, so they may trail the latest events by a refresh interval."""
+import argparse
+from datetime import datetime
+
+from fasthtml.common import *
+from monsterui.all import *
+from fastcore.basics import AttrDict
+
+from db_connection import DBConnection
+
+EVENTS_HWM = 'instance_step_events'
+BATCH_SIZE = 5000
+
+ANALYTICS_TABLES = """
+    CREATE TABLE IF NOT EXISTS instance_step_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        instance_step_id INTEGER NOT NULL,
+        instance_id INTEGER NOT NULL,
+        step_id INTEGER NOT NULL,
+        checklist_id INTEGER NOT NULL,
+        old_status TEXT,
+        new_status TEXT,
+        instance_done INTEGER NOT NULL DEFAULT 0,  -- this change completed the instance
+        created_at TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS analytics_state (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+
+    -- Steps started but not yet completed, as of the high-water mark
+    CREATE TABLE IF NOT EXISTS step_timers (
+        instance_step_id INTEGER PRIMARY KEY,
+        started_at TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS step_duration_stats (
+        step_id INTEGER PRIMARY KEY,
+        checklist_id INTEGER NOT NULL,
+        completions INTEGER NOT NULL DEFAULT 0,
+        total_seconds REAL NOT NULL DEFAULT 0,
+        min_seconds REAL,
+        max_seconds REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_step_duration_stats_checklist ON step_duration_stats (checklist_id);
+
+    -- Each instance's first completion, the one template_duration_stats counts
+    CREATE TABLE IF NOT EXISTS instance_first_completions (
+        instance_id INTEGER PRIMARY KEY,
+        checklist_id INTEGER NOT NULL,
+        seconds REAL NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS template_duration_stats (
+        checklist_id INTEGER PRIMARY KEY,
+        step_completions INTEGER NOT NULL DEFAULT 0,
+        step_total_seconds REAL NOT NULL DEFAULT 0,
+        instance_completions INTEGER NOT NULL DEFAULT 0,
+        instance_total_seconds REAL NOT NULL DEFAULT 0,
+        min_instance_seconds REAL,
+        max_instance_seconds REAL
+    );
+"""
+
+def ensure_analytics_tables():
+    with DBConnection() as cursor:
+        cursor.executescript(ANALYTICS_TABLES)
+
+def record_step_event(cursor, instance_step_id, old_status):
+    """Log a status change; call inside the transaction that made it, after the update"""
+    cursor.execute("""
+        INSERT INTO instance_step_events
+        (instance_step_id, instance_id, step_id, checklist_id, old_status, new_status, instance_done, created_at)
+        SELECT i_steps.id, i_steps.instance_id, i_steps.step_id, ci.checklist_id, ?, i_steps.status,
+               i_steps.status = 'Completed' AND ci.completed_steps = ci.total_steps,
+               i_steps.updated_at
+        FROM instance_steps i_steps
+        JOIN checklist_instances ci ON ci.id = i_steps.instance_id
+        WHERE i_steps.id = ?
+    """, (old_status, instance_step_id))
+
+
+def _seconds(start, end):
+    return max((datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds(), 0.0)
+
+def _merge(stats, key, seconds):
+    count, total, low, high = stats.get(key, (0, 0.0, None, None))
+    stats[key] = (count + 1, total + seconds,
+                  seconds if low is None else min(low, seconds),
+                  seconds if high is None else max(high, seconds))
+
+def process_events(batch_size=BATCH_SIZE):
+    """Roll events past the high-water mark into the duration aggregates, one
+    batch per transaction; returns the number of events processed"""
+    processed = 0
+    while True:
+        with DBConnection() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("SELECT value FROM analytics_state WHERE name = ?", (EVENTS_HWM,))
+                row = cursor.fetchone()
+                hwm = row['value'] if row else 0
+                cursor.execute("""
+                    SELECT e.*, ci.created_at as instance_created_at
+                    FROM instance_step_events e
+                    LEFT JOIN checklist_instances ci ON ci.id = e.instance_id
+                    WHERE e.id > ?
+                    ORDER BY e.id
+                    LIMIT ?
+                """, (hwm, batch_size))
+                events = cursor.fetchall()
+                if not events:
+                    cursor.execute("COMMIT")
+                    return processed
+
+                # Open timers for the steps in this batch
+                step_ids = sorted({e['instance_step_id'] for e in events})
+                cursor.execute(f"""
+                    SELECT instance_step_id, started_at FROM step_timers
+                    WHERE instance_step_id IN ({','.join('?' * len(step_ids))})
+                """, step_ids)
+                timers = {r['instance_step_id']: r['started_at'] for r in cursor.fetchall()}
+
+                step_stats, template_steps, finished = {}, {}, {}
+                for e in events:
+                    if e['new_status'] == 'In Progress':
+                        timers.setdefault(e['instance_step_id'], e['created_at'])
+                    elif e['new_status'] == 'Completed':
+                        started = timers.pop(e['instance_step_id'], None) or e['instance_created_at']
+                        if started:
+                            seconds = _seconds(started, e['created_at'])
+                            _merge(step_stats, (e['step_id'], e['checklist_id']), seconds)
+                            _merge(template_steps, e['checklist_id'], seconds)
+                        if e['instance_done'] and e['instance_created_at']:
+                            finished.setdefault(e['instance_id'], (
+                                e['checklist_id'], _seconds(e['instance_created_at'], e['created_at'])))
+                    else:
+                        timers.pop(e['instance_step_id'], None)
+
+                # Only instances completing for the first time count towards the template
+                template_instances = {}
+                for instance_id, (checklist_id, seconds) in finished.items():
+                    cursor.execute("""
+                        INSERT OR IGNORE INTO instance_first_completions (instance_id, checklist_id, seconds)
+                        VALUES (?, ?, ?)
+                    """, (instance_id, checklist_id, seconds))
+                    if cursor.rowcount:
+                        _merge(template_instances, checklist_id, seconds)
+
+                cursor.execute(f"""
+                    DELETE FROM step_timers
+                    WHERE instance_step_id IN ({','.join('?' * len(step_ids))})
+                """, step_ids)
+                cursor.executemany("""
+                    INSERT INTO step_timers (instance_step_id, started_at) VALUES (?, ?)
+                """, list(timers.items()))
+                cursor.executemany("""
+                    INSERT INTO step_duration_stats
+                    (step_id, checklist_id, completions, total_seconds, min_seconds, max_seconds)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(step_id) DO UPDATE SET
+                        completions = completions + excluded.completions,
+                        total_seconds = total_seconds + excluded.total_seconds,
+                        min_seconds = MIN(COALESCE(min_seconds, excluded.min_seconds), excluded.min_seconds),
+                        max_seconds = MAX(COALESCE(max_seconds, excluded.max_seconds), excluded.max_seconds)
+                """, [(step_id, checklist_id, *stats) for (step_id, checklist_id), stats in step_stats.items()])
+                cursor.executemany("""
+                    INSERT INTO template_duration_stats (checklist_id, step_completions, step_total_seconds)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(checklist_id) DO UPDATE SET
+                        step_completions = step_completions + excluded.step_completions,
+                        step_total_seconds = step_total_seconds + excluded.step_total_seconds
+                """, [(checklist_id, count, total) for checklist_id, (count, total, _, _) in template_steps.items()])
+                cursor.executemany("""
+                    INSERT INTO template_duration_stats
+                    (checklist_id, instance_completions, instance_total_seconds, min_instance_seconds, max_instance_seconds)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(checklist_id) DO UPDATE SET
+                        instance_completions = instance_completions + excluded.instance_completions,
+                        instance_total_seconds = instance_total_seconds + excluded.instance_total_seconds,
+                        min_instance_seconds = MIN(COALESCE(min_instance_seconds, excluded.min_instance_seconds), excluded.min_instance_seconds),
+                        max_instance_seconds = MAX(COALESCE(max_instance_seconds, excluded.max_instance_seconds), excluded.max_instance_seconds)
+                """, [(checklist_id, *stats) for checklist_id, stats in template_instances.items()])
+                cursor.execute("""
+                    INSERT INTO analytics_state (name, value) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value
+                """, (EVENTS_HWM, events[-1]['id']))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        processed += len(events)
+        if len(events) < batch_size:
+            return processed
+
+def recount_first_completions(cursor):
+    """Fill instance_first_completions from the events processed so far and
+    recompute the templates' instance totals from it (corrects instances that
+    were counted once per re-completion)"""
+    cursor.execute("SELECT value FROM analytics_state WHERE name = ?", (EVENTS_HWM,))
+    row = cursor.fetchone()
+    cursor.execute("""
+        INSERT OR IGNORE INTO instance_first_completions (instance_id, checklist_id, seconds)
+        SELECT e.instance_id, e.checklist_id,
+               MAX((julianday(e.created_at) - julianday(ci.created_at)) * 86400.0, 0.0)
+        FROM instance_step_events e
+        JOIN checklist_instances ci ON ci.id = e.instance_id
+        WHERE e.instance_done AND e.id <= ?
+        ORDER BY e.id
+    """, (row['value'] if row else 0,))
+    cursor.execute("""
+        UPDATE template_duration_stats SET
+            (instance_completions, instance_total_seconds, min_instance_seconds, max_instance_seconds) = (
+                SELECT COUNT(*), COALESCE(SUM(seconds), 0), MIN(seconds), MAX(seconds)
+                FROM instance_first_completions f
+                WHERE f.checklist_id = template_duration_stats.checklist_id)
+    """)
+
+
+def get_step_durations(checklist_id):
+    """Per-step duration aggregates for a checklist, in step order"""
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT s.id as step_id, s.text,
+                   COALESCE(d.completions, 0) as completions,
+                   d.total_seconds / d.completions as avg_seconds,
+                   d.min_seconds, d.max_seconds
+            FROM steps s
+            LEFT JOIN step_duration_stats d ON d.step_id = s.id
+            WHERE s.checklist_id = ?
+            ORDER BY s.order_index
+        """, (checklist_id,))
+        return [AttrDict(dict(row)) for row in cursor.fetchall()]
+
+def get_template_durations(checklist_id):
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT step_completions, instance_completions,
+                   step_total_seconds / step_completions as avg_step_seconds,
+                   instance_total_seconds / instance_completions as avg_instance_seconds,
+                   min_instance_seconds, max_instance_seconds
+            FROM template_duration_stats WHERE checklist_id = ?
+        """, (checklist_id,))
+        row = cursor.fetchone()
+        return AttrDict(dict(row)) if row else None
+
+
+# Rendering
+
+def format_duration(seconds):
+    if seconds is None:
+        return "–"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days}d {hours}h"
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m {secs}s"
+
+def render_duration_stats(checklist_id):
+    """Step and template durations, as of the last `process_events`"""
+    template = get_template_durations(checklist_id)
+    return Div(
+        H3("Durations", cls="uk-heading-small"),
+        P(f"Instances completed: {template.instance_completions}, "
+          f"average {format_duration(template.avg_instance_seconds)} "
+          f"(fastest {format_duration(template.min_instance_seconds)}, "
+          f"slowest {format_duration(template.max_instance_seconds)})",
+          cls="uk-text-meta") if template else P("No completed steps yet", cls="uk-text-meta"),
+        Table(
+            Thead(Tr(Th("Step"), Th("Completions"), Th("Average"), Th("Fastest"), Th("Slowest"))),
+            Tbody(*(Tr(
+                Td(step.text),
+                Td(step.completions),
+                Td(format_duration(step.avg_seconds)),
+                Td(format_duration(step.min_seconds)),
+                Td(format_duration(step.max_seconds)),
+            ) for step in get_step_durations(checklist_id))),
+            cls="uk-table uk-table-divider uk-table-small"
+        ),
+        id="duration-stats"
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    ensure_analytics_tables()
+    print(f"Processed {process_events(args.batch_size)} event(s)")
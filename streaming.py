@@ -0,0 +1,44 @@
+"""Chunked HTML responses for long lists.
+
+A page is rendered as a normal FT tree with `STREAM_SLOT` where the list items
+go; the HTML before the slot is sent immediately, the items are rendered and
+sent in chunks as they come off a generator, and the HTML after the slot
+closes the page. Memory and time-to-first-byte no longer grow with the number
+of rows.
+
+The generator must not hold a pooled connection while the client reads:
+fetch rows in bounded chunks, each in its own `with DBConnection()` (see
+instance_functions.iter_instance_steps)."""
+from fastcore.xml import NotStr, to_xml
+from starlette.responses import StreamingResponse
+
+from config import STREAM_CHUNK_ROWS, STREAM_HTMX_RESPONSES
+
+STREAM_SLOT = NotStr('<!--stream-slot-->')
+
+def wants_stream(req):
+    """Stream htmx fragment requests; full page loads still need FastHTML's page wrapper"""
+    return STREAM_HTMX_RESPONSES and 'hx-request' in req.headers
+
+def iter_html(page, items, chunk_rows=STREAM_CHUNK_ROWS):
+    """Yield `page` as HTML with the FT components from `items` in place of STREAM_SLOT"""
+    head, sep, tail = to_xml(page).partition(str(STREAM_SLOT))
+    yield head
+    if not sep:  # e.g. a "not found" message in place of the page
+        return
+    chunk = []
+    for item in items:
+        chunk.append(to_xml(item))
+        if len(chunk) >= chunk_rows:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+    yield tail
+
+def StreamingHTML(page, items, chunk_rows=STREAM_CHUNK_ROWS, headers=()):
+    """A chunked text/html response, see iter_html
+    `headers` are extra HttpHeaders, as a route would return alongside FT content"""
+    return StreamingResponse(iter_html(page, items, chunk_rows), media_type='text/html',
+                             headers={'vary': 'HX-Request, HX-History-Restore-Request',
+                                      **{h.k: str(h.v) for h in headers}})
@@ -0,0 +1,289 @@
+"""Hierarchical tags (category / sub-category / sub-sub-category) for checklists.
+
+The tree lives in `tags` (with a materialized `path` for display order) and a
+closure table, `tag_closure`, holding one (ancestor, descendant, depth) row for
+every pair including each tag with itself. "Every checklist under tag X" is
+then a single indexed join, whatever the depth. `tags.checklist_count` counts
+the distinct checklists tagged anywhere in the tag's subtree and is kept
+current by triggers on `checklist_tags`."""
+from fasthtml.common import *
+from monsterui.all import *
+from fastcore.basics import AttrDict
+
+from db_connection import DBConnection
+
+MAX_TAG_DEPTH = 3  # category, sub-category, sub-sub-category
+PATH_SEP = '\x1f'  # sorts before any printable character, so ORDER BY path is tree order
+
+TAG_TABLES = """
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY,
+        parent_id INTEGER REFERENCES tags(id),
+        name TEXT NOT NULL,
+        path TEXT NOT NULL,
+        depth INTEGER NOT NULL,
+        checklist_count INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_tags_parent_name ON tags (COALESCE(parent_id, 0), name);
+
+    CREATE TABLE IF NOT EXISTS tag_closure (
+        ancestor_id INTEGER NOT NULL REFERENCES tags(id),
+        descendant_id INTEGER NOT NULL REFERENCES tags(id),
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS checklist_tags (
+        checklist_id INTEGER NOT NULL REFERENCES checklists(id),
+        tag_id INTEGER NOT NULL REFERENCES tags(id),
+        PRIMARY KEY (checklist_id, tag_id)
+    ) WITHOUT ROWID;
+"""
+
+TAG_TRIGGERS = """
+    -- +1 on every ancestor whose subtree didn't already contain the checklist
+    CREATE TRIGGER IF NOT EXISTS checklist_tags_count_insert
+    AFTER INSERT ON checklist_tags
+    BEGIN
+        UPDATE tags SET checklist_count = checklist_count + 1
+        WHERE id IN (SELECT ancestor_id FROM tag_closure WHERE descendant_id = NEW.tag_id)
+          AND NOT EXISTS (
+              SELECT 1 FROM checklist_tags ct
+              JOIN tag_closure tc ON tc.descendant_id = ct.tag_id
+              WHERE ct.checklist_id = NEW.checklist_id
+                AND tc.ancestor_id = tags.id
+                AND ct.tag_id != NEW.tag_id
+          );
+    END;
+
+    -- -1 on every ancestor whose subtree no longer contains the checklist
+    CREATE TRIGGER IF NOT EXISTS checklist_tags_count_delete
+    AFTER DELETE ON checklist_tags
+    BEGIN
+        UPDATE tags SET checklist_count = checklist_count - 1
+        WHERE id IN (SELECT ancestor_id FROM tag_closure WHERE descendant_id = OLD.tag_id)
+          AND NOT EXISTS (
+              SELECT 1 FROM checklist_tags ct
+              JOIN tag_closure tc ON tc.descendant_id = ct.tag_id
+              WHERE ct.checklist_id = OLD.checklist_id
+                AND tc.ancestor_id = tags.id
+          );
+    END;
+
+    -- A checklist's tags are shown on its edit page, see versions.py
+    CREATE TRIGGER IF NOT EXISTS checklist_tags_version_insert
+    AFTER INSERT ON checklist_tags
+    BEGIN
+        UPDATE checklists SET version = COALESCE(version, 0) + 1 WHERE id = NEW.checklist_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS checklist_tags_version_delete
+    AFTER DELETE ON checklist_tags
+    BEGIN
+        UPDATE checklists SET version = COALESCE(version, 0) + 1 WHERE id = OLD.checklist_id;
+    END;
+"""
+
+def ensure_tag_tables():
+    with DBConnection() as cursor:
+        cursor.executescript(TAG_TABLES)
+
+def ensure_tag_triggers():
+    """Create the count and version triggers if missing (run at every startup)"""
+    with DBConnection() as cursor:
+        cursor.executescript(TAG_TRIGGERS)
+
+def recompute_tag_counts():
+    """Recompute every tag's subtree checklist count from checklist_tags"""
+    with DBConnection() as cursor:
+        cursor.execute("""
+            UPDATE tags SET checklist_count = (
+                SELECT COUNT(DISTINCT ct.checklist_id)
+                FROM tag_closure tc
+                JOIN checklist_tags ct ON ct.tag_id = tc.descendant_id
+                WHERE tc.ancestor_id = tags.id
+            )
+        """)
+
+
+# Tree
+
+def create_tag(name, parent_id=None):
+    """Add a tag under `parent_id` (or at the top level) and return its id;
+    returns the existing tag's id if the parent already has one of that name"""
+    name = name.strip()
+    if not name:
+        raise ValueError("Tag name is required")
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT id FROM tags WHERE COALESCE(parent_id, 0) = ? AND name = ?
+        """, (parent_id or 0, name))
+        row = cursor.fetchone()
+        if row:
+            return row['id']
+
+        path, depth = name, 1
+        if parent_id:
+            cursor.execute("SELECT path, depth FROM tags WHERE id = ?", (parent_id,))
+            parent = cursor.fetchone()
+            if not parent:
+                raise ValueError(f"Tag {parent_id} not found")
+            if parent['depth'] >= MAX_TAG_DEPTH:
+                raise ValueError(f"Tags can only be nested {MAX_TAG_DEPTH} levels deep")
+            path, depth = parent['path'] + PATH_SEP + name, parent['depth'] + 1
+
+        cursor.execute("""
+            INSERT INTO tags (parent_id, name, path, depth) VALUES (?, ?, ?, ?)
+        """, (parent_id or None, name, path, depth))
+        tag_id = cursor.lastrowid
+        # The parent's ancestors (including the parent itself) are ours too
+        cursor.execute("""
+            INSERT INTO tag_closure (ancestor_id, descendant_id, depth)
+            SELECT ancestor_id, ?, depth + 1 FROM tag_closure WHERE descendant_id = ?
+            UNION ALL
+            SELECT ?, ?, 0
+        """, (tag_id, parent_id or 0, tag_id, tag_id))
+        return tag_id
+
+def delete_tag(tag_id):
+    """Delete a tag and everything under it, untagging their checklists"""
+    with DBConnection() as cursor:
+        cursor.execute("SELECT descendant_id FROM tag_closure WHERE ancestor_id = ?", (tag_id,))
+        subtree = [row['descendant_id'] for row in cursor.fetchall()]
+        if not subtree:
+            return False
+        marks = ', '.join('?' * len(subtree))
+        # Untag first so the count triggers still see the tree
+        cursor.execute(f"DELETE FROM checklist_tags WHERE tag_id IN ({marks})", subtree)
+        cursor.execute(f"DELETE FROM tag_closure WHERE descendant_id IN ({marks})", subtree)
+        cursor.execute(f"DELETE FROM tags WHERE id IN ({marks})", subtree)
+        return True
+
+def get_tags():
+    """All tags in tree order, with their subtree checklist counts"""
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT id, parent_id, name, path, depth, checklist_count
+            FROM tags
+            ORDER BY path
+        """)
+        return [AttrDict(dict(row)) for row in cursor.fetchall()]
+
+def get_tag(tag_id):
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT id, parent_id, name, path, depth, checklist_count FROM tags WHERE id = ?
+        """, (tag_id,))
+        row = cursor.fetchone()
+        return AttrDict(dict(row)) if row else None
+
+def tag_display_path(tag):
+    return tag.path.replace(PATH_SEP, ' › ')
+
+
+# Checklists
+
+def subtree_filter_sql(alias=''):
+    """WHERE-clause fragment limiting checklists to those tagged under a tag
+    (one `?` param: the tag id)"""
+    prefix = f"{alias}." if alias else ""
+    return f""" AND {prefix}id IN (
+        SELECT ct.checklist_id
+        FROM tag_closure tc
+        JOIN checklist_tags ct ON ct.tag_id = tc.descendant_id
+        WHERE tc.ancestor_id = ?
+    )"""
+
+def get_checklist_tags(checklist_id):
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT t.id, t.parent_id, t.name, t.path, t.depth, t.checklist_count
+            FROM checklist_tags ct
+            JOIN tags t ON t.id = ct.tag_id
+            WHERE ct.checklist_id = ?
+            ORDER BY t.path
+        """, (checklist_id,))
+        return [AttrDict(dict(row)) for row in cursor.fetchall()]
+
+def tag_checklist(checklist_id, tag_id):
+    with DBConnection() as cursor:
+        cursor.execute("""
+            INSERT OR IGNORE INTO checklist_tags (checklist_id, tag_id)
+            SELECT c.id, t.id FROM checklists c, tags t
+            WHERE c.id = ? AND t.id = ?
+        """, (checklist_id, tag_id))
+        return cursor.rowcount > 0
+
+def untag_checklist(checklist_id, tag_id):
+    with DBConnection() as cursor:
+        cursor.execute("""
+            DELETE FROM checklist_tags WHERE checklist_id = ? AND tag_id = ?
+        """, (checklist_id, tag_id))
+        return cursor.rowcount > 0
+
+
+# Rendering
+
+def tag_options(tags, selected=None, with_counts=False):
+    """<option>s for a tag Select, indented by depth"""
+    return [Option(('  ' * (tag.depth - 1)) + tag.name
+                   + (f" ({tag.checklist_count})" if with_counts else ""),
+                   value=tag.id, selected=tag.id == selected)
+            for tag in tags]
+
+def render_tag_filter(tag_id=None, order='desc'):
+    """Main-page select that limits the checklist table to one tag's subtree"""
+    return Form(
+        Hidden(name="order", value=order),
+        Select(
+            Option("All categories", value="", selected=not tag_id),
+            *tag_options(get_tags(), tag_id, with_counts=True),
+            name="tag",
+            cls="uk-select uk-form-width-medium"
+        ),
+        **{'hx-get': '/',
+           'hx-trigger': 'change',
+           'hx-target': '#main-content',
+           'hx-push-url': 'true'}
+    )
+
+def render_checklist_tags(checklist_id, error=None):
+    """Tag editor for the checklist edit page"""
+    tags = get_tags()
+    return Div(
+        H3("Tags", cls="uk-heading-small uk-margin-top"),
+        Div(*(
+            Span(tag_display_path(tag), " ",
+                 A("×", cls="uk-link-reset",
+                   **{'hx-delete': f'/checklist/{checklist_id}/tags/{tag.id}',
+                      'hx-target': f'#checklist-tags-{checklist_id}',
+                      'hx-swap': 'outerHTML'}),
+                 cls="uk-label uk-margin-small-right")
+            for tag in get_checklist_tags(checklist_id)
+        ), cls="uk-margin-small-bottom"),
+        Form(
+            Select(
+                Option("Add existing tag...", value=""),
+                *tag_options(tags),
+                name="tag_id",
+                cls="uk-select uk-form-small uk-form-width-medium uk-margin-small-right"
+            ),
+            Span("or new", cls="uk-text-meta uk-margin-small-right"),
+            Input(name="name", placeholder="Tag name",
+                  cls="uk-input uk-form-small uk-form-width-small uk-margin-small-right"),
+            Select(
+                Option("at top level", value=""),
+                *(Option(f"under {tag_display_path(tag)}", value=tag.id)
+                  for tag in tags if tag.depth < MAX_TAG_DEPTH),
+                name="parent_id",
+                cls="uk-select uk-form-small uk-form-width-medium uk-margin-small-right"
+            ),
+            Button("Add", cls="uk-button uk-button-small uk-button-default", type="submit"),
+            cls="uk-flex uk-flex-middle",
+            **{'hx-post': f'/checklist/{checklist_id}/tags',
+               'hx-target': f'#checklist-tags-{checklist_id}',
+               'hx-swap': 'outerHTML'}
+        ),
+        P(error, cls="uk-text-danger uk-text-small") if error else "",
+        id=f'checklist-tags-{checklist_id}'
+    )
@@ -0,0 +1,381 @@
+"""Version history for checklist templates.
+
+Every change to a checklist's fields or steps appends a numbered version to
+`checklist_history`. Most versions are stored as a delta against the previous
+one; every HISTORY_SNAPSHOT_INTERVAL-th version is a full snapshot, so
+rebuilding any version reads one snapshot plus fewer than that many deltas.
+
+A template's state is
+    {"title": ..., "description": ..., "description_long": ...,
+     "steps": [[step_id, text, reference_url], ...]}      # in order
+and a delta holds only what changed:
+    {"fields": {name: value}, "steps": {id: [text, url]},  # new or edited
+     "removed": [id, ...], "moves": [[id, prev_id], ...]}  # see _order_moves
+
+Versions are written through the edit's own cursor, in the same transaction
+as the edit, so a version commits (or rolls back) with its change and
+concurrent edits get their versions in commit order. Single-step edits pass
+`record_change` the delta of what they just did, which costs a couple of
+indexed reads; only every snapshot version, reverts and whole-list reorders
+read the full checklist (`record_state`).
+
+Reverting writes an old state back as a new version, so history is append-only."""
+import json
+from datetime import datetime
+
+from fasthtml.common import *
+from monsterui.all import *
+from fastcore.basics import AttrDict
+
+from config import HISTORY_SNAPSHOT_INTERVAL, PAGE_SIZE
+from db_connection import DBConnection
+
+FIELDS = ('title', 'description', 'description_long')
+
+HISTORY_TABLE = """
+    CREATE TABLE IF NOT EXISTS checklist_history (
+        checklist_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        snapshot INTEGER NOT NULL DEFAULT 0,
+        data TEXT NOT NULL,
+        summary TEXT,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (checklist_id, seq)
+    ) WITHOUT ROWID
+"""
+
+def ensure_history_table():
+    with DBConnection() as cursor:
+        cursor.execute(HISTORY_TABLE)
+
+
+# State and deltas
+
+def read_state(cursor, checklist_id):
+    """The checklist as `cursor` sees it now, or None if it doesn't exist"""
+    cursor.execute(f"SELECT {', '.join(FIELDS)} FROM checklists WHERE id = ?", (checklist_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    cursor.execute("""
+        SELECT s.id, s.text, sr.url FROM steps s
+        LEFT JOIN step_references sr ON sr.step_id = s.id
+        WHERE s.checklist_id = ?
+        ORDER BY s.order_index, s.id
+    """, (checklist_id,))
+    return {
+        **{field: row[field] for field in FIELDS},
+        'steps': [[step['id'], step['text'], step['url']] for step in cursor.fetchall()],
+    }
+
+def _order_moves(old_ids, new_ids):
+    """[[id, prev_id], ...] turning `old_ids` into `new_ids` (after removals).
+    Steps on a longest run that kept its relative order aren't listed, so a
+    single drag is a single move."""
+    from checklist_edit import _longest_increasing_run
+    position = {step_id: i for i, step_id in enumerate(old_ids)}
+    staying = [i for i, step_id in enumerate(new_ids) if step_id in position]
+    keep = {new_ids[staying[i]] for i in _longest_increasing_run([position[new_ids[j]] for j in staying])}
+    return [[step_id, new_ids[i - 1] if i else None]
+            for i, step_id in enumerate(new_ids) if step_id not in keep]
+
+def diff_states(old, new):
+    """Delta from `old` to `new`, or None if they're the same"""
+    delta = {}
+    fields = {field: new[field] for field in FIELDS if old.get(field) != new[field]}
+    if fields:
+        delta['fields'] = fields
+    old_steps = {step[0]: step[1:] for step in old['steps']}
+    new_steps = {step[0]: step[1:] for step in new['steps']}
+    changed = {str(step_id): values for step_id, values in new_steps.items()
+               if old_steps.get(step_id) != values}
+    if changed:
+        delta['steps'] = changed
+    removed = [step_id for step_id in old_steps if step_id not in new_steps]
+    if removed:
+        delta['removed'] = removed
+    old_ids = [step[0] for step in old['steps'] if step[0] in new_steps]
+    new_ids = [step[0] for step in new['steps']]
+    if old_ids != new_ids:
+        delta['moves'] = _order_moves(old_ids, new_ids)
+    return delta or None
+
+def apply_delta(state, delta):
+    """The state after `delta`"""
+    state = {**state, **delta.get('fields', {})}
+    removed = set(delta.get('removed', ()))
+    values = {step[0]: step[1:] for step in state['steps'] if step[0] not in removed}
+    values.update({int(step_id): step for step_id, step in delta.get('steps', {}).items()})
+    moves = delta.get('moves', ())
+    moving = {step_id for step_id, _ in moves}
+    order = [step[0] for step in state['steps'] if step[0] not in removed and step[0] not in moving]
+    for step_id, prev_id in moves:
+        order.insert(order.index(prev_id) + 1 if prev_id is not None else 0, step_id)
+    state['steps'] = [[step_id, *values[step_id]] for step_id in order]
+    return state
+
+
+# History
+
+def _dumps(data):
+    return json.dumps(data, separators=(',', ':'))
+
+def _state_at(cursor, checklist_id, seq):
+    """Rebuild version `seq` from its nearest snapshot; None if there's no such version"""
+    cursor.execute("""
+        SELECT seq, snapshot, data FROM checklist_history
+        WHERE checklist_id = ? AND seq <= ? AND seq >= (
+            SELECT MAX(seq) FROM checklist_history
+            WHERE checklist_id = ? AND seq <= ? AND snapshot = 1
+        )
+        ORDER BY seq
+    """, (checklist_id, seq, checklist_id, seq))
+    rows = cursor.fetchall()
+    if not rows or rows[-1]['seq'] != seq:
+        return None
+    state = json.loads(rows[0]['data'])
+    for row in rows[1:]:
+        state = apply_delta(state, json.loads(row['data']))
+    return state
+
+def get_version_state(checklist_id, seq):
+    with DBConnection() as cursor:
+        return _state_at(cursor, checklist_id, seq)
+
+def latest_version(checklist_id):
+    with DBConnection() as cursor:
+        cursor.execute("SELECT MAX(seq) FROM checklist_history WHERE checklist_id = ?", (checklist_id,))
+        return cursor.fetchone()[0]
+
+def _append(cursor, checklist_id, summary, delta=None, state=None):
+    """Append the next version, from `delta` or from the full `state`"""
+    cursor.execute("SELECT MAX(seq) FROM checklist_history WHERE checklist_id = ?", (checklist_id,))
+    last = cursor.fetchone()[0] or 0
+    seq = last + 1
+    snapshot = last == 0 or (seq - 1) % HISTORY_SNAPSHOT_INTERVAL == 0
+    if snapshot:
+        data = state if state is not None else read_state(cursor, checklist_id)
+    else:
+        data = delta if delta is not None else diff_states(_state_at(cursor, checklist_id, last), state)
+        if data is None:
+            return None
+    cursor.execute("""
+        INSERT INTO checklist_history (checklist_id, seq, snapshot, data, summary, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (checklist_id, seq, int(snapshot), _dumps(data), summary, datetime.now().isoformat()))
+    return seq
+
+def record_change(cursor, checklist_id, delta, summary=None):
+    """Append `delta` (see the module docstring) as a new version; returns its
+    number, or None if the delta is empty.
+    Call with the edit's cursor, after its writes and before it commits."""
+    delta = {key: value for key, value in delta.items() if value}
+    if not delta:
+        return None
+    return _append(cursor, checklist_id, summary, delta=delta)
+
+def record_state(cursor, checklist_id, summary=None):
+    """Append the checklist's current state as a new version if it differs from
+    the last one; returns its number or None. Reads the whole checklist, so
+    it's for changes whose delta isn't known up front (reverts, partial
+    reorders, new checklists). Like record_change, call it inside the edit's
+    transaction."""
+    state = read_state(cursor, checklist_id)
+    if state is None:
+        return None
+    return _append(cursor, checklist_id, summary, state=state)
+
+def step_values(cursor, step_id):
+    """(checklist_id, text, reference url) of a step, or None"""
+    cursor.execute("""
+        SELECT s.checklist_id, s.text, sr.url FROM steps s
+        LEFT JOIN step_references sr ON sr.step_id = s.id
+        WHERE s.id = ?
+    """, (step_id,))
+    row = cursor.fetchone()
+    return tuple(row) if row else None
+
+def previous_step_id(cursor, checklist_id, step_id):
+    """The step just before `step_id` in its checklist, or None if it's first"""
+    cursor.execute("""
+        SELECT prev.id FROM steps s
+        JOIN steps prev ON prev.checklist_id = s.checklist_id
+            AND (prev.order_index, prev.id) < (s.order_index, s.id)
+        WHERE s.id = ? AND s.checklist_id = ?
+        ORDER BY prev.order_index DESC, prev.id DESC
+        LIMIT 1
+    """, (step_id, checklist_id))
+    row = cursor.fetchone()
+    return row['id'] if row else None
+
+def get_history(checklist_id, before=None, limit=PAGE_SIZE):
+    """Versions newest first, without their data; returns (versions, next `before`)"""
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT seq, snapshot, summary, created_at, LENGTH(data) as size
+            FROM checklist_history
+            WHERE checklist_id = ? AND seq < ?
+            ORDER BY seq DESC
+            LIMIT ?
+        """, (checklist_id, before or 2**62, limit + 1))
+        rows = [AttrDict(dict(row)) for row in cursor.fetchall()]
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].seq
+    return rows, None
+
+def delete_history(cursor, checklist_id):
+    cursor.execute("DELETE FROM checklist_history WHERE checklist_id = ?", (checklist_id,))
+
+def revert_to_version(checklist_id, seq):
+    """Write version `seq` back to the checklist, keeping step ids where possible
+    (instance steps refer to them). Returns the checklist's version number
+    afterwards, or None if there's no such version."""
+    from checklist_edit import ORDER_GAP
+    with DBConnection() as cursor:
+        state = _state_at(cursor, checklist_id, seq)
+        if state is None:
+            return None
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(f"""
+                UPDATE checklists SET {', '.join(f'{field} = ?' for field in FIELDS)}
+                WHERE id = ?
+            """, (*(state[field] for field in FIELDS), checklist_id))
+
+            cursor.execute("""
+                SELECT s.id, s.text, sr.url FROM steps s
+                LEFT JOIN step_references sr ON sr.step_id = s.id
+                WHERE s.checklist_id = ?
+            """, (checklist_id,))
+            existing = {row['id']: (row['text'], row['url']) for row in cursor.fetchall()}
+            wanted = {step[0] for step in state['steps']}
+            for step_id in existing.keys() - wanted:
+                cursor.execute("DELETE FROM step_references WHERE step_id = ?", (step_id,))
+                cursor.execute("DELETE FROM steps WHERE id = ?", (step_id,))
+
+            for i, (step_id, text, url) in enumerate(state['steps']):
+                order_index = (i + 1) * ORDER_GAP
+                if step_id in existing:
+                    cursor.execute("""
+                        UPDATE steps SET text = ?, order_index = ?
+                        WHERE id = ? AND (text IS NOT ? OR order_index IS NOT ?)
+                    """, (text, order_index, step_id, text, order_index))
+                    if existing[step_id][1] == url:
+                        continue
+                else:
+                    # Bring a deleted step back under its old id unless it's been reused
+                    cursor.execute("SELECT 1 FROM steps WHERE id = ?", (step_id,))
+                    cursor.execute("""
+                        INSERT INTO steps (id, checklist_id, text, status, order_index)
+                        VALUES (?, ?, ?, 'Not Started', ?)
+                    """, (None if cursor.fetchone() else step_id, checklist_id, text, order_index))
+                    step_id = cursor.lastrowid
+                if url:
+                    cursor.execute("""
+                        INSERT INTO step_references (step_id, url, type_id) VALUES (?, ?, 1)
+                        ON CONFLICT(step_id) DO UPDATE SET url = excluded.url
+                    """, (step_id, url))
+                else:
+                    cursor.execute("DELETE FROM step_references WHERE step_id = ?", (step_id,))
+            reverted = record_state(cursor, checklist_id, f"Reverted to version {seq}")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    return reverted or latest_version(checklist_id)
+
+def backfill_history(progress=print, batch_size=500):
+    """Record a first version for every checklist that has no history yet"""
+    with DBConnection() as cursor:
+        cursor.execute("""
+            SELECT id FROM checklists c
+            WHERE NOT EXISTS (SELECT 1 FROM checklist_history h WHERE h.checklist_id = c.id)
+        """)
+        checklist_ids = [row['id'] for row in cursor.fetchall()]
+    for i, checklist_id in enumerate(checklist_ids, 1):
+        with DBConnection() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # An edit may have recorded a first version since the query above
+                cursor.execute("SELECT 1 FROM checklist_history WHERE checklist_id = ? LIMIT 1", (checklist_id,))
+                if not cursor.fetchone():
+                    record_state(cursor, checklist_id, "Initial version")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        if i % batch_size == 0 or i == len(checklist_ids):
+            progress(f"checklist_history: recorded {i}/{len(checklist_ids)} checklists")
+
+
+# Rendering
+
+def render_history_rows(checklist_id, before=None):
+    versions, next_before = get_history(checklist_id, before)
+    latest = latest_version(checklist_id)
+    rows = [Tr(
+        Td(f"v{v.seq}"),
+        Td(v.summary or "", cls="uk-text-small"),
+        Td(v.created_at[:16].replace('T', ' '), cls="uk-text-meta"),
+        Td(
+            A("View", cls="uk-link-text uk-margin-small-right",
+              **{'hx-get': f'/checklist/{checklist_id}/history/{v.seq}',
+                 'hx-target': '#main-content',
+                 'hx-push-url': 'true'}),
+            A("Revert", cls="uk-link-text",
+              **{'hx-post': f'/checklist/{checklist_id}/history/{v.seq}/revert',
+                 'hx-confirm': f'Revert this checklist to version {v.seq}?',
+                 'hx-target': '#main-content'}) if v.seq != latest else "",
+            cls="uk-text-right"
+        )
+    ) for v in versions]
+    if next_before:
+        rows.append(Tr(
+            Td("Loading more...", colspan="4", cls="uk-text-muted uk-text-center"),
+            hx_get=f'/checklist/{checklist_id}/history/page?before={next_before}',
+            hx_trigger='revealed',
+            hx_swap='outerHTML'
+        ))
+    return rows
+
+def render_history(checklist_id):
+    return Div(
+        A("← Back to editing",
+          cls="uk-link-text",
+          **{'hx-get': f'/checklist/{checklist_id}/edit',
+             'hx-target': '#main-content',
+             'hx-push-url': 'true'}),
+        H2("Version history", cls="uk-heading-small"),
+        Table(
+            Thead(Tr(Th("Version"), Th("Change"), Th("When"), Th(""))),
+            Tbody(*render_history_rows(checklist_id)),
+            cls="uk-table uk-table-divider uk-table-small"
+        ),
+        cls="uk-container uk-margin-top",
+        id="main-content"
+    )
+
+def render_version(checklist_id, seq):
+    """Read-only view of an old version"""
+    state = get_version_state(checklist_id, seq)
+    if state is None:
+        return Div("Version not found", cls="uk-alert uk-alert-danger")
+    return Div(
+        A("← Back to history",
+          cls="uk-link-text",
+          **{'hx-get': f'/checklist/{checklist_id}/history',
+             'hx-target': '#main-content',
+             'hx-push-url': 'true'}),
+        H2(f"{state['title']} (v{seq})", cls="uk-heading-small"),
+        P(state['description'], cls="uk-text-meta"),
+        P(state['description_long']) if state['description_long'] else "",
+        Ol(*(Li(text, " ", A("Reference", href=url) if url else "")
+             for _, text, url in state['steps']), cls="uk-list uk-list-decimal"),
+        Button("Revert to this version",
+               cls="uk-button uk-button-default",
+               **{'hx-post': f'/checklist/{checklist_id}/history/{seq}/revert',
+                  'hx-confirm': f'Revert this checklist to version {seq}?',
+                  'hx-target': '#main-content'}),
+        cls="uk-container uk-margin-top",
+        id="main-content"
+    )
@@ -0,0 +1,214 @@
+"""Per-checklist and per-instance version counters.
+
+`checklists.version` is bumped by triggers whenever the checklist, one of its
+steps or a step reference changes, so anything derived from a checklist (rendered
+fragments, cached objects, ETags) can be keyed by (checklist id, version).
+Likewise `checklist_instances.version` is bumped when an instance or one of its
+steps changes, and `checklists.instances_version` when any of a checklist's
+instances is created, changed or deleted. The tag tree, which every edit page
+shows, has no counter; `get_tags_version` digests it instead."""
+import hashlib
+import sqlite3
+import threading
+
+from db_connection import DBConnection, DB_PATH
+
+VERSION_TRIGGERS = """
+    -- Seed new checklists with a microsecond timestamp so a re-used id never
+    -- repeats a (id, version) pair from a deleted checklist
+    CREATE TRIGGER IF NOT EXISTS checklists_version_insert
+    AFTER INSERT ON checklists
+    BEGIN
+        UPDATE checklists 
+        SET version = CAST((julianday('now') - 2440587.5) * 86400000000 AS INTEGER)
+        WHERE id = NEW.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS checklists_version_fields
+    AFTER UPDATE OF title, description, description_long ON checklists
+    BEGIN
+        UPDATE checklists SET version = COALESCE(version, 0) + 1 WHERE id = NEW.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS steps_version_insert
+    AFTER INSERT ON steps
+    BEGIN
+        UPDATE checklists SET version = COALESCE(version, 0) + 1 WHERE id = NEW.checklist_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS steps_version_update
+    AFTER UPDATE ON steps
+    BEGIN
+        UPDATE checklists SET version = COALESCE(version, 0) + 1 
+        WHERE id IN (NEW.checklist_id, OLD.checklist_id);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS steps_version_delete
+    AFTER DELETE ON steps
+    BEGIN
+        UPDATE checklists SET version = COALESCE(version, 0) + 1 WHERE id = OLD.checklist_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS step_references_version_insert
+    AFTER INSERT ON step_references
+    BEGIN
+        UPDATE checklists SET version = COALESCE(version, 0) + 1 
+        WHERE id = (SELECT checklist_id FROM steps WHERE id = NEW.step_id);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS step_references_version_update
+    AFTER UPDATE ON step_references
+    BEGIN
+        UPDATE checklists SET version = COALESCE(version, 0) + 1 
+        WHERE id = (SELECT checklist_id FROM steps WHERE id = NEW.step_id);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS step_references_version_delete
+    AFTER DELETE ON step_references
+    BEGIN
+        UPDATE checklists SET version = COALESCE(version, 0) + 1 
+        WHERE id = (SELECT checklist_id FROM steps WHERE id = OLD.step_id);
+    END;
+
+    -- Seeded like checklists.version, and the same for a re-used instance id
+    CREATE TRIGGER IF NOT EXISTS checklist_instances_version_insert
+    AFTER INSERT ON checklist_instances
+    BEGIN
+        UPDATE checklist_instances 
+        SET version = CAST((julianday('now') - 2440587.5) * 86400000000 AS INTEGER)
+        WHERE id = NEW.id;
+        UPDATE checklists SET instances_version = COALESCE(instances_version, 0) + 1 
+        WHERE id = NEW.checklist_id;
+    END;
+
+    -- Anything but a version bump (the progress counter triggers land here too)
+    CREATE TRIGGER IF NOT EXISTS checklist_instances_version_update
+    AFTER UPDATE ON checklist_instances
+    WHEN NEW.version IS OLD.version
+    BEGIN
+        UPDATE checklist_instances SET version = COALESCE(version, 0) + 1 WHERE id = NEW.id;
+        UPDATE checklists SET instances_version = COALESCE(instances_version, 0) + 1 
+        WHERE id IN (NEW.checklist_id, OLD.checklist_id);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS checklist_instances_version_delete
+    AFTER DELETE ON checklist_instances
+    BEGIN
+        UPDATE checklists SET instances_version = COALESCE(instances_version, 0) + 1 
+        WHERE id = OLD.checklist_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS instance_steps_version_update
+    AFTER UPDATE ON instance_steps
+    BEGIN
+        UPDATE checklist_instances SET version = COALESCE(version, 0) + 1 
+        WHERE id IN (NEW.instance_id, OLD.instance_id);
+    END;
+"""
+
+def ensure_version_triggers():
+    """Create the version triggers if missing.
+    Run at every startup: fast_app's schema transform rebuilds checklists/steps
+    (dropping their triggers) whenever the table config changes."""
+    with DBConnection() as cursor:
+        cursor.executescript(VERSION_TRIGGERS)
+        # Rows that predate the column (fast_app adds it without backfilling)
+        cursor.execute("UPDATE checklists SET version = 0 WHERE version IS NULL")
+        cursor.execute("UPDATE checklists SET instances_version = 0 WHERE instances_version IS NULL")
+
+class VersionWatcher:
+    """Remembers version counters until something commits to the database.
+
+    `PRAGMA data_version` on a dedicated, read-only connection changes whenever
+    any other connection (in this process or another worker) commits, so while
+    it is unchanged the remembered versions are still current and no query is
+    needed. `generation` counts the commits observed, for caches that only need
+    to know "has anything changed"."""
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.generation = 0
+        self._conn = None
+        self._data_version = None
+        self._known = {}
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._known.clear()
+            self.generation += 1
+        return self.generation
+
+    def current_generation(self):
+        with self._lock:
+            return self._refresh()
+
+    def _lookup(self, key, query, params):
+        """The row `query` returns as a tuple (None if no row), remembered under `key`"""
+        with self._lock:
+            generation = self._refresh()
+            if key in self._known:
+                return self._known[key]
+        with DBConnection(self.db_path) as cursor:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+            value = tuple(row) if row else None
+        with self._lock:
+            # Only remember it if nothing committed in between
+            if self.generation == generation:
+                self._known[key] = value
+        return value
+
+    def checklist_version(self, checklist_id):
+        row = self._lookup(('checklist', checklist_id),
+                           "SELECT version FROM checklists WHERE id = ?", (checklist_id,))
+        return row[0] if row else None
+
+    def instances_version(self, checklist_id):
+        """(checklist version, instances_version), or None if the checklist doesn't exist"""
+        return self._lookup(('instances', checklist_id),
+                            "SELECT version, instances_version FROM checklists WHERE id = ?",
+                            (checklist_id,))
+
+    def instance_version(self, instance_id):
+        """(checklist id, checklist version, instance version), or None if the instance doesn't exist"""
+        return self._lookup(('instance', instance_id), """
+            SELECT c.id, c.version, ci.version
+            FROM checklist_instances ci
+            JOIN checklists c ON ci.checklist_id = c.id
+            WHERE ci.id = ?
+        """, (instance_id,))
+
+    def tags_version(self):
+        """Every tag's id and path, in one string ('' if there are no tags)"""
+        return self._lookup(('tags',), """
+            SELECT COALESCE(group_concat(id || ':' || path, ','), '')
+            FROM (SELECT id, path FROM tags ORDER BY id)
+        """, ())[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn, self._data_version = None, None
+            self._known.clear()
+
+
+watcher = VersionWatcher()
+
+def get_checklist_version(checklist_id):
+    """Current version of a checklist, or None if it doesn't exist"""
+    return watcher.checklist_version(checklist_id)
+
+def get_instances_version(checklist_id):
+    return watcher.instances_version(checklist_id)
+
+def get_instance_version(instance_id):
+    return watcher.instance_version(instance_id)
+
+def get_tags_version():
+    """Short digest of the tag tree; changes when a tag is added or deleted"""
+    return hashlib.sha256(watcher.tags_version().encode()).hexdigest()[:10]